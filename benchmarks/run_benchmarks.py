@@ -0,0 +1,368 @@
+# =============================================================================
+# run_benchmarks.py
+#
+# Time the hot kernels of post-processing and verification on synthetic WRF-like
+# ensembles and observation grids (see synthetic.py), and append the results to a JSON
+# lines file so regressions can be tracked across commits. Each result records the
+# commit, grid size, minimum and median time over repeated runs, peak memory traced by
+# tracemalloc in a separate run (memory allocated by Fortran extensions is not traced),
+# and throughput in grid points per second.
+#
+# Benchmarks whose dependencies are not installed are skipped.
+#
+# Usage
+# -----
+#   python benchmarks/run_benchmarks.py --nmem 42 --ny 400 --nx 500 --nz 50
+#   python benchmarks/run_benchmarks.py nmep fss --repeat 10
+# =============================================================================
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import synthetic
+
+DIR_REPO = Path(__file__).resolve().parents[1]
+
+# verify/ goes first, since both directories have neighborhood.py and gridrad.py
+sys.path[1:1] = [str(DIR_REPO / "verify"), str(DIR_REPO / "post")]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    A benchmark function takes the parsed command line arguments and a scratch
+    directory, and returns a tuple (setup, run, npoints). `setup` is called before each
+    run without being timed and returns the arguments of `run`, and `npoints` is the
+    number of grid points processed by one call of `run`.
+    """
+
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+@benchmark("nmep")
+def bench_nmep(args, workdir):
+    import probcalc_numpy
+
+    field = synthetic.ensemble_field(args.nmem, args.ny, args.nx)
+
+    def run(field):
+        return probcalc_numpy.nmep(field, 32.0, 40.0)
+
+    return (lambda: (field,)), run, field.size
+
+
+@benchmark("exceedance")
+def bench_exceedance(args, workdir):
+    import exceedance
+
+    field = synthetic.ensemble_field(args.nmem, args.ny, args.nx)
+
+    def run(field):
+        return exceedance.pack(exceedance.exceedance(field, 40.0, 32.0))
+
+    return (lambda: (field,)), run, field.size
+
+
+@benchmark("nmep_subsets")
+def bench_nmep_subsets(args, workdir):
+    import exceedance
+
+    field = synthetic.ensemble_field(args.nmem, args.ny, args.nx)
+    packed = exceedance.pack(exceedance.exceedance(field, 40.0, 32.0))
+    subsets = exceedance.random_subsets(args.nmem, args.nmem // 2, 100, seed=0)
+
+    def run(packed):
+        return exceedance.nmep_subsets(packed, args.nmem, subsets)
+
+    return (lambda: (packed,)), run, subsets.shape[0] * args.ny * args.nx
+
+
+@benchmark("nep")
+def bench_nep(args, workdir):
+    import exceedance
+
+    field = synthetic.ensemble_field(args.nmem, args.ny, args.nx)
+
+    def run(field):
+        return exceedance.nep(field, 40.0, [32.0, 64.0, 96.0])
+
+    return (lambda: (field,)), run, field.size
+
+
+@benchmark("neighbor_prob")
+def bench_neighbor_prob(args, workdir):
+    import neighborhood
+
+    st4 = synthetic.stage4_grid(args.ny, args.nx)
+    # Observations on a 4.7 km grid and forecast points on a 3 km grid, in meters
+    obs_y, obs_x = np.mgrid[0 : args.ny, 0 : args.nx] * 4762.5
+    wrf_y, wrf_x = np.mgrid[
+        0 : args.ny * 4762.5 : 3000.0, 0 : args.nx * 4762.5 : 3000.0
+    ]
+    points = np.vstack((obs_y.flatten(), obs_x.flatten())).T
+    xi = np.vstack((wrf_y.flatten(), wrf_x.flatten())).T
+    values = (st4.tp.values >= 2.54).astype(float).flatten()
+    query = neighborhood.build_query(points, xi, 32186.9)
+
+    return (lambda: (xi, values, query)), neighborhood.neighbor_prob, xi.shape[0]
+
+
+@benchmark("remove_clutter")
+def bench_remove_clutter(args, workdir):
+    import gridrad
+
+    data = synthetic.gridrad_data(args.ny, args.nx, args.nz)
+
+    def run(data):
+        return gridrad.remove_clutter(data)
+
+    return (lambda: (deepcopy(data),)), run, args.nz * args.ny * args.nx
+
+
+@benchmark("isosurface_interpolation")
+def bench_isosurface(args, workdir):
+    import metpy.interpolate as mpinterp
+    from metpy.units import units
+
+    ds = synthetic.wrf_dataset(args.ny, args.nx, args.nz).sel(Time=0)
+    p = (ds.PB + ds.P).values * units.Pa
+    t = (ds.T + ds.T00).values * units.K
+    levels = np.array([850.0, 700.0, 500.0, 300.0]) * units.hPa
+
+    def run(p, t):
+        return [mpinterp.interpolate_to_isosurface(p, t, level) for level in levels]
+
+    return (lambda: (p, t)), run, args.nz * args.ny * args.nx
+
+
+@benchmark("interpolate_to_pressure")
+def bench_interpolate_to_pressure(args, workdir):
+    import diagnostics
+
+    ds = synthetic.wrf_dataset(args.ny, args.nx, args.nz).sel(Time=0)
+    p = (ds.PB + ds.P).values
+    fields = {name: ds[name].values for name in ("T", "QVAPOR", "REFL_10CM", "PB", "P")}
+    levels = np.array([85000.0, 70000.0, 50000.0, 30000.0])
+
+    def run(p, fields):
+        return diagnostics.interpolate_to_pressure(p, fields, levels)
+
+    return (lambda: (p, fields)), run, args.nz * args.ny * args.nx
+
+
+@benchmark("slp")
+def bench_slp(args, workdir):
+    import diagnostics
+    import wrf_ens_tools.post as wrfpost
+
+    members = [
+        synthetic.wrf_dataset(args.ny, args.nx, args.nz, seed=mem).sel(Time=0)
+        for mem in range(args.nmem)
+    ]
+    p = np.stack([(ds.PB + ds.P).values for ds in members])
+    t = np.stack([(ds.T + ds.T00).values for ds in members]) * (p / 1.0e5) ** 0.2857
+    z = (
+        np.stack([wrfpost.destagger(ds.PHB.values + ds.PH.values, 0) for ds in members])
+        / 9.81
+    )
+    qv = np.stack([ds.QVAPOR.values for ds in members])
+
+    return (lambda: (z, t, p, qv)), diagnostics.slp, p.size
+
+
+@benchmark("earth_relative_winds")
+def bench_earth_relative_winds(args, workdir):
+    import diagnostics
+
+    ds = synthetic.wrf_dataset(args.ny, args.nx, args.nz).sel(Time=0)
+    winds = diagnostics.EarthRelativeWinds(ds)
+    u = ds.U.values
+    v = ds.V.values
+
+    return (lambda: (u, v)), winds.destagger_rotate, args.nz * args.ny * args.nx
+
+
+@benchmark("reliability")
+def bench_reliability(args, workdir):
+    import probabilistic_verification
+    from metpy.units import units
+
+    fcst, obs = synthetic.probability_fields(args.ny, args.nx)
+    fcst = fcst * units.percent
+    obs = obs * units.percent
+    bins = (
+        np.array([5.0, 15.0, 25.0, 35.0, 45.0, 55.0, 65.0, 75.0, 85.0, 95.0, 100.0])
+        * units.percent
+    )
+
+    def run(fcst, obs):
+        return probabilistic_verification.reliability(fcst, obs, bins)
+
+    return (lambda: (fcst, obs)), run, fcst.size
+
+
+@benchmark("fss")
+def bench_fss(args, workdir):
+    import probabilistic_verification
+    from metpy.units import units
+
+    fcst, obs = synthetic.probability_fields(args.ny, args.nx)
+    fcst = fcst * units.percent
+    obs = obs * units.percent
+
+    def run(fcst, obs):
+        return probabilistic_verification.fss(fcst, obs, return_fbs=True)
+
+    return (lambda: (fcst, obs)), run, fcst.size
+
+
+@benchmark("wrf_post")
+def bench_wrf_post(args, workdir):
+    import wrf_post
+
+    directory = Path(workdir) / "wrf_post" / "2016042700"
+    path_ref = synthetic.write_wrf_ensemble(
+        directory, args.nmem, args.ny, args.nx, args.nz, [11, 12]
+    )
+    argv = [
+        "wrf_post.py",
+        str(directory),
+        "2016042700",
+        "12",
+        str(args.nmem),
+        "2",
+        "--path_ref",
+        path_ref,
+        "--path_save",
+        str(Path(workdir) / "wrf_post" / "out"),
+    ]
+
+    def run():
+        argv_orig = sys.argv
+        sys.argv = argv
+        try:
+            wrf_post.main()
+        finally:
+            sys.argv = argv_orig
+
+    return (lambda: ()), run, args.nmem * args.nz * args.ny * args.nx
+
+
+def git_commit():
+    """Return the commit hash of the repository, or None if it is unknown."""
+    try:
+        result = subprocess.run(
+            ["git", "-C", str(DIR_REPO), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def time_benchmark(setup, run, repeat):
+    """Return the run times in seconds and the peak traced memory in bytes."""
+    times = []
+    for _ in range(repeat):
+        inputs = setup()
+        start = time.perf_counter()
+        run(*inputs)
+        times.append(time.perf_counter() - start)
+
+    inputs = setup()
+    tracemalloc.start()
+    run(*inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark post-processing and verification kernels"
+    )
+    parser.add_argument(
+        "benchmarks",
+        type=str,
+        nargs="*",
+        default=[],
+        help=f"Benchmarks to run: {', '.join(BENCHMARKS)}. Default is all benchmarks",
+    )
+    parser.add_argument("--nmem", type=int, default=10, help="Ensemble members")
+    parser.add_argument("--ny", type=int, default=200, help="Grid points in y")
+    parser.add_argument("--nx", type=int, default=250, help="Grid points in x")
+    parser.add_argument("--nz", type=int, default=40, help="Vertical levels")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs of each benchmark"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=str(DIR_REPO / "benchmarks" / "results.jsonl"),
+        help="JSON lines file to append results to",
+    )
+
+    args = parser.parse_args()
+    benchmarks = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    size = {"nmem": args.nmem, "ny": args.ny, "nx": args.nx, "nz": args.nz}
+    common = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in benchmarks:
+            try:
+                setup, run, npoints = BENCHMARKS[name](args, workdir)
+            except ImportError as err:
+                print(f"Skipping {name}: {err}")
+                continue
+
+            times, peak = time_benchmark(setup, run, args.repeat)
+            result = dict(common, benchmark=name, **size)
+            result.update(
+                repeat=args.repeat,
+                time_min=min(times),
+                time_median=statistics.median(times),
+                peak_memory=peak,
+                npoints=npoints,
+                throughput=npoints / min(times),
+            )
+            results.append(result)
+            print(
+                f"{name:<26} {min(times):>10.4f} s {peak / 1e6:>10.1f} MB "
+                f"{result['throughput']:>12.4g} points/s"
+            )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print(f"Appended {len(results)} results to {args.output}")
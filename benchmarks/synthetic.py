@@ -0,0 +1,233 @@
+# =============================================================================
+# synthetic.py
+#
+# Generate synthetic WRF-like ensembles and GridRad/Stage IV-like observation grids
+# of any size for benchmarks. Fields have realistic ranges and vertical structure, so
+# diagnostics such as sea level pressure and isobaric interpolation follow the same
+# code paths as for real forecasts, but are otherwise random.
+# =============================================================================
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+WRF_DATE_FMT = "%Y-%m-%d_%H:%M:%S"
+
+
+def wrf_dataset(ny, nx, nz, seed=0, hour=0):
+    """Return a dataset with the variables of a WRF output file used in post-processing.
+
+    Parameters
+    ----------
+    ny, nx, nz : int
+        Number of unstaggered grid points in y, x, and the vertical.
+    seed : int (optional)
+        Seed of random perturbations, e.g. the member number. Default is 0.
+    hour : int (optional)
+        Forecast hour, which scales accumulated precipitation. Default is 0.
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with a single time.
+    """
+    rng = np.random.default_rng(seed * 1000 + hour)
+    dims_3d = ["bottom_top", "south_north", "west_east"]
+    dims_2d = ["south_north", "west_east"]
+    shape_3d = (nz, ny, nx)
+    shape_2d = (ny, nx)
+    eta = np.linspace(0.0, 1.0, nz)[:, None, None]
+    eta_stag = np.linspace(0.0, 1.0, nz + 1)[:, None, None]
+
+    data_vars = {
+        "PB": (dims_3d, np.broadcast_to(100000.0 - 90000.0 * eta, shape_3d), "Pa"),
+        "P": (dims_3d, rng.normal(0.0, 200.0, shape_3d), "Pa"),
+        "PHB": (
+            ["bottom_top_stag", "south_north", "west_east"],
+            np.broadcast_to(160000.0 * eta_stag, (nz + 1, ny, nx)),
+            "m2 s-2",
+        ),
+        "PH": (
+            ["bottom_top_stag", "south_north", "west_east"],
+            rng.normal(0.0, 50.0, (nz + 1, ny, nx)),
+            "m2 s-2",
+        ),
+        "T": (dims_3d, 10.0 + 60.0 * eta + rng.normal(0.0, 1.0, shape_3d), "K"),
+        "QVAPOR": (
+            dims_3d,
+            0.012
+            * np.exp(-5.0 * eta)
+            * np.clip(1.0 + 0.1 * rng.normal(size=shape_3d), 0.5, 1.5),
+            "kg kg-1",
+        ),
+        "U": (
+            ["bottom_top", "south_north", "west_east_stag"],
+            rng.normal(5.0, 5.0, (nz, ny, nx + 1)),
+            "m s-1",
+        ),
+        "V": (
+            ["bottom_top", "south_north_stag", "west_east"],
+            rng.normal(0.0, 5.0, (nz, ny + 1, nx)),
+            "m s-1",
+        ),
+        "REFL_10CM": (dims_3d, rng.normal(10.0, 15.0, shape_3d), "dBZ"),
+        "T2": (dims_2d, 295.0 + rng.normal(0.0, 2.0, shape_2d), "K"),
+        "PSFC": (dims_2d, 100000.0 + rng.normal(0.0, 300.0, shape_2d), "Pa"),
+        "Q2": (dims_2d, 0.01 + 0.001 * rng.normal(size=shape_2d), "kg kg-1"),
+        "U10": (dims_2d, rng.normal(size=shape_2d), "m s-1"),
+        "V10": (dims_2d, rng.normal(size=shape_2d), "m s-1"),
+        "RAINNC": (dims_2d, hour * np.abs(rng.normal(size=shape_2d)), "mm"),
+        "RAINC": (dims_2d, 0.1 * hour * np.abs(rng.normal(size=shape_2d)), "mm"),
+        "UP_HELI_MAX": (dims_2d, np.abs(rng.normal(0.0, 30.0, shape_2d)), "m2 s-2"),
+        "SINALPHA": (dims_2d, np.full(shape_2d, 0.1), ""),
+        "COSALPHA": (dims_2d, np.full(shape_2d, np.sqrt(0.99)), ""),
+        "XLAT": (
+            dims_2d,
+            np.broadcast_to(np.linspace(25.0, 45.0, ny)[:, None], shape_2d),
+            "degree_north",
+        ),
+        "XLONG": (
+            dims_2d,
+            np.broadcast_to(np.linspace(-110.0, -85.0, nx)[None, :], shape_2d),
+            "degree_east",
+        ),
+    }
+
+    ds = xr.Dataset(
+        {
+            name: (["Time"] + dims, values[None].astype("float32"), {"units": unit})
+            for name, (dims, values, unit) in data_vars.items()
+        }
+    )
+    ds["T00"] = (["Time"], np.array([290.0], dtype="float32"))
+    ds.attrs.update(DX=3000.0, DY=3000.0, TRUELAT1=30.0, TRUELAT2=60.0, STAND_LON=-98.0)
+    return ds
+
+
+def write_wrf_ensemble(directory, nmem, ny, nx, nz, hours, init="2016042700", domain=2):
+    """Write a synthetic ensemble of WRF output files laid out like a forecast directory.
+
+    Files are written as <directory>/mem<n>/wrf/wrfout_d0<domain>_<date>, along with a
+    reference file <directory>/wrfoutREFd0<domain>.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Forecast directory to write files to.
+    nmem : int
+        Number of ensemble members.
+    ny, nx, nz : int
+        Number of unstaggered grid points in y, x, and the vertical.
+    hours : list of int
+        Forecast hours to write.
+    init : str (optional)
+        Initialization date (YYYYMMDDHH). Default is "2016042700".
+    domain : int (optional)
+        WRF domain number in file names. Default is 2.
+
+    Returns
+    -------
+    str
+        Path of the reference file.
+    """
+    init = pd.to_datetime(init, format="%Y%m%d%H")
+    for mem in range(1, nmem + 1):
+        dir_wrf = os.path.join(directory, f"mem{mem}", "wrf")
+        os.makedirs(dir_wrf, exist_ok=True)
+        for hour in hours:
+            date = (init + pd.Timedelta(hour, unit="hour")).strftime(WRF_DATE_FMT)
+            wrf_dataset(ny, nx, nz, seed=mem, hour=hour).to_netcdf(
+                os.path.join(dir_wrf, f"wrfout_d0{domain}_{date}")
+            )
+
+    path_ref = os.path.join(directory, f"wrfoutREFd0{domain}")
+    wrf_dataset(ny, nx, nz).to_netcdf(path_ref)
+    return path_ref
+
+
+def ensemble_field(nmem, ny, nx, seed=0):
+    """Return an ensemble of 2-D reflectivity-like fields with storm-like features.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 values in dBZ with shape (nmem, ny, nx).
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:ny, 0:nx]
+    fields = np.full((nmem, ny, nx), -10.0, dtype="float32")
+    nstorms = max(1, ny * nx // 2000)
+    for mem in range(nmem):
+        for cy, cx, size in zip(
+            rng.uniform(0, ny, nstorms),
+            rng.uniform(0, nx, nstorms),
+            rng.uniform(2.0, 8.0, nstorms),
+        ):
+            storm = 55.0 * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2.0 * size**2))
+            np.maximum(fields[mem], storm, out=fields[mem])
+    return fields
+
+
+def probability_fields(ny, nx, seed=0):
+    """Return forecast and observed probability fields in percent.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Forecast and observed probabilities with shape (ny, nx).
+    """
+    refl = ensemble_field(2, ny, nx, seed)
+    fcst = np.clip(refl[0] * 2.0, 0.0, 100.0)
+    obs = np.clip(refl[1] * 2.0, 0.0, 100.0)
+    return fcst, obs
+
+
+def gridrad_data(ny, nx, nz, seed=0):
+    """Return a dictionary structured like GridRad data returned by `gridrad.read_file`.
+
+    Parameters
+    ----------
+    ny, nx, nz : int
+        Number of grid points in latitude, longitude, and altitude.
+
+    Returns
+    -------
+    dict
+    """
+    rng = np.random.default_rng(seed)
+    altitude = np.linspace(1.0, 24.0, nz)
+    refl = ensemble_field(1, ny, nx, seed)[0]
+    values = refl[None] * np.exp(-altitude / 8.0)[:, None, None]
+    values = values + rng.normal(0.0, 2.0, (nz, ny, nx))
+    values[values < 0.0] = np.nan
+    # Speckles of isolated echo for clutter removal to find
+    speckles = rng.random((nz, ny, nx)) < 0.01
+    values[speckles] = rng.uniform(5.0, 30.0, speckles.sum())
+
+    return {
+        "x": {"n": nx, "values": np.linspace(235.0, 295.0, nx)},
+        "y": {"n": ny, "values": np.linspace(24.0, 50.0, ny)},
+        "z": {"n": nz, "values": altitude},
+        "Z_H": {"values": values},
+    }
+
+
+def stage4_grid(ny, nx, seed=0):
+    """Return Stage IV-like 1-hour precipitation in mm on a regular lat-lon grid.
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with precipitation `tp` and 2-D `latitude` and `longitude`.
+    """
+    precip = np.clip(ensemble_field(1, ny, nx, seed)[0] / 2.0, 0.0, None)
+    lon, lat = np.meshgrid(np.linspace(-125.0, -67.0, nx), np.linspace(24.0, 50.0, ny))
+    return xr.Dataset(
+        {
+            "tp": (["y", "x"], precip, {"units": "mm"}),
+            "latitude": (["y", "x"], lat),
+            "longitude": (["y", "x"], lon),
+        }
+    )
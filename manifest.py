@@ -0,0 +1,415 @@
+# =============================================================================
+# manifest.py
+#
+# Index the files of ensemble experiments in a SQLite manifest, so scripts can find
+# files with a single query instead of globbing directories or checking several
+# possible file names, each of which is a metadata round trip on Lustre.
+#
+# A directory tree is crawled once, after which only directories whose modification
+# time changed are rescanned. Creating, deleting, or renaming a file updates the
+# modification time of its directory, but rewriting a file in place does not, so use
+# --full to re-stat every file after files are overwritten.
+#
+# Files are recorded with metadata parsed from their path relative to the crawled root,
+# which is expected to be laid out as <root>/<experiment>/<init>/[mem<n>/...]<file>:
+#
+#   experiment : directories before the initialization directory, e.g. 'recenter'
+#   init       : initialization directory (YYYYMMDDHH)
+#   member     : member number of a 'mem<n>' directory
+#   domain     : WRF domain of wrfout, wrfinput, reduced, and derived files
+#   hour       : forecast hour of WRF output and post-processed files
+#   kind       : wrfout, reduced, derived, wrfinput, convective, exceedance, surface,
+#                upper, or time_neighborhood
+#
+# Usage
+# -----
+#   python manifest.py update manifest.sqlite /lustre/scratch/rmanser --only recenter
+#   python manifest.py missing manifest.sqlite recenter 2016050100 --hour 48
+# =============================================================================
+
+import argparse
+import os
+import re
+import sqlite3
+from datetime import datetime
+from functools import lru_cache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    experiment TEXT,
+    init TEXT,
+    member INTEGER,
+    domain INTEGER,
+    hour INTEGER,
+    kind TEXT,
+    compressed INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_forecast ON files (experiment, init, hour);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+COLUMNS = [
+    "path",
+    "directory",
+    "experiment",
+    "init",
+    "member",
+    "domain",
+    "hour",
+    "kind",
+    "compressed",
+    "size",
+    "mtime",
+]
+
+# File name patterns of each kind of file, in the order they are matched
+PATTERNS = [
+    (
+        "derived",
+        re.compile(r"^wrfout_d0(?P<domain>\d)_derived_(?P<date>[0-9_:-]{19})\.nc$"),
+    ),
+    (
+        "reduced",
+        re.compile(r"^wrfout_d0(?P<domain>\d)_red_(?P<date>[0-9_:-]{19})(\.gz)?$"),
+    ),
+    ("wrfout", re.compile(r"^wrfout_d0(?P<domain>\d)_(?P<date>[0-9_:-]{19})(\.gz)?$")),
+    ("wrfinput", re.compile(r"^wrfinput_d0(?P<domain>\d)(\.gz)?$")),
+    (
+        "post",
+        re.compile(
+            r"^(?P<kind>convective|exceedance|surface|upper|time_neighborhood)"
+            r"_f(?P<hour>\d+)\.nc$"
+        ),
+    ),
+]
+
+_INIT = re.compile(r"^\d{10}$")
+_MEMBER = re.compile(r"^mem(\d+)$")
+
+
+@lru_cache(maxsize=None)
+def _lead_hours(init, date):
+    """Return the number of hours between an initialization and a WRF file date."""
+    lead = datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") - datetime.strptime(
+        init, "%Y%m%d%H"
+    )
+    return int(lead.total_seconds() // 3600)
+
+
+def parse_path(relpath):
+    """Parse ensemble metadata from a file path relative to a crawled root.
+
+    Parameters
+    ----------
+    relpath : str
+        Path of a file relative to the root of an experiment tree.
+
+    Returns
+    -------
+    dict
+        Experiment, init, member, domain, hour, kind, and compressed. Values that
+        cannot be parsed from the path are None.
+    """
+    parts = relpath.split(os.sep)
+    dirs, name = parts[:-1], parts[-1]
+    info = {
+        "experiment": None,
+        "init": None,
+        "member": None,
+        "domain": None,
+        "hour": None,
+        "kind": None,
+        "compressed": name.endswith(".gz"),
+    }
+
+    i_init = next((i for i, d in enumerate(dirs) if _INIT.match(d)), len(dirs))
+    if i_init > 0:
+        info["experiment"] = "/".join(dirs[:i_init])
+    if i_init < len(dirs):
+        info["init"] = dirs[i_init]
+    for d in dirs[i_init + 1 :]:
+        match = _MEMBER.match(d)
+        if match is not None:
+            info["member"] = int(match.group(1))
+
+    for kind, pattern in PATTERNS:
+        match = pattern.match(name)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        info["kind"] = groups.get("kind", kind)
+        if "domain" in groups:
+            info["domain"] = int(groups["domain"])
+        if "hour" in groups:
+            info["hour"] = int(groups["hour"])
+        elif "date" in groups and info["init"] is not None:
+            info["hour"] = _lead_hours(info["init"], groups["date"])
+        elif kind == "wrfinput":
+            info["hour"] = 0
+        break
+
+    return info
+
+
+class Manifest:
+    """SQLite index of the files in ensemble experiment directory trees.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the SQLite database, which is created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(os.fspath(path), timeout=60.0)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Commit any changes and close the database."""
+        self.conn.commit()
+        self.conn.close()
+
+    def update(self, root, only=None, full=False):
+        """Crawl a directory tree and update the manifest with its files.
+
+        Parameters
+        ----------
+        root : str or pathlib.Path
+            Root of the tree, relative to which experiment metadata are parsed.
+        only : list of str (optional)
+            Subdirectories of `root` to crawl, e.g. experiment names. Default is to
+            crawl all of `root`.
+        full : bool (optional)
+            Re-stat files in every directory, not only in directories that changed
+            since the last update. Default is False.
+
+        Returns
+        -------
+        tuple of int
+            Number of files added or updated and number of files removed.
+        """
+        root = os.path.abspath(root)
+        if only is None:
+            tops = [root]
+        else:
+            tops = [os.path.join(root, subdir) for subdir in only]
+
+        known = {}
+        for top in tops:
+            known.update(
+                self.conn.execute(
+                    "SELECT path, mtime FROM directories "
+                    "WHERE path = ? OR (path >= ? AND path < ?)",
+                    (top, top + "/", top + "0"),
+                )
+            )
+
+        nupdated = 0
+        nremoved = 0
+        seen = set()
+        stack = list(tops)
+        with self.conn:
+            while stack:
+                directory = stack.pop()
+                try:
+                    dir_mtime = os.stat(directory).st_mtime
+                    entries = list(os.scandir(directory))
+                except FileNotFoundError:
+                    continue
+                seen.add(directory)
+
+                # Subdirectories are always listed, but files are only stat'ed if the
+                # directory changed
+                changed = full or known.get(directory) != dir_mtime
+                rows = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif changed:
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        info = parse_path(os.path.relpath(entry.path, root))
+                        rows.append(
+                            (entry.path, directory)
+                            + tuple(info[col] for col in COLUMNS[2:9])
+                            + (stat.st_size, stat.st_mtime)
+                        )
+                if not changed:
+                    continue
+
+                indexed = {
+                    path
+                    for path, in self.conn.execute(
+                        "SELECT path FROM files WHERE directory = ?", (directory,)
+                    )
+                }
+                removed = indexed - {row[0] for row in rows}
+                self.conn.executemany(
+                    "DELETE FROM files WHERE path = ?", [(p,) for p in removed]
+                )
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO files VALUES ({', '.join('?' * 11)})",
+                    rows,
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO directories VALUES (?, ?)",
+                    (directory, dir_mtime),
+                )
+                nupdated += len(rows)
+                nremoved += len(removed)
+
+            # Forget directories that no longer exist
+            for directory in set(known) - seen:
+                nremoved += self.conn.execute(
+                    "DELETE FROM files WHERE directory = ?", (directory,)
+                ).rowcount
+                self.conn.execute(
+                    "DELETE FROM directories WHERE path = ?", (directory,)
+                )
+
+        return nupdated, nremoved
+
+    def paths(self, directory):
+        """Return the set of indexed file paths under a directory."""
+        directory = os.path.abspath(directory)
+        return {
+            path
+            for path, in self.conn.execute(
+                "SELECT path FROM files WHERE path >= ? AND path < ?",
+                (directory + "/", directory + "0"),
+            )
+        }
+
+    def files(self, **conditions):
+        """Return indexed files whose columns equal the given values.
+
+        Parameters
+        ----------
+        **conditions
+            Column names and values to select files by, e.g. experiment="recenter",
+            kind="convective". A value of None selects files where the column is null.
+
+        Returns
+        -------
+        list of dict
+            Columns of each selected file, ordered by path.
+        """
+        clauses = []
+        values = []
+        for col, value in conditions.items():
+            if col not in COLUMNS:
+                raise ValueError(f"Unknown manifest column {col}")
+            if value is None:
+                clauses.append(f"{col} IS NULL")
+            else:
+                clauses.append(f"{col} = ?")
+                values.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM files {where} ORDER BY path", values
+        )
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def mtimes(self):
+        """Return the modification time of every indexed file keyed by path."""
+        return dict(self.conn.execute("SELECT path, mtime FROM files"))
+
+    def missing_members(self, experiment, init, nmem, hour, domain=2, kind="wrfout"):
+        """Return members without a file of some kind for a forecast hour.
+
+        Returns
+        -------
+        list of int
+            Member numbers from 1 to `nmem` without a matching file.
+        """
+        found = {
+            mem
+            for mem, in self.conn.execute(
+                "SELECT DISTINCT member FROM files WHERE experiment = ? AND init = ? "
+                "AND hour = ? AND domain = ? AND kind = ?",
+                (experiment, init, hour, domain, kind),
+            )
+        }
+        return [mem for mem in range(1, nmem + 1) if mem not in found]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index ensemble files in a SQLite manifest"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_update = subparsers.add_parser(
+        "update", help="Crawl directory trees and update the manifest"
+    )
+    parser_update.add_argument("path_manifest", type=str, help="SQLite manifest")
+    parser_update.add_argument(
+        "roots", type=str, nargs="+", help="Parent directories of experiments"
+    )
+    parser_update.add_argument(
+        "--only",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Subdirectories of each root to crawl, e.g. experiment/init",
+    )
+    parser_update.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-stat every file, e.g. after files were overwritten in place",
+    )
+
+    parser_missing = subparsers.add_parser(
+        "missing", help="Print members missing a file for a forecast hour"
+    )
+    parser_missing.add_argument("path_manifest", type=str, help="SQLite manifest")
+    parser_missing.add_argument("experiment", type=str, help="Ensemble experiment")
+    parser_missing.add_argument(
+        "init", type=str, help="Initialization date (YYYYMMDDHH)"
+    )
+    parser_missing.add_argument(
+        "--nmem", type=int, default=42, help="Number of ensemble members"
+    )
+    parser_missing.add_argument("--hour", type=int, default=48, help="Forecast hour")
+    parser_missing.add_argument("--domain", type=int, default=2, help="WRF domain")
+    parser_missing.add_argument(
+        "--kind",
+        type=str,
+        default="wrfout",
+        choices=["wrfout", "reduced", "derived", "wrfinput"],
+        help="Kind of file to look for",
+    )
+
+    args = parser.parse_args()
+
+    with Manifest(args.path_manifest) as index:
+        if args.command == "update":
+            for root in args.roots:
+                nupdated, nremoved = index.update(root, args.only, args.full)
+                print(f"{root}: updated {nupdated} files, removed {nremoved} files")
+        else:
+            missing = index.missing_members(
+                args.experiment,
+                args.init,
+                args.nmem,
+                args.hour,
+                args.domain,
+                args.kind,
+            )
+            print(" ".join(str(mem) for mem in missing))
@@ -0,0 +1,720 @@
+# =============================================================================
+# diagnostics.py
+# -----------------------------------------------------------------------------
+# Calculate the 2-D surface, upper air, and convective fields that are
+# post-processed from a single WRF member file. These are used by wrf_post.py,
+# and may also be calculated while WRF output is reduced (see
+# run_ensemble/util/reduce_wrf.py --derive) and stored in a derived file next
+# to the reduced file, so post-processing does not need to read 3-D fields.
+# =============================================================================
+
+import logging
+from pathlib import Path
+
+import metpy.calc as mpcalc
+import metpy.constants as mpconsts
+import metpy.interpolate as mpinterp
+import fastunits
+import numpy as np
+import profiling
+import wrf_ens_tools.post as wrfpost
+import xarray as xr
+from metpy.units import units
+
+log = logging.getLogger(__name__)
+
+SURFACE_NAMES = [
+    "temperature_2_meter",
+    "u_wind_component_10_meter",
+    "v_wind_component_10_meter",
+    "wind_speed_10_meter",
+    "mean_sea_level_pressure",
+    "dewpoint_temperature_2_meter",
+]
+
+UPPER_NAMES = [
+    "temperature",
+    "u_wind_component",
+    "v_wind_component",
+    "wind_speed",
+    "geopotential_height",
+    "dewpoint_temperature",
+]
+
+CONVECTIVE_NAMES = [
+    "accumulated_precipitation",
+    "reflectivity",
+    "updraft_helicity",
+]
+
+# Units of fields passed between diagnostics and wrf_post.py as arrays without units
+FIELD_UNITS = {
+    "temperature_2_meter": "kelvin",
+    "u_wind_component_10_meter": "meter / second",
+    "v_wind_component_10_meter": "meter / second",
+    "wind_speed_10_meter": "meter / second",
+    "mean_sea_level_pressure": "hectopascal",
+    "dewpoint_temperature_2_meter": "degree_Celsius",
+    "temperature": "kelvin",
+    "u_wind_component": "meter / second",
+    "v_wind_component": "meter / second",
+    "wind_speed": "meter / second",
+    "geopotential_height": "meter",
+    "dewpoint_temperature": "kelvin",
+    "accumulated_precipitation": "millimeter",
+    "reflectivity": "dBZ",
+    "updraft_helicity": "meter ** 2 / second ** 2",
+}
+
+# Constants of the sea level pressure calculation in wrf-python (DCOMPUTESEAPRS)
+SLP_PCONST = 10000.0  # Pa
+SLP_TC = 273.16 + 17.5  # K
+SLP_RD = 287.0  # J/(kg K)
+SLP_G = 9.81  # m/s^2
+SLP_USSALR = 0.0065  # K/m
+
+
+def derived_path(directory, domain, date):
+    """Return the path of a derived file for a domain and valid date string."""
+    return Path(directory) / f"wrfout_d0{domain}_derived_{date}.nc"
+
+
+class EarthRelativeWinds:
+    """Destagger and rotate grid-relative WRF winds to earth-relative winds.
+
+    The map rotation is read from the reference dataset once. Staggered 3-D winds are
+    destaggered and rotated one level at a time into output buffers that are allocated
+    on the first call and reused by later calls, so only 2-D temporaries are created.
+
+    Parameters
+    ----------
+    ref : xarray.Dataset
+        WRF reference dataset with map rotation angles SINALPHA and COSALPHA.
+    """
+
+    def __init__(self, ref):
+        self.sinalpha = np.asarray(ref.SINALPHA.values, dtype=np.float32)
+        self.cosalpha = np.asarray(ref.COSALPHA.values, dtype=np.float32)
+        self._uearth = None
+        self._vearth = None
+        self._scratch = np.empty((3,) + self.sinalpha.shape, dtype=np.float32)
+
+    def rotate(self, u, v, out=None):
+        """Rotate unstaggered grid-relative winds with shape (y, x).
+
+        Parameters
+        ----------
+        u, v : numpy.ndarray
+            Grid-relative wind components.
+        out : tuple of numpy.ndarray (optional)
+            Arrays to write the earth-relative components to. Default is new arrays.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Earth-relative u and v components.
+        """
+        if out is None:
+            out = (np.empty_like(self.sinalpha), np.empty_like(self.sinalpha))
+        uearth, vearth = out
+        tmp = self._scratch[0]
+        np.multiply(u, self.cosalpha, out=uearth)
+        np.multiply(v, self.sinalpha, out=tmp)
+        np.subtract(uearth, tmp, out=uearth)
+        np.multiply(v, self.cosalpha, out=vearth)
+        np.multiply(u, self.sinalpha, out=tmp)
+        np.add(vearth, tmp, out=vearth)
+        return uearth, vearth
+
+    def destagger_rotate(self, u, v):
+        """Destagger and rotate grid-relative 3-D winds.
+
+        Parameters
+        ----------
+        u : numpy.ndarray
+            Grid-relative u component with shape (z, y, x + 1).
+        v : numpy.ndarray
+            Grid-relative v component with shape (z, y + 1, x).
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            float32 earth-relative u and v components with shape (z, y, x). These are
+            overwritten by the next call, so copy them if they need to be kept.
+        """
+        shape = (u.shape[0],) + self.sinalpha.shape
+        if self._uearth is None or self._uearth.shape != shape:
+            self._uearth = np.empty(shape, dtype=np.float32)
+            self._vearth = np.empty(shape, dtype=np.float32)
+
+        ugrid, vgrid = self._scratch[1], self._scratch[2]
+        for k in range(shape[0]):
+            np.add(u[k, :, :-1], u[k, :, 1:], out=ugrid)
+            ugrid *= 0.5
+            np.add(v[k, :-1, :], v[k, 1:, :], out=vgrid)
+            vgrid *= 0.5
+            self.rotate(ugrid, vgrid, out=(self._uearth[k], self._vearth[k]))
+        return self._uearth, self._vearth
+
+
+def _take_level(values, k):
+    """Select one level per column of (..., nz, ny, nx) values at indices (..., ny, nx)."""
+    return np.take_along_axis(values, k[..., np.newaxis, :, :], axis=-3)[..., 0, :, :]
+
+
+def slp(z, t, p, qv):
+    """Calculate sea level pressure like `wrf.slp` for a stack of columns.
+
+    Follows DCOMPUTESEAPRS in wrf-python: temperature and height are interpolated to
+    100 hPa above the surface, and reduced to sea level with a standard lapse rate.
+    Rather than failing for the whole grid, columns where pressure never drops 100 hPa
+    below the surface, or only does so at the model top, are set to NaN.
+
+    Parameters
+    ----------
+    z : numpy.ndarray
+        Height in meters with shape (..., nz, ny, nx), e.g. (member, nz, ny, nx).
+    t : numpy.ndarray
+        Temperature in kelvin with the same shape as `z`.
+    p : numpy.ndarray
+        Pressure in pascals with the same shape as `z`.
+    qv : numpy.ndarray
+        Water vapor mixing ratio in kg/kg with the same shape as `z`.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 sea level pressure in hPa with shape (..., ny, nx).
+    """
+    z, t, p, qv = (np.asarray(a, dtype=np.float32) for a in (z, t, p, qv))
+    nz = p.shape[-3]
+    p_sfc = p[..., 0, :, :]
+    p_at_pconst = p_sfc - np.float32(SLP_PCONST)
+
+    # First level where pressure is 100 hPa less than at the surface
+    above = p < p_at_pconst[..., np.newaxis, :, :]
+    level = np.argmax(above, axis=-3)
+    klo = np.maximum(level - 1, 0)
+    khi = np.minimum(klo + 1, nz - 2)
+    bad = ~np.any(above, axis=-3) | (klo == khi)
+    if np.any(bad):
+        log.warning(f"Setting SLP to NaN in {np.count_nonzero(bad)} columns")
+
+    plo = _take_level(p, klo)
+    phi = _take_level(p, khi)
+    tlo = _take_level(t, klo) * (1.0 + 0.608 * _take_level(qv, klo))
+    thi = _take_level(t, khi) * (1.0 + 0.608 * _take_level(qv, khi))
+    zlo = _take_level(z, klo)
+    zhi = _take_level(z, khi)
+
+    # wrf-python multiplies, rather than divides, by log(plo / phi)
+    weight = np.log(p_at_pconst / phi) * np.log(plo / phi)
+    t_at_pconst = thi - (thi - tlo) * weight
+    z_at_pconst = zhi - (zhi - zlo) * weight
+    t_surf = t_at_pconst * (p_sfc / p_at_pconst) ** (SLP_USSALR * SLP_RD / SLP_G)
+    t_sea_level = t_at_pconst + SLP_USSALR * z_at_pconst
+
+    # Limit sea level temperature as in the MM5/RIP "ridiculous_mm5_test"
+    t_sea_level = np.where(
+        (t_surf <= SLP_TC) & (t_sea_level >= SLP_TC),
+        np.float32(SLP_TC),
+        SLP_TC - 0.005 * (t_surf - SLP_TC) ** 2,
+    )
+
+    slp = (
+        0.01
+        * p_sfc
+        * np.exp((2.0 * SLP_G * z[..., 0, :, :]) / (SLP_RD * (t_sea_level + t_surf)))
+    )
+    slp = slp.astype(np.float32, copy=False)
+    slp[bad] = np.nan
+    return slp
+
+
+class FieldCache:
+    """Lazily calculate and cache 3-D fields of a WRF member dataset.
+
+    Fields are calculated the first time they are looked up by name, e.g.
+    ``cache["temperature"]``, and kept for later lookups, so the surface and upper
+    air diagnostics of the same member share them. Fields are float32 arrays without
+    units, in the units of FieldCache.field_units. New fields are added with the
+    `FieldCache.register` decorator, and may look up other fields of the cache.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        WRF member output for a single time.
+    ref : xarray.Dataset
+        WRF reference dataset with base state variables and map rotation angles.
+    winds : EarthRelativeWinds (optional)
+        Rotation to earth-relative winds, which may be shared between members with the
+        same reference dataset. Default is to create one from `ref`.
+    """
+
+    calculations = {}
+    field_units = {}
+
+    def __init__(self, ds, ref, winds=None):
+        self.ds = ds
+        self.ref = ref
+        self.winds = EarthRelativeWinds(ref) if winds is None else winds
+        self._fields = {}
+
+    @classmethod
+    def register(cls, name, unit):
+        """Register a function calculating a field from a cache as `name` in `unit`."""
+
+        def decorator(func):
+            cls.calculations[name] = func
+            cls.field_units[name] = unit
+            return func
+
+        return decorator
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            with profiling.span(f"derive {name}"):
+                self._fields[name] = self.calculations[name](self)
+        return self._fields[name]
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def quantity(self, name):
+        """Return a field with units."""
+        return self[name] * units(self.field_units[name])
+
+
+def _float32(values):
+    return np.asarray(values, dtype=np.float32)
+
+
+def _read(da, unit):
+    """Read a variable as float32 values in `unit`, copying only to convert units."""
+    values = _float32(da.values)
+    if fastunits.factors(da.units, unit) != (1.0, 0.0):
+        values = fastunits.convert(values.copy(), da.units, unit)
+    return values
+
+
+@FieldCache.register("pressure", "Pa")
+def _pressure(cache):
+    p = _float32((cache.ref.PB + cache.ds.P).values)
+    return fastunits.convert(p, cache.ds.P.units, "Pa")
+
+
+@FieldCache.register("potential_temperature", "K")
+def _potential_temperature(cache):
+    theta = _float32((cache.ds.T + cache.ref.T00).values)
+    return fastunits.convert(theta, cache.ds.T.units, "K")
+
+
+@FieldCache.register("water_vapor_mixing_ratio", "kg/kg")
+def _water_vapor_mixing_ratio(cache):
+    return _read(cache.ds.QVAPOR, "kg/kg")
+
+
+@FieldCache.register("geopotential", "m^2/s^2")
+def _geopotential(cache):
+    phb_ph = _float32((cache.ref.PHB + cache.ds.PH).values)
+    return wrfpost.destagger(fastunits.convert(phb_ph, cache.ds.PH.units, "m^2/s^2"), 0)
+
+
+@FieldCache.register("height", "m")
+def _height(cache):
+    # Same as metpy geopotential_to_height
+    earth_radius = mpconsts.earth_avg_radius.m_as("m")
+    gravity = mpconsts.earth_gravity.m_as("m/s^2")
+    gpot = cache["geopotential"]
+    return _float32(gpot * earth_radius / (gravity * earth_radius - gpot))
+
+
+@FieldCache.register("temperature", "K")
+def _temperature(cache):
+    # Same as metpy temperature_from_potential_temperature
+    p = cache["pressure"]
+    return _float32(
+        cache["potential_temperature"]
+        * (p / mpconsts.P0.m_as("Pa")) ** mpconsts.kappa.m
+    )
+
+
+@FieldCache.register("earth_relative_winds", "m/s")
+def _earth_relative_winds(cache):
+    # Buffers of the wind rotation, which are overwritten by the next member
+    return cache.winds.destagger_rotate(
+        _read(cache.ds.U, "m/s"), _read(cache.ds.V, "m/s")
+    )
+
+
+def interpolate_to_pressure(p, fields, levels):
+    """Linearly interpolate 3-D fields to pressure levels.
+
+    Gives the same results as metpy `interpolate_to_isosurface` for pressure decreasing
+    with height, but the bounding model levels and interpolation weights of each pressure
+    level are found once and shared by all fields. Where a pressure level is below the
+    lowest model level, values are taken from the lowest model level, and where it is
+    above the highest model level, from the highest model level.
+
+    Parameters
+    ----------
+    p : numpy.ndarray
+        Pressure with shape (z, y, x), decreasing with height.
+    fields : dict
+        Fields with the same shape as `p`.
+    levels : array-like
+        Pressure levels in the units of `p`.
+
+    Returns
+    -------
+    dict
+        float32 fields interpolated to pressure levels with shape (levels, y, x).
+    """
+    nz = p.shape[0]
+    p_min = p.min(axis=0)
+    p_max = p.max(axis=0)
+    interpolated = {
+        name: np.empty((len(levels),) + p.shape[1:], dtype=np.float32)
+        for name in fields
+    }
+
+    for i, level in enumerate(levels):
+        # Index of the first model level at or above the pressure level
+        above = np.count_nonzero(p > level, axis=0)
+        good = (above > 0) & (above < nz)
+        above = np.clip(above, 1, nz - 1)[np.newaxis]
+        p_above = np.take_along_axis(p, above, axis=0)[0]
+        p_below = np.take_along_axis(p, above - 1, axis=0)[0]
+        weight = (level - p_above) / (p_below - p_above)
+
+        for name, field in fields.items():
+            values = interpolated[name][i]
+            field_above = np.take_along_axis(field, above, axis=0)[0]
+            field_below = np.take_along_axis(field, above - 1, axis=0)[0]
+            values[:] = weight * (field_below - field_above) + field_above
+            values[~good] = np.nan
+            values[p_min >= level] = field[-1][p_min >= level]
+            values[p_max <= level] = field[0][p_max <= level]
+    return interpolated
+
+
+def dewpoint(p, qv):
+    """Calculate dewpoint like metpy `dewpoint_from_specific_humidity`.
+
+    Parameters
+    ----------
+    p : numpy.ndarray
+        Pressure in pascals.
+    qv : numpy.ndarray
+        Water vapor mixing ratio in kg/kg.
+
+    Returns
+    -------
+    numpy.ndarray
+        Dewpoint in degrees Celsius.
+    """
+    # Vapor pressure in hPa relative to saturation at 0 degrees Celsius (Bolton 1980)
+    val = np.log(0.01 * p * qv / (mpconsts.epsilon.m + qv) / 6.112)
+    return _float32(243.5 * val / (17.67 - val))
+
+
+def sea_level_pressure(cache):
+    """Calculate sea level pressure in hPa from the fields of a WRF member dataset.
+
+    Columns where the calculation fails are NaN.
+
+    Parameters
+    ----------
+    cache : FieldCache
+        Fields of a WRF member dataset.
+    """
+    z = cache["height"]
+    t = cache["temperature"]
+    p = cache["pressure"]
+    qv = cache["water_vapor_mixing_ratio"]
+    with profiling.span("slp"):
+        return slp(z, t, p, qv)
+
+
+def surface_fields(ds, ref, winds=None, cache=None):
+    """Calculate surface fields from a WRF member dataset.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        WRF member output for a single time.
+    ref : xarray.Dataset
+        WRF reference dataset with base state variables and map rotation angles.
+    winds : EarthRelativeWinds (optional)
+        Rotation to earth-relative winds, which may be shared between members with the
+        same reference dataset. Default is to create one from `ref`.
+    cache : FieldCache (optional)
+        3-D fields of `ds` shared with other diagnostics of the member. Default is to
+        create one from `ds`, `ref`, and `winds`.
+
+    Returns
+    -------
+    dict
+        float32 fields named as in SURFACE_NAMES, in the units of FIELD_UNITS.
+    """
+    if cache is None:
+        cache = FieldCache(ds, ref, winds)
+    t2 = _read(ds.T2, "kelvin")
+    psfc = _read(ds.PSFC, "Pa")
+    qv2 = _read(ds.Q2, "kg/kg")
+    u10earth, v10earth = cache.winds.rotate(_read(ds.U10, "m/s"), _read(ds.V10, "m/s"))
+
+    fields = (
+        t2,
+        u10earth,
+        v10earth,
+        np.hypot(u10earth, v10earth),
+        sea_level_pressure(cache),
+        dewpoint(psfc, qv2),
+    )
+    return dict(zip(SURFACE_NAMES, fields))
+
+
+def upper_fields(ds, ref, levels, winds=None, cache=None):
+    """Calculate upper air fields on pressure surfaces from a WRF member dataset.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        WRF member output for a single time.
+    ref : xarray.Dataset
+        WRF reference dataset with base state variables and map rotation angles.
+    levels : pint.Quantity
+        Pressure levels to interpolate to.
+    winds : EarthRelativeWinds (optional)
+        Rotation to earth-relative winds, which may be shared between members with the
+        same reference dataset. Default is to create one from `ref`.
+    cache : FieldCache (optional)
+        3-D fields of `ds` shared with other diagnostics of the member. Default is to
+        create one from `ds`, `ref`, and `winds`.
+
+    Returns
+    -------
+    dict
+        float32 fields named as in UPPER_NAMES, in the units of FIELD_UNITS, with shape
+        (levels, y, x).
+    """
+    if cache is None:
+        cache = FieldCache(ds, ref, winds)
+    uearth, vearth = cache["earth_relative_winds"]
+    p_levels = levels.m_as("Pa")
+
+    # Only prognostic fields are interpolated. Fields derived from them are calculated
+    # on pressure levels, which have far fewer points than model levels
+    with profiling.span("interpolate to isobaric"):
+        interpolated = interpolate_to_pressure(
+            cache["pressure"],
+            {
+                "temperature": cache["temperature"],
+                "u_wind_component": uearth,
+                "v_wind_component": vearth,
+                "geopotential_height": cache["height"],
+                "water_vapor_mixing_ratio": cache["water_vapor_mixing_ratio"],
+            },
+            p_levels,
+        )
+
+    qv = interpolated.pop("water_vapor_mixing_ratio")
+    p = np.broadcast_to(_float32(p_levels)[:, np.newaxis, np.newaxis], qv.shape)
+    fields = interpolated
+    fields["wind_speed"] = np.hypot(
+        fields["u_wind_component"], fields["v_wind_component"]
+    )
+    fields["dewpoint_temperature"] = fastunits.convert(
+        dewpoint(p, qv), "degC", "kelvin"
+    )
+    return {name: fields[name] for name in UPPER_NAMES}
+
+
+def convective_fields(ds):
+    """Calculate convective fields from a WRF member dataset.
+
+    Precipitation is accumulated since initialization, so hourly precipitation requires
+    the accumulated precipitation of the previous forecast hour.
+
+    Returns
+    -------
+    dict
+        float32 fields named as in CONVECTIVE_NAMES, in the units of FIELD_UNITS.
+    """
+    precip = _float32((ds.RAINNC + ds.RAINC).values)
+    unit = FIELD_UNITS["accumulated_precipitation"]
+    return {
+        "accumulated_precipitation": fastunits.convert(precip, ds.RAINNC.units, unit),
+        "reflectivity": np.max(ds.REFL_10CM.values, axis=0),
+        "updraft_helicity": _read(ds.UP_HELI_MAX, FIELD_UNITS["updraft_helicity"]),
+    }
+
+
+# Reference calculations with pint quantities, which the unit-free calculations above
+# are checked against by wrf_post.py --validate_units
+# -------------------------------------------------------------------------------------
+
+
+def surface_fields_pint(ds, ref):
+    """Calculate surface fields with units from a WRF member dataset."""
+    t2 = ds.T2.values * units(ds.T2.units)
+    psfc = ds.PSFC.values * units(ds.PSFC.units)
+    qv2 = ds.Q2.values * units(ds.Q2.units)
+
+    spec_h2 = mpcalc.specific_humidity_from_mixing_ratio(qv2)
+    u10earth, v10earth = wrfpost.earth_relative_winds(
+        ds.U10.values, ds.V10.values, ref.SINALPHA.values, ref.COSALPHA.values
+    )
+    u10earth = u10earth * units(ds.U10.units)
+    v10earth = v10earth * units(ds.V10.units)
+
+    p = (ref.PB + ds.P).values * units(ds.P.units)
+    theta = (ds.T + ref.T00).values * units(ds.T.units)
+    gpot = wrfpost.destagger(ref.PHB.values + ds.PH.values, 0) * units(ds.PH.units)
+    z = mpcalc.geopotential_to_height(gpot)
+    t = mpcalc.temperature_from_potential_temperature(p, theta)
+    qv = ds.QVAPOR.values * units(ds.QVAPOR.units)
+    mslp = slp(z.m_as("m"), t.m_as("K"), p.m_as("Pa"), qv.m_as("kg/kg")) * units.hPa
+
+    fields = (
+        t2,
+        u10earth,
+        v10earth,
+        mpcalc.wind_speed(u10earth, v10earth),
+        mslp,
+        mpcalc.dewpoint_from_specific_humidity(psfc, t2, spec_h2),
+    )
+    return dict(zip(SURFACE_NAMES, fields))
+
+
+def upper_fields_pint(ds, ref, levels):
+    """Calculate upper air fields with units on pressure surfaces."""
+    u = wrfpost.destagger(ds.U.values, 2) * units(ds.U.units)
+    v = wrfpost.destagger(ds.V.values, 1) * units(ds.V.units)
+    gpot = wrfpost.destagger(ref.PHB.values + ds.PH.values, 0) * units(ds.PH.units)
+    p = (ref.PB + ds.P).values * units(ds.P.units)
+    theta = (ds.T + ref.T00).values * units(ds.T.units)
+    qv = ds.QVAPOR.values * units(ds.QVAPOR.units)
+
+    sinalpha = np.broadcast_to(ref.SINALPHA, u.shape)
+    cosalpha = np.broadcast_to(ref.COSALPHA, u.shape)
+    uearth, vearth = wrfpost.earth_relative_winds(u, v, sinalpha, cosalpha)
+    t = mpcalc.temperature_from_potential_temperature(p, theta)
+    z = mpcalc.geopotential_to_height(gpot)
+
+    interpolated = []
+    for field in (t, uearth, vearth, z, qv):
+        interpolated.append(
+            np.stack(
+                [
+                    mpinterp.interpolate_to_isosurface(p, field, level)
+                    for level in levels
+                ],
+                axis=0,
+            )
+        )
+    t, uearth, vearth, z, qv = interpolated
+    p = np.broadcast_to(levels[:, np.newaxis, np.newaxis], qv.shape)
+    spec_h = mpcalc.specific_humidity_from_mixing_ratio(qv)
+    dpt = mpcalc.dewpoint_from_specific_humidity(p, t, spec_h)
+    wspd = mpcalc.wind_speed(uearth, vearth)
+
+    fields = (t, uearth, vearth, wspd, z, dpt)
+    return {
+        name: field.to(FIELD_UNITS[name]) for name, field in zip(UPPER_NAMES, fields)
+    }
+
+
+def convective_fields_pint(ds):
+    """Calculate convective fields with units from a WRF member dataset."""
+    return {
+        "accumulated_precipitation": (ds.RAINNC + ds.RAINC).values
+        * units(ds.RAINNC.units),
+        "reflectivity": np.max(ds.REFL_10CM.values, axis=0),
+        "updraft_helicity": ds.UP_HELI_MAX.values * units(ds.UP_HELI_MAX.units),
+    }
+
+
+def validate_fields(fields, reference):
+    """Check unit-free fields against fields calculated with pint quantities.
+
+    Parameters
+    ----------
+    fields : dict
+        Fields in the units of FIELD_UNITS.
+    reference : dict
+        Fields of the same names with units, e.g. from `surface_fields_pint`.
+
+    Raises
+    ------
+    AssertionError
+        If any field differs from the reference by more than float32 rounding.
+    """
+    for name, values in reference.items():
+        fastunits.check(fields[name], values, FIELD_UNITS[name], name)
+
+
+def write_derived(ds, ref, levels, path_out):
+    """Calculate all surface, upper air, and convective fields and write them to file.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        WRF member output for a single time.
+    ref : xarray.Dataset
+        WRF reference dataset with base state variables and map rotation angles.
+    levels : pint.Quantity
+        Pressure levels to interpolate upper air fields to.
+    path_out : str or pathlib.Path
+        Path of the derived file to write.
+    """
+    cache = FieldCache(ds, ref)
+    fields = surface_fields(ds, ref, cache=cache)
+    fields.update(upper_fields(ds, ref, levels, cache=cache))
+    fields.update(convective_fields(ds))
+
+    data_vars = {}
+    for name, field in fields.items():
+        dims = ["pressure", "y", "x"] if name in UPPER_NAMES else ["y", "x"]
+        data_vars[name] = (dims, field, {"units": FIELD_UNITS[name]})
+
+    coords = {"pressure": (["pressure"], levels.m, {"units": str(levels.units)})}
+    attrs = {"description": "2-D fields derived from WRF member output"}
+    encoding = {name: {"zlib": True} for name in data_vars}
+    xr.Dataset(data_vars, coords, attrs).to_netcdf(path_out, encoding=encoding)
+
+
+def read_derived(path, levels):
+    """Read surface, upper air, and convective fields from a derived file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of a derived file written by `write_derived`.
+    levels : pint.Quantity
+        Pressure levels of upper air fields.
+
+    Returns
+    -------
+    dict or None
+        float32 fields in the units of FIELD_UNITS, or None if the file is missing any
+        fields or pressure levels, in which case fields must be calculated from WRF
+        output.
+    """
+    with xr.open_dataset(path) as derived:
+        names = SURFACE_NAMES + UPPER_NAMES + CONVECTIVE_NAMES
+        if any(name not in derived for name in names):
+            return None
+        pressure = derived.pressure.values * units(derived.pressure.units)
+        if not np.all(np.isin(levels.to(pressure.units).m, pressure.m)):
+            return None
+
+        fields = {}
+        for name in names:
+            field = derived[name]
+            if "pressure" in field.dims:
+                field = field.sel(pressure=levels.to(pressure.units).m)
+            values = np.array(field.values, dtype=np.float32)
+            fields[name] = fastunits.convert(values, field.units, FIELD_UNITS[name])
+    return fields
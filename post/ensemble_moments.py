@@ -0,0 +1,75 @@
+# =============================================================================
+# ensemble_moments.py
+# -----------------------------------------------------------------------------
+# Running ensemble mean, variance, minimum, and maximum of gridded fields that
+# are updated one member at a time with Welford's algorithm, so ensemble
+# products can be written without a second pass over all members.
+# =============================================================================
+
+import numpy as np
+
+
+class RunningMoments:
+    """Running ensemble statistics of a gridded field.
+
+    Parameters
+    ----------
+    minmax : bool (optional)
+        Also track the ensemble minimum and maximum. Default is False.
+
+    Notes
+    -----
+    NaN values (e.g., SLP where the calculation failed) are skipped, so the number of
+    members contributing to the statistics is counted separately at each grid point.
+    """
+
+    def __init__(self, minmax=False):
+        self.minmax = minmax
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        """Add a single ensemble member to the running statistics.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Member field with the same shape as all other members.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.count is None:
+            self.count = np.zeros(values.shape, dtype=np.int64)
+            self.mean = np.zeros(values.shape)
+            self.m2 = np.zeros(values.shape)
+            if self.minmax:
+                self.min = np.full(values.shape, np.inf)
+                self.max = np.full(values.shape, -np.inf)
+
+        valid = ~np.isnan(values)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0.0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += delta * np.where(valid, values - self.mean, 0.0)
+
+        if self.minmax:
+            np.fmin(self.min, values, out=self.min)
+            np.fmax(self.max, values, out=self.max)
+
+    def variance(self, ddof=1):
+        """Return the ensemble variance, or NaN where too few members are valid."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    def results(self):
+        """Return the ensemble mean and standard deviation, and optionally minimum and
+        maximum, as a dictionary of arrays keyed by product name.
+        """
+        mean = np.where(self.count > 0, self.mean, np.nan)
+        products = {"mean": mean, "spread": np.sqrt(self.variance())}
+        if self.minmax:
+            products["min"] = np.where(self.count > 0, self.min, np.nan)
+            products["max"] = np.where(self.count > 0, self.max, np.nan)
+        return products
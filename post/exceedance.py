@@ -0,0 +1,229 @@
+# =============================================================================
+# exceedance.py
+# -----------------------------------------------------------------------------
+# Neighborhood exceedance of ensemble members, stored as bits, and neighborhood
+# maximum ensemble probabilities (NMEP) of any subset of members.
+#
+# A member exceeds a threshold at a grid point if any point within the
+# neighborhood radius does, and NMEP is the percentage of members that exceed
+# the threshold. Exceedance is packed along the member dimension with
+# np.packbits, so 42 members take 6 bytes per grid point, and NMEP of a subset
+# of members is counted from the bitwise AND of the packed bytes with a packed
+# member mask. This makes ensemble size sensitivity studies, e.g. NMEP of many
+# random 10-member subsets, a matter of table lookups rather than reruns of
+# post-processing:
+#
+#     with xr.open_dataset("exceedance_f12.nc") as ds:
+#         packed = ds.exceedance_reflectivity_40_0.values
+#         subsets = exceedance.random_subsets(ds.nmem, 10, 1000)
+#         probs = exceedance.nmep_subsets(packed, ds.nmem, subsets)
+#
+# Neighborhood ensemble probabilities (NEP), the fraction of grid points in the
+# neighborhood where members exceed the threshold, are calculated with the
+# circular neighborhoods of multiscale_fss.py, so they are consistent with the
+# observed neighborhood probabilities of the verification scripts.
+# =============================================================================
+
+import numpy as np
+from scipy import ndimage
+
+import multiscale_fss
+
+# Grid spacing in km assumed by probcalc_numpy.nmep
+GRID_SPACING = 4.0
+
+# Number of set bits of every byte
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def footprint(radius, dx=GRID_SPACING):
+    """Return the grid points within `radius` of the center of a neighborhood.
+
+    Parameters
+    ----------
+    radius : float
+        Neighborhood radius.
+    dx : float (optional)
+        Grid spacing in the units of `radius`. Default is GRID_SPACING (km).
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean disk with shape (2 * n + 1, 2 * n + 1), where n = int(radius / dx).
+    """
+    n = int(radius / dx)
+    y, x = np.mgrid[-n : n + 1, -n : n + 1] * dx
+    return y**2 + x**2 <= radius**2
+
+
+def exceedance(fields, threshold, radius, dx=GRID_SPACING):
+    """Find where members exceed a threshold within a neighborhood.
+
+    Parameters
+    ----------
+    fields : numpy.ndarray
+        Member fields with shape (member, y, x).
+    threshold : float
+        Threshold in the units of `fields`. Values equal to the threshold exceed it.
+    radius : float
+        Neighborhood radius.
+    dx : float (optional)
+        Grid spacing in the units of `radius`. Default is GRID_SPACING (km).
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean exceedance with the same shape as `fields`.
+    """
+    # Compare in the precision of the fields, like probcalc_numpy.nmep
+    exceeds = fields >= np.asarray(threshold, dtype=fields.dtype)
+    structure = footprint(radius, dx)[np.newaxis]
+    return ndimage.binary_dilation(exceeds, structure=structure)
+
+
+def pack(exceeds):
+    """Pack boolean exceedance with shape (member, ...) into bytes along member."""
+    return np.packbits(exceeds, axis=0)
+
+
+def member_masks(subsets, nmem):
+    """Return packed masks of subsets of members.
+
+    Parameters
+    ----------
+    subsets : array-like
+        Member numbers (starting at 1) of each subset, with shape (subset, member).
+    nmem : int
+        Number of members in the ensemble.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint8 masks with shape (subset, ceil(nmem / 8)).
+    """
+    subsets = np.atleast_2d(subsets)
+    masks = np.zeros((subsets.shape[0], nmem), dtype=bool)
+    np.put_along_axis(masks, subsets - 1, True, axis=1)
+    return np.packbits(masks, axis=1)
+
+
+def counts(packed, masks):
+    """Count exceeding members of subsets at every grid point.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        Exceedance packed along the first dimension, e.g. with shape (byte, y, x).
+    masks : numpy.ndarray
+        Packed member masks of subsets with shape (subset, byte).
+
+    Returns
+    -------
+    numpy.ndarray
+        uint16 counts with shape (subset, ...) for the remaining dimensions of `packed`.
+    """
+    nsubsets, nbytes = masks.shape
+    expand = (slice(None),) + (np.newaxis,) * (packed.ndim - 1)
+    total = np.zeros((nsubsets,) + packed.shape[1:], dtype=np.uint16)
+    for byte in range(nbytes):
+        total += POPCOUNT[packed[byte] & masks[:, byte][expand]]
+    return total
+
+
+def nmep_subsets(packed, nmem, subsets):
+    """Calculate NMEP of subsets of members of the same size.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        Exceedance packed along the first dimension, e.g. with shape (byte, y, x).
+    nmem : int
+        Number of members in the ensemble.
+    subsets : array-like
+        Member numbers (starting at 1) of each subset, with shape (subset, member).
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 NMEP in percent with shape (subset, ...) for the remaining dimensions of
+        `packed`.
+    """
+    subsets = np.atleast_2d(subsets)
+    probs = counts(packed, member_masks(subsets, nmem)).astype(np.float32)
+    probs /= np.float32(subsets.shape[1])
+    probs *= np.float32(100.0)
+    return probs
+
+
+def nmep(packed, nmem, members=None):
+    """Calculate NMEP of a subset of members.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        Exceedance packed along the first dimension, e.g. with shape (byte, y, x).
+    nmem : int
+        Number of members in the ensemble.
+    members : array-like (optional)
+        Member numbers (starting at 1) of the subset. Default is all members.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 NMEP in percent with the remaining dimensions of `packed`.
+    """
+    if members is None:
+        members = np.arange(1, nmem + 1)
+    return nmep_subsets(packed, nmem, [members])[0]
+
+
+def nep(fields, threshold, radii, dx=GRID_SPACING):
+    """Calculate neighborhood ensemble probabilities (NEP) for several radii.
+
+    Fractions are linear in the exceedance field, so the mean of the member fractions is
+    the fraction of the number of exceeding members, which is convolved once per radius.
+    Neighborhoods are truncated at the domain edges.
+
+    Parameters
+    ----------
+    fields : numpy.ndarray
+        Member fields with shape (member, y, x).
+    threshold : float
+        Threshold in the units of `fields`. Values equal to the threshold exceed it.
+    radii : array-like
+        Neighborhood radii.
+    dx : float (optional)
+        Grid spacing in the units of `radii`. Default is GRID_SPACING (km).
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 NEP in percent with shape (radius, y, x).
+    """
+    exceeds = fields >= np.asarray(threshold, dtype=fields.dtype)
+    members = np.count_nonzero(exceeds, axis=0)
+    fractions = multiscale_fss.fractions_scales(members, radii, dx, shape="circle")
+    return (fractions * (100.0 / fields.shape[0])).astype(np.float32)
+
+
+def random_subsets(nmem, size, n, seed=None):
+    """Draw random subsets of members without replacement within each subset.
+
+    Parameters
+    ----------
+    nmem : int
+        Number of members in the ensemble.
+    size : int
+        Number of members in each subset.
+    n : int
+        Number of subsets.
+    seed : int (optional)
+        Seed of the random number generator. Default is None.
+
+    Returns
+    -------
+    numpy.ndarray
+        Member numbers (starting at 1) with shape (n, size).
+    """
+    rng = np.random.default_rng(seed)
+    return np.argsort(rng.random((n, nmem)), axis=1)[:, :size] + 1
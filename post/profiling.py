@@ -0,0 +1,186 @@
+# =============================================================================
+# profiling.py
+# -----------------------------------------------------------------------------
+# Record where post-processing and verification scripts spend time and memory.
+# Stages of a script are wrapped in named spans, which may be nested:
+#
+#     profiling.start()
+#     with profiling.span("open member", member=mem):
+#         ds = xr.open_dataset(path)
+#     profiling.stop("profile.json")
+#
+# Each span records wall time, CPU time, bytes read and written by the process
+# (from /proc/self/io, where available), and the change and peak of memory
+# traced by tracemalloc. The peak is the span's own, including nested spans,
+# which needs tracemalloc.reset_peak (Python 3.9+). On older versions, only the
+# peak of the process so far is recorded, as process_memory_peak. Spans are
+# written as a Chrome trace, which can be opened in chrome://tracing or
+# https://ui.perfetto.dev, and summarized by name when profiling stops.
+#
+# Spans are no-ops until profiling is started, so instrumented code costs
+# nothing when a script is not profiled.
+# =============================================================================
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+_profiler = None
+
+# tracemalloc.reset_peak is new in Python 3.9
+_RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+def _io_counters():
+    """Return bytes read and written by this process, or None if unavailable."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class Profiler:
+    """Record nested spans of wall time, CPU time, I/O, and memory use.
+
+    Parameters
+    ----------
+    trace_memory : bool (optional)
+        Trace memory allocations with tracemalloc, which slows down allocation-heavy
+        code. Default is True.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.events = []
+        self._t0 = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Peaks of the spans that are open, updated whenever the traced peak is reset
+        self._peaks = []
+        self._process_peak = 0
+
+    @contextmanager
+    def span(self, name, **args):
+        """Record a span around the body of a `with` block.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span, e.g. the stage of a script.
+        **args
+            Extra values to store with the span, e.g. member=1.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        io_start = _io_counters()
+        mem_start = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        if self.trace_memory and _RESET_PEAK:
+            self._reset_peak()
+            self._peaks.append(0)
+        try:
+            yield
+        finally:
+            wall_end = time.perf_counter()
+            record = dict(args)
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            io_end = _io_counters()
+            if io_start is not None and io_end is not None:
+                record["bytes_read"] = io_end[0] - io_start[0]
+                record["bytes_written"] = io_end[1] - io_start[1]
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["memory_delta"] = current - mem_start
+                if _RESET_PEAK:
+                    record["memory_peak"] = max(self._peaks.pop(), peak)
+                    for i in range(len(self._peaks)):
+                        self._peaks[i] = max(self._peaks[i], record["memory_peak"])
+                else:
+                    record["process_memory_peak"] = peak
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (wall_start - self._t0) * 1e6,
+                    "dur": (wall_end - wall_start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": record,
+                }
+            )
+
+    def _reset_peak(self):
+        # Fold the peak since the last reset into the open spans and the process
+        peak = tracemalloc.get_traced_memory()[1]
+        self._peaks = [max(p, peak) for p in self._peaks]
+        self._process_peak = max(self._process_peak, peak)
+        tracemalloc.reset_peak()
+
+    def memory_peak(self):
+        """Return the peak traced memory of the process since profiling started."""
+        return max(self._process_peak, tracemalloc.get_traced_memory()[1])
+
+    def summary(self):
+        """Return total wall time, CPU time, and number of calls of each span name."""
+        totals = defaultdict(
+            lambda: {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+        )
+        for event in self.events:
+            total = totals[event["name"]]
+            total["calls"] += 1
+            total["wall_seconds"] += event["dur"] / 1e6
+            total["cpu_seconds"] += event["args"]["cpu_seconds"]
+        return dict(totals)
+
+    def write(self, path):
+        """Write recorded spans to a Chrome trace file."""
+        with open(path, "w") as f:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"}, f, indent=1
+            )
+
+
+def start(trace_memory=True):
+    """Start profiling spans of this process and return the profiler."""
+    global _profiler
+    _profiler = Profiler(trace_memory)
+    return _profiler
+
+
+def stop(path=None):
+    """Stop profiling, print a summary of spans, and write them to `path` if given."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return
+
+    print("Summary of performance:")
+    print(f"{'span':<32} {'calls':>6} {'wall (s)':>10} {'cpu (s)':>10}")
+    totals = sorted(
+        profiler.summary().items(), key=lambda item: -item[1]["wall_seconds"]
+    )
+    for name, total in totals:
+        print(
+            f"{name:<32} {total['calls']:>6} {total['wall_seconds']:>10.3f} "
+            f"{total['cpu_seconds']:>10.3f}"
+        )
+    if profiler.trace_memory:
+        current = tracemalloc.get_traced_memory()[0]
+        print(f"Current memory use = {current / 1e9:.3f} GB")
+        print(f"Peak memory use = {profiler.memory_peak() / 1e9:.3f} GB")
+
+    if path is not None:
+        profiler.write(path)
+        print(f"Wrote profile trace to {path}")
+
+
+def span(name, **args):
+    """Return a context manager recording a span if profiling has started."""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.span(name, **args)
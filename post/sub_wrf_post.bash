@@ -12,7 +12,8 @@
 # sub_wrf_post.bash
 #
 # Post-process WRF ensemble forecasts. Upper air forecasts are processed every 12 hours,
-# surface forecasts every 6 hours, and convective forecasts every hour.
+# surface forecasts every 6 hours, and convective forecasts every hour. Convective
+# forecasts are then combined into time-and-space NMEPs within +/- 1 and 2 hours.
 #
 # Parameters
 # ----------
@@ -78,3 +79,9 @@ for fhour in `seq $hour_start $hour_end`; do
   $pyenv /home/rmanser/scripts/wrf_post.py $directory $init $fhour $nmem $domain \
   --path_ref $path_ref --path_save $path_save --prefix $prefix
 done
+
+# Convective forecasts are not processed at hour 0. Hours up to 2 hours before this chunk
+# are redone, since their windows now include hours from this chunk
+conv_start=$(( hour_start > 2 ? hour_start - 2 : 1 ))
+$pyenv /home/rmanser/scripts/time_neighborhood.py $path_save $conv_start $hour_end \
+--windows 1 2
@@ -0,0 +1,243 @@
+# =============================================================================
+# time_neighborhood.py
+# -----------------------------------------------------------------------------
+# Calculate time-and-space neighborhood maximum ensemble probabilities (NMEP)
+# from the member exceedance files written by wrf_post.py. A member exceeds a
+# threshold at a grid point and forecast hour if it does so within the spatial
+# neighborhood at any hour within +/- the time window, so the exceedance of a
+# window is the bitwise OR of the packed exceedance of its hours.
+#
+# Exceedance files are streamed in order of forecast hour, and only the hours
+# within the largest window of the hour being processed are held in memory.
+# Windows extend beyond the hours processed into any consecutive exceedance
+# files that exist, so forecasts processed in chunks of hours get the same
+# windows, and are only truncated at hour 1 and the last hour with a file.
+# Requested hours without an exceedance file are skipped. The number of
+# forecast hours in each window is written alongside the probabilities.
+#
+# Usage
+# -----
+#   python time_neighborhood.py /lustre/scratch/rmanser/wrf_post/exp/2016050100 1 48
+# =============================================================================
+
+import argparse
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+import exceedance
+import profiling
+
+
+def centered_windows(hours, read, half_width):
+    """Stream items for each hour with the items of the hours around it.
+
+    Parameters
+    ----------
+    hours : iterable of int
+        Forecast hours in increasing order.
+    read : callable
+        Function returning the item of a forecast hour. It is called once per hour.
+    half_width : int
+        Half-width of the window in hours.
+
+    Yields
+    ------
+    tuple
+        Center hour and a list of (hour, item) pairs for the hours within `half_width`
+        of the center, in order of hour. Windows are truncated at the first and last
+        hours.
+    """
+    window = deque()
+    centers = deque()
+
+    def take(center):
+        # Drop items that are outside the windows of this and the following centers
+        while window[0][0] < center - half_width:
+            window.popleft()
+        return center, [(h, item) for h, item in window if h <= center + half_width]
+
+    for hour in hours:
+        with profiling.span("read", hour=hour):
+            window.append((hour, read(hour)))
+        centers.append(hour)
+        while centers[0] + half_width <= hour:
+            yield take(centers.popleft())
+
+    while centers:
+        yield take(centers.popleft())
+
+
+def window_exceedance(center, items, windows):
+    """OR packed exceedance over nested time windows.
+
+    Parameters
+    ----------
+    center : int
+        Center forecast hour.
+    items : list of (int, numpy.ndarray)
+        Forecast hours and packed exceedance of the hours around `center`.
+    windows : list of int
+        Window half-widths in hours in increasing order.
+
+    Returns
+    -------
+    list of (numpy.ndarray, int)
+        Packed exceedance and number of forecast hours of each window.
+    """
+    packed = next(item for h, item in items if h == center).copy()
+    nhours = 1
+    result = []
+    distance = 0
+    for window in windows:
+        # Windows are nested, so each window extends the OR of the previous one
+        for h, item in items:
+            if distance < abs(h - center) <= window:
+                np.bitwise_or(packed, item, out=packed)
+                nhours += 1
+        distance = window
+        result.append((packed.copy(), nhours))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Calculate time-and-space NMEPs from the member exceedance files "
+            "(exceedance_f<hour>.nc) written by wrf_post.py"
+        )
+    )
+    parser.add_argument(
+        "directory", type=str, help="Directory of post-processed exceedance files"
+    )
+    parser.add_argument("hour_start", type=int, help="First forecast hour to process")
+    parser.add_argument("hour_end", type=int, help="Final forecast hour to process")
+    parser.add_argument(
+        "--windows",
+        type=int,
+        nargs="+",
+        default=[1, 2],
+        help="Half-widths of the time windows in hours. Default is 1 2",
+    )
+    parser.add_argument(
+        "--path_save",
+        type=str,
+        default=None,
+        help="Directory in which to save output files. Default is `directory`",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Record time and memory use of each stage and write them to "
+            "profile_time_neighborhood.json in the `path_save` directory"
+        ),
+    )
+
+    args = parser.parse_args()
+    directory = Path(args.directory)
+    hours = range(args.hour_start, args.hour_end + 1)
+    windows = sorted(set(args.windows))
+    path_save = Path(args.path_save) if args.path_save is not None else directory
+    profile = args.profile
+
+    print('Argument "directory":', directory)
+    print('Argument "hour_start":', args.hour_start)
+    print('Argument "hour_end":', args.hour_end)
+    print('Argument "windows":', windows)
+    print('Argument "path_save":', path_save)
+    print('Argument "profile":', profile)
+
+    if profile:
+        profiling.start()
+
+    path_save.mkdir(exist_ok=True, parents=True)
+
+    def path_exceedance(hour):
+        return directory / f"exceedance_f{str(hour).zfill(2)}.nc"
+
+    def read(hour):
+        return xr.load_dataset(path_exceedance(hour))
+
+    # Hours without an exceedance file are skipped, e.g. hours of a previous chunk that
+    # has not been processed yet
+    hours_found = [hour for hour in hours if path_exceedance(hour).exists()]
+    for hour in sorted(set(hours) - set(hours_found)):
+        print(f"No exceedance file for hour {hour}. Skipping")
+
+    # Read the hours around those processed that are within a window, up to the first
+    # missing file in each direction
+    hours_before = []
+    for hour in range(hours.start - 1, max(hours.start - max(windows), 1) - 1, -1):
+        if not path_exceedance(hour).exists():
+            break
+        hours_before.insert(0, hour)
+    hours_after = []
+    for hour in range(hours.stop, hours.stop + max(windows)):
+        if not path_exceedance(hour).exists():
+            break
+        hours_after.append(hour)
+    hours_read = hours_before + hours_found + hours_after
+
+    for center, items in centered_windows(hours_read, read, max(windows)):
+        if center not in hours:
+            continue
+        ds = next(item for h, item in items if h == center)
+        data_vars = {}
+
+        for name in ds.data_vars:
+            with profiling.span("time neighborhood", hour=center, field=name):
+                packed = [(h, item[name].values) for h, item in items]
+                probs = []
+                nhours = []
+                for window, n in window_exceedance(center, packed, windows):
+                    probs.append(exceedance.nmep(window, ds.nmem))
+                    nhours.append(n)
+
+            description = ds[name].description
+            data_vars[f'nmep{name[len("exceedance"):]}'] = (
+                ["window", "radius", "y", "x"],
+                np.stack(probs),
+                {
+                    "description": (
+                        f"Time-and-space NMEPs from {description[0].lower()}"
+                        f"{description[1:]}"
+                    ),
+                    "threshold": ds[name].threshold,
+                    "units": "percent",
+                },
+            )
+
+        data_vars["nhours"] = (
+            ["window"],
+            np.array(nhours),
+            {"description": "Number of forecast hours within each time window"},
+        )
+        coords = {
+            "window": (["window"], np.array(windows), {"units": "hour"}),
+            "radius": ds.radius,
+            "y": ds.y,
+            "x": ds.x,
+        }
+        attrs = {
+            "description": (
+                "Neighborhood maximum ensemble probability forecasts within +/- the"
+                " time window of the forecast hour"
+            ),
+        }
+        attrs.update({key: ds.attrs[key] for key in ds.attrs if key != "description"})
+
+        with profiling.span("write", hour=center):
+            ds_time = xr.Dataset(data_vars, coords, attrs)
+            ds_time.to_netcdf(
+                path_save / f"time_neighborhood_f{str(center).zfill(2)}.nc"
+            )
+
+    if profile:
+        profiling.stop(path_save / "profile_time_neighborhood.json")
+
+
+if __name__ == "__main__":
+    main()
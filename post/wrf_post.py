@@ -11,28 +11,21 @@
 
 import argparse
 import logging
+import os
 import sys
-import tracemalloc
 from pathlib import Path
 
-import metpy.calc as mpcalc
-import metpy.interpolate as mpinterp
+import diagnostics
+import exceedance
+import fastunits
 import numpy as np
 import pandas as pd
-import probcalc_numpy
-import wrf
-import wrf_ens_tools.post as wrfpost
+import profiling
+from ensemble_moments import RunningMoments
 import xarray as xr
 from metpy.units import units
 
 
-def print_memory_use():
-    current, peak = tracemalloc.get_traced_memory()
-    # Convert Gibibytes to Gigabytes
-    print(f"Current memory use = {(current / 1024 ** 3) * 1.073742} GB")
-    print(f"Peak memory use = {(peak / 1024 ** 3) * 1.073742} GB\n")
-
-
 def main():
 
     description = (
@@ -93,12 +86,47 @@ def main():
         default="",
         help="Characters following the date in each WRF file name",
     )
+    parser.add_argument(
+        "--ensemble_minmax",
+        action="store_true",
+        help=(
+            "Also write ensemble minimum and maximum surface and upper air products "
+            "along with the ensemble mean and spread"
+        ),
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help=(
+            "SQLite manifest of ensemble files (see manifest.py in the repository root, "
+            "which must be on the PYTHONPATH). If given, member files are found with a "
+            "single query of the manifest instead of checking each possible file name"
+        ),
+    )
+    parser.add_argument(
+        "--validate_units",
+        action="store_true",
+        help=(
+            "Also calculate fields of each member file with pint quantities, and stop if "
+            "they differ from the fields calculated without units"
+        ),
+    )
     parser.add_argument(
         "--profile",
         action="store_true",
         help=(
-            "Profile this script for memory and time performance (this may significantly"
-            "reduce overall performance of the script)"
+            "Profile time, I/O, and memory use of each stage and member (this may "
+            "significantly reduce overall performance of the script)"
+        ),
+    )
+    parser.add_argument(
+        "--path_profile",
+        type=str,
+        default=None,
+        help=(
+            "Path of the Chrome trace file written with --profile. Default is "
+            "profile_f<hour>.json in the `path_save` directory"
         ),
     )
 
@@ -114,7 +142,14 @@ def main():
     prefix = args.prefix
     date_fmt = args.date_fmt
     suffix = args.suffix
+    ensemble_minmax = args.ensemble_minmax
+    path_manifest = args.manifest
+    validate_units = args.validate_units
     profile = args.profile
+    if args.path_profile is not None:
+        path_profile = Path(args.path_profile)
+    else:
+        path_profile = path_save / f"profile_f{str(fhour).zfill(2)}.json"
 
     log = logging.getLogger(sys.argv[0])
     log.addHandler(logging.NullHandler())
@@ -143,14 +178,20 @@ def main():
     print('Argument "prefix":', prefix)
     print('Argument "date_fmt":', date_fmt)
     print('Argument "suffix":', suffix)
+    print('Argument "ensemble_minmax":', ensemble_minmax)
+    print('Argument "manifest":', path_manifest)
+    print('Argument "validate_units":', validate_units)
     print('Argument "profile":', profile)
 
     if profile:
-        tracemalloc.start()
-        time_start = pd.Timestamp.now()
+        profiling.start()
 
+    # Winds are rotated to earth-relative with the map rotation of the reference file,
+    # which is read once for all members
+    winds = None
     if path_ref is not None:
         ref = xr.open_dataset(path_ref).sel(Time=0)
+        winds = diagnostics.EarthRelativeWinds(ref)
 
     path_save.mkdir(exist_ok=True, parents=True)
 
@@ -166,23 +207,31 @@ def main():
 
     lead = init + pd.Timedelta(fhour, unit="hour")
 
-    upper_names = [
-        "temperature",
-        "u_wind_component",
-        "v_wind_component",
-        "wind_speed",
-        "geopotential_height",
-        "dewpoint_temperature",
-    ]
-
-    surface_names = [
-        "temperature_2_meter",
-        "u_wind_component_10_meter",
-        "v_wind_component_10_meter",
-        "wind_speed_10_meter",
-        "mean_sea_level_pressure",
-        "dewpoint_temperature_2_meter",
-    ]
+    # Look up every indexed file of this forecast at once rather than checking the
+    # possible names of each member file on the file system. The forecast is crawled
+    # first, since files may have been reduced or derived since the last update. Only
+    # directories that changed are re-listed, and metadata are parsed relative to the
+    # experiment tree as by workflow.py
+    if path_manifest is not None:
+        import manifest
+
+        root = Path(os.path.abspath(directory)).parents[1]
+        with manifest.Manifest(path_manifest) as index:
+            index.update(root, only=[os.path.relpath(directory, root)])
+            indexed = index.paths(directory)
+
+        def exists(path):
+            return os.path.abspath(path) in indexed
+
+    else:
+
+        def exists(path):
+            return Path(path).exists()
+
+    upper_names = diagnostics.UPPER_NAMES
+    surface_names = diagnostics.SURFACE_NAMES
+    # Fields are arrays without units, in these units, until they are written
+    field_units = diagnostics.FIELD_UNITS
 
     # Convective -- every hour
     members_precip = {}
@@ -205,6 +254,11 @@ def main():
     members_z = {}
     members_dpt = {}
 
+    # Ensemble products are accumulated as members are processed, so they don't require
+    # another pass over all members
+    moments_surface = {name: RunningMoments(ensemble_minmax) for name in surface_names}
+    moments_upper = {name: RunningMoments(ensemble_minmax) for name in upper_names}
+
     attrs_all = {
         "initialization": init.strftime("%Y-%m-%d %H:%M:%S"),
         "forecast_hour": fhour,
@@ -212,194 +266,155 @@ def main():
     }
 
     for mem in range(1, nmem + 1):
+        with profiling.span("member", member=mem):
 
-        log.info(f"Opening WRF member file {mem}")
-        possible_names = [
-            f"mem{mem}/wrfoutred/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
-            f"mem{mem}/wrfoutred/wrfout_d02_red_{lead.strftime(date_fmt)}",
-            f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
-            f"mem{mem}/wrf/wrfout_d02_{lead.strftime(date_fmt)}",
-            f"mem{mem}/wrfout_d02_{lead.strftime(date_fmt)}.gz",
-            f"mem{mem}/wrfout_d02_{lead.strftime(date_fmt)}",
-            f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
-            f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}",
-        ]
-        file = ""
-        for name in possible_names:
-            if (directory / name).exists():
-                file = name
-                break
-
-        try:
-            ds = xr.open_dataset(directory / file).sel(Time=0)
-        except (FileNotFoundError, OSError):
-            log.error(f"None of the following files were found in {directory}:")
-            for name in possible_names:
-                log.error(name)
-            exit(1)
-
-        if path_ref is None:
-            logging.debug(
-                "No argument given for WRF reference file. "
-                "Looking for base state variables in input dataset"
+            # Use 2-D fields derived when WRF output was reduced if they are available,
+            # otherwise calculate them from WRF output
+            path_derived = diagnostics.derived_path(
+                directory / f"mem{mem}/wrfoutred", domain, lead.strftime(date_fmt)
             )
-            ref = ds
-
-        # Handle hourly convective variables
-        # ---------------------------------------------------------------------
-        if fhour >= 1 and not skip_convective:
-            precip = (ds.RAINNC + ds.RAINC).values * units(ds.RAINNC.units)
-            # Subtract accumulated precip from the previous forecast hour to get hourly precip
-            if fhour == 1:
-                precip_prev = np.zeros_like(precip) * precip.units
-            else:
+            fields = None
+            if exists(path_derived):
+                log.info(f"Opening derived member file {mem}")
+                with profiling.span("read derived", member=mem):
+                    fields = diagnostics.read_derived(path_derived, levels)
+
+            # Gzipped files are netCDF3 files reduced by ncks. Files reduced by
+            # reduce_wrf.py are compressed netCDF4 files, which are never gzipped
+            possible_names = [
+                f"mem{mem}/wrfoutred/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
+                f"mem{mem}/wrfoutred/wrfout_d02_red_{lead.strftime(date_fmt)}",
+                f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
+                f"mem{mem}/wrf/wrfout_d02_{lead.strftime(date_fmt)}",
+                f"mem{mem}/wrfout_d02_{lead.strftime(date_fmt)}.gz",
+                f"mem{mem}/wrfout_d02_{lead.strftime(date_fmt)}",
+                f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}.gz",
+                f"mem{mem}/wrfout_d02_red_{lead.strftime(date_fmt)}",
+            ]
+
+            if fields is None:
+                log.info(f"Opening WRF member file {mem}")
+                file = ""
                 for name in possible_names:
-                    name = name.replace(
-                        lead.strftime(date_fmt),
-                        (lead - pd.Timedelta(1, unit="hour")).strftime(date_fmt),
-                    )
-                    if (directory / name).exists():
-                        file_prev = name
+                    if exists(directory / name):
+                        file = name
                         break
+
                 try:
-                    ds_prev = xr.open_dataset(directory / file_prev).sel(Time=0)
-                    precip_prev = (ds_prev.RAINC + ds_prev.RAINNC).values * units(
-                        ds_prev.RAINNC.units
-                    )
+                    with profiling.span("open member", member=mem):
+                        ds = xr.open_dataset(directory / file).sel(Time=0)
                 except (FileNotFoundError, OSError):
-                    log.error(f"Could not open file {directory / file_prev}")
+                    log.error(f"None of the following files were found in {directory}:")
+                    for name in possible_names:
+                        log.error(name)
                     exit(1)
 
-            members_precip[f"mem{mem}"] = precip - precip_prev
-            members_uh[f"mem{mem}"] = ds.UP_HELI_MAX.values * units(
-                ds.UP_HELI_MAX.units
-            )
-            members_refl[f"mem{mem}"] = np.max(ds.REFL_10CM.values, axis=0)
-
-        # Handle 6-hourly surface variables
-        # ---------------------------------------------------------------------
-        if fhour % 6 == 0:
-            log.info(f"Working on surface variables for hour {fhour}")
-            t2 = ds.T2.values * units(ds.T2.units)
-            psfc = ds.PSFC.values * units(ds.PSFC.units)
-            qv2 = ds.Q2.values * units(ds.Q2.units)
-            u10 = ds.U10.values
-            v10 = ds.V10.values
-
-            spec_h2 = mpcalc.specific_humidity_from_mixing_ratio(qv2)
-            u10earth, v10earth = wrfpost.earth_relative_winds(
-                u10, v10, ref.SINALPHA, ref.COSALPHA
-            )
-            u10earth = u10earth.values * units(ds.U10.units)
-            v10earth = v10earth.values * units(ds.V10.units)
-
-            # Sea level pressure requires 3-D model variables to calculate
-            p = (ref.PB + ds.P).values * units(ds.P.units)
-            gpot = wrfpost.destagger(ref.PHB.values + ds.PH.values, 0) * units(
-                ds.PH.units
-            )
-            theta = (ds.T + ref.T00).values * units(ds.T.units)
-            qv = ds.QVAPOR.values * units(ds.QVAPOR.units)
-
-            z = mpcalc.geopotential_to_height(gpot)
-            t = mpcalc.temperature_from_potential_temperature(p, theta)
-
-            try:
-                mslp = wrf.slp(
-                    z.to("meter").m,
-                    t.to("kelvin").m,
-                    p.to("pascal").m,
-                    qv.m,
-                    units="hPa",
-                ).values * units("hPa")
-            except wrf.DiagnosticError:
-                log.error(
-                    f"Error when calculating SLP for member {mem} and hour {fhour}"
+                if path_ref is None:
+                    logging.debug(
+                        "No argument given for WRF reference file. "
+                        "Looking for base state variables in input dataset"
+                    )
+                    ref = ds
+
+                # 3-D fields are calculated once and shared by surface and upper air
+                cache = diagnostics.FieldCache(ds, ref, winds)
+                fields = {}
+                if fhour >= 1 and not skip_convective:
+                    with profiling.span("convective fields", member=mem):
+                        fields.update(diagnostics.convective_fields(ds))
+                if fhour % 6 == 0:
+                    log.info(f"Working on surface variables for hour {fhour}")
+                    with profiling.span("surface fields", member=mem):
+                        fields.update(diagnostics.surface_fields(ds, ref, cache=cache))
+                if fhour % 12 == 0:
+                    log.info(f"Working on upper air variables for hour {fhour}")
+                    with profiling.span("upper fields", member=mem):
+                        fields.update(
+                            diagnostics.upper_fields(ds, ref, levels, cache=cache)
+                        )
+
+                if validate_units:
+                    with profiling.span("validate units", member=mem):
+                        reference = {}
+                        if fhour >= 1 and not skip_convective:
+                            reference.update(diagnostics.convective_fields_pint(ds))
+                        if fhour % 6 == 0:
+                            reference.update(diagnostics.surface_fields_pint(ds, ref))
+                        if fhour % 12 == 0:
+                            reference.update(
+                                diagnostics.upper_fields_pint(ds, ref, levels)
+                            )
+                        diagnostics.validate_fields(fields, reference)
+
+            # Handle hourly convective variables
+            # ---------------------------------------------------------------------
+            if fhour >= 1 and not skip_convective:
+                precip = fields["accumulated_precipitation"]
+                # Subtract accumulated precip from the previous forecast hour to get hourly precip
+                lead_prev = (lead - pd.Timedelta(1, unit="hour")).strftime(date_fmt)
+                path_derived_prev = diagnostics.derived_path(
+                    directory / f"mem{mem}/wrfoutred", domain, lead_prev
                 )
-                log.error("Setting SLP to NaN")
-                mslp = np.full_like(t2, np.nan)
-
-            members_t2[f"mem{mem}"] = t2
-            members_u10[f"mem{mem}"] = u10earth
-            members_v10[f"mem{mem}"] = v10earth
-            members_mslp[f"mem{mem}"] = mslp
-            members_dpt2[f"mem{mem}"] = mpcalc.dewpoint_from_specific_humidity(
-                psfc, t2, spec_h2
-            )
-            members_wspd10[f"mem{mem}"] = mpcalc.wind_speed(u10earth, v10earth)
-
-        # Handle 12-hourly upper air variables
-        # ---------------------------------------------------------------------
-        if fhour % 12 == 0:
-            log.info(f"Working on upper air variables for hour {fhour}")
-            u = wrfpost.destagger(ds.U.values, 2) * units(ds.U.units)
-            v = wrfpost.destagger(ds.V.values, 1) * units(ds.V.units)
-            gpot = wrfpost.destagger(ref.PHB.values + ds.PH.values, 0) * units(
-                ds.PH.units
-            )
-            p = (ref.PB + ds.P).values * units(ds.P.units)
-            theta = (ds.T + ref.T00).values * units(ds.T.units)
-            qv = ds.QVAPOR.values * units(ds.QVAPOR.units)
-
-            sinalpha = np.broadcast_to(ref.SINALPHA, u.shape)
-            cosalpha = np.broadcast_to(ref.COSALPHA, u.shape)
-            uearth, vearth = wrfpost.earth_relative_winds(u, v, sinalpha, cosalpha)
-            t = mpcalc.temperature_from_potential_temperature(p, theta)
-            spec_h = mpcalc.specific_humidity_from_mixing_ratio(qv)
-            dpt = mpcalc.dewpoint_from_specific_humidity(p, t, spec_h)
-            wspd = mpcalc.wind_speed(uearth, vearth)
-            z = mpcalc.geopotential_to_height(gpot)
-
-            t850 = (mpinterp.interpolate_to_isosurface(p, t, levels[0])).to("kelvin")
-            t700 = (mpinterp.interpolate_to_isosurface(p, t, levels[1])).to("kelvin")
-            t500 = (mpinterp.interpolate_to_isosurface(p, t, levels[2])).to("kelvin")
-            t300 = (mpinterp.interpolate_to_isosurface(p, t, levels[3])).to("kelvin")
-
-            u850 = (mpinterp.interpolate_to_isosurface(p, uearth, levels[0])).to("m/s")
-            u700 = (mpinterp.interpolate_to_isosurface(p, uearth, levels[1])).to("m/s")
-            u500 = (mpinterp.interpolate_to_isosurface(p, uearth, levels[2])).to("m/s")
-            u300 = (mpinterp.interpolate_to_isosurface(p, uearth, levels[3])).to("m/s")
-
-            v850 = (mpinterp.interpolate_to_isosurface(p, vearth, levels[0])).to("m/s")
-            v700 = (mpinterp.interpolate_to_isosurface(p, vearth, levels[1])).to("m/s")
-            v500 = (mpinterp.interpolate_to_isosurface(p, vearth, levels[2])).to("m/s")
-            v300 = (mpinterp.interpolate_to_isosurface(p, vearth, levels[3])).to("m/s")
-
-            wspd850 = (mpinterp.interpolate_to_isosurface(p, wspd, levels[0])).to("m/s")
-            wspd700 = (mpinterp.interpolate_to_isosurface(p, wspd, levels[1])).to("m/s")
-            wspd500 = (mpinterp.interpolate_to_isosurface(p, wspd, levels[2])).to("m/s")
-            wspd300 = (mpinterp.interpolate_to_isosurface(p, wspd, levels[3])).to("m/s")
-
-            z850 = (mpinterp.interpolate_to_isosurface(p, z, levels[0])).to("meter")
-            z700 = (mpinterp.interpolate_to_isosurface(p, z, levels[1])).to("meter")
-            z500 = (mpinterp.interpolate_to_isosurface(p, z, levels[2])).to("meter")
-            z300 = (mpinterp.interpolate_to_isosurface(p, z, levels[3])).to("meter")
-
-            dpt850 = (mpinterp.interpolate_to_isosurface(p, dpt, levels[0])).to(
-                "kelvin"
-            )
-            dpt700 = (mpinterp.interpolate_to_isosurface(p, dpt, levels[1])).to(
-                "kelvin"
-            )
-            dpt500 = (mpinterp.interpolate_to_isosurface(p, dpt, levels[2])).to(
-                "kelvin"
-            )
-            dpt300 = (mpinterp.interpolate_to_isosurface(p, dpt, levels[3])).to(
-                "kelvin"
-            )
-
-            members_temperature[f"mem{mem}"] = np.stack(
-                [t850, t700, t500, t300], axis=0
-            )
-            members_u[f"mem{mem}"] = np.stack([u850, u700, u500, u300], axis=0)
-            members_v[f"mem{mem}"] = np.stack([v850, v700, v500, v300], axis=0)
-            members_wspd[f"mem{mem}"] = np.stack(
-                [wspd850, wspd700, wspd500, wspd300], axis=0
-            )
-            members_z[f"mem{mem}"] = np.stack([z850, z700, z500, z300], axis=0)
-            members_dpt[f"mem{mem}"] = np.stack(
-                [dpt850, dpt700, dpt500, dpt300], axis=0
-            )
+                if fhour == 1:
+                    precip_prev = np.zeros_like(precip)
+                elif exists(path_derived_prev):
+                    with profiling.span("previous precipitation", member=mem):
+                        with xr.open_dataset(path_derived_prev) as ds_prev:
+                            precip_prev = fastunits.convert(
+                                ds_prev.accumulated_precipitation.values,
+                                ds_prev.accumulated_precipitation.units,
+                                field_units["accumulated_precipitation"],
+                            )
+                else:
+                    file_prev = ""
+                    for name in possible_names:
+                        name = name.replace(lead.strftime(date_fmt), lead_prev)
+                        if exists(directory / name):
+                            file_prev = name
+                            break
+                    try:
+                        with profiling.span("previous precipitation", member=mem):
+                            ds_prev = xr.open_dataset(directory / file_prev).sel(Time=0)
+                            precip_prev = fastunits.convert(
+                                (ds_prev.RAINC + ds_prev.RAINNC).values,
+                                ds_prev.RAINNC.units,
+                                field_units["accumulated_precipitation"],
+                            )
+                    except (FileNotFoundError, OSError):
+                        log.error(f"Could not open file {directory / file_prev}")
+                        exit(1)
+
+                members_precip[f"mem{mem}"] = precip - precip_prev
+                members_uh[f"mem{mem}"] = fields["updraft_helicity"]
+                members_refl[f"mem{mem}"] = fields["reflectivity"]
+
+            # Handle 6-hourly surface variables
+            # ---------------------------------------------------------------------
+            if fhour % 6 == 0:
+                members_t2[f"mem{mem}"] = fields["temperature_2_meter"]
+                members_u10[f"mem{mem}"] = fields["u_wind_component_10_meter"]
+                members_v10[f"mem{mem}"] = fields["v_wind_component_10_meter"]
+                members_mslp[f"mem{mem}"] = fields["mean_sea_level_pressure"]
+                members_dpt2[f"mem{mem}"] = fields["dewpoint_temperature_2_meter"]
+                members_wspd10[f"mem{mem}"] = fields["wind_speed_10_meter"]
+
+                with profiling.span("ensemble moments", member=mem):
+                    for name in surface_names:
+                        moments_surface[name].update(fields[name])
+
+            # Handle 12-hourly upper air variables
+            # ---------------------------------------------------------------------
+            if fhour % 12 == 0:
+                members_temperature[f"mem{mem}"] = fields["temperature"]
+                members_u[f"mem{mem}"] = fields["u_wind_component"]
+                members_v[f"mem{mem}"] = fields["v_wind_component"]
+                members_wspd[f"mem{mem}"] = fields["wind_speed"]
+                members_z[f"mem{mem}"] = fields["geopotential_height"]
+                members_dpt[f"mem{mem}"] = fields["dewpoint_temperature"]
+
+                with profiling.span("ensemble moments", member=mem):
+                    for name in upper_names:
+                        moments_upper[name].update(fields[name])
 
     # Save surface variables to file
     # -------------------------------------------------------------------------
@@ -422,17 +437,30 @@ def main():
         for name, vr in zip(surface_names, (t2, u10, v10, wspd10, mslp, dpt2)):
             data_vars[name] = (
                 dims,
-                vr.m,
-                {"description": f'{name.replace("_", " ")}', "units": str(vr.units)},
+                vr,
+                {
+                    "description": f'{name.replace("_", " ")}',
+                    "units": field_units[name],
+                },
             )
+            for product, values in moments_surface[name].results().items():
+                data_vars[f"{name}_ensemble_{product}"] = (
+                    dims[1:],
+                    values,
+                    {
+                        "description": f'ensemble {product} of {name.replace("_", " ")}',
+                        "units": field_units[name],
+                    },
+                )
 
         attrs = {
             "description": "WRF ensemble model output near the surface",
         }
         attrs.update(attrs_all)
 
-        ds_surface = xr.Dataset(data_vars, coords, attrs)
-        ds_surface.to_netcdf(path_save / f"surface_f{str(fhour).zfill(2)}.nc")
+        with profiling.span("write surface"):
+            ds_surface = xr.Dataset(data_vars, coords, attrs)
+            ds_surface.to_netcdf(path_save / f"surface_f{str(fhour).zfill(2)}.nc")
 
     # Save upper air variables to file
     # -------------------------------------------------------------------------
@@ -456,14 +484,26 @@ def main():
         for name, vr in zip(upper_names, (t, u, v, wspd, z, dpt)):
             data_vars[name] = (
                 dims,
-                vr.m,
+                vr,
                 {
                     "description": (
                         f'{name.replace("_", " ")} interpolated to pressuresurfaces'
                     ),
-                    "units": str(vr.units),
+                    "units": field_units[name],
                 },
             )
+            for product, values in moments_upper[name].results().items():
+                data_vars[f"{name}_ensemble_{product}"] = (
+                    dims[1:],
+                    values,
+                    {
+                        "description": (
+                            f'ensemble {product} of {name.replace("_", " ")} '
+                            "interpolated to pressure surfaces"
+                        ),
+                        "units": field_units[name],
+                    },
+                )
 
         attrs = {
             "description": (
@@ -472,8 +512,9 @@ def main():
         }
         attrs.update(attrs_all)
 
-        ds_upper = xr.Dataset(data_vars, coords, attrs)
-        ds_upper.to_netcdf(path_save / f"upper_f{str(fhour).zfill(2)}.nc")
+        with profiling.span("write upper"):
+            ds_upper = xr.Dataset(data_vars, coords, attrs)
+            ds_upper.to_netcdf(path_save / f"upper_f{str(fhour).zfill(2)}.nc")
 
     # Calculate probabilities for convective variables and save member and
     # probabilistic forecasts to file for non-zero forecast hours
@@ -491,56 +532,123 @@ def main():
             "x": ref.west_east.values,
         }
         data_vars = {}
+        data_vars_exceedance = {}
+
+        def packed_exceedance(fields, thresh):
+            # Member exceedance for each radius, with shape (member byte, radius, y, x)
+            packed = []
+            for radius in radii.m:
+                with profiling.span("exceedance", radius=float(radius)):
+                    exceeds = exceedance.exceedance(fields, thresh, radius)
+                    packed.append(exceedance.pack(exceeds))
+            return np.stack(packed, axis=1)
+
+        def add_exceedance(name, packed, thresh, unit, description):
+            data_vars_exceedance[f"exceedance_{name}"] = (
+                ["member_byte", "radius", "y", "x"],
+                packed,
+                {"description": description, "threshold": thresh, "units": unit},
+            )
+            with profiling.span("nmep"):
+                return exceedance.nmep(packed, nmem)
+
+        def add_nep(name, fields, thresh, description):
+            with profiling.span("nep"):
+                probs = exceedance.nep(fields, thresh, radii.m)
+            data_vars[f"nep_{name}"] = (
+                dims,
+                probs,
+                {"description": description, "units": "percent"},
+            )
 
         for thresh in thresholds["precipitation"]:
-            probs = {}
-            for radius in radii:
-                thresh = thresh.to(precip.units)
-                probs[f"{radius.m}"] = probcalc_numpy.nmep(precip.m, radius.m, thresh.m)
+            thresh = thresh.to(field_units["accumulated_precipitation"])
+            name = f'precipitation_{str(thresh.m).replace(".", "_")}'
+            packed = packed_exceedance(precip, thresh.m)
 
             description = (
                 f"NMEPs for 1-hour accumulated precipitation >= {thresh} {thresh.units}"
             )
-            data_vars[f'nmep_precipitation_{str(thresh.m).replace(".", "_")}'] = (
+            probs = add_exceedance(
+                name,
+                packed,
+                thresh.m,
+                field_units["accumulated_precipitation"],
+                "Member neighborhood exceedance of 1-hour accumulated precipitation "
+                f">= {thresh}",
+            )
+            data_vars[f"nmep_{name}"] = (
                 dims,
-                np.stack([v for v in probs.values()]),
-                {"description": description, "units": str(probs.values[0].units)},
+                probs,
+                {"description": description, "units": "percent"},
+            )
+            add_nep(
+                name,
+                precip,
+                thresh.m,
+                f"NEPs for 1-hour accumulated precipitation >= {thresh}",
             )
 
         for thresh in thresholds["reflectivity"]:
-            probs = {}
-            for radius in radii:
-                probs[f"{radius.m}"] = probcalc_numpy.nmep(refl, radius.m, thresh)
+            name = f'reflectivity_{str(thresh).replace(".", "_")}'
+            packed = packed_exceedance(refl, thresh)
 
             description = f"NMEPs for column maximum reflectivity >= {thresh} dBZ"
-            data_vars[f'nmep_reflectivity_{str(thresh).replace(".", "_")}'] = (
+            probs = add_exceedance(
+                name,
+                packed,
+                thresh,
+                "dBZ",
+                "Member neighborhood exceedance of column maximum reflectivity "
+                f">= {thresh} dBZ",
+            )
+            data_vars[f"nmep_{name}"] = (
                 dims,
-                np.stack([v for v in probs.values()]),
-                {"description": description, "units": str(probs.values[0].units)},
+                probs,
+                {"description": description, "units": "percent"},
+            )
+            add_nep(
+                name,
+                refl,
+                thresh,
+                f"NEPs for column maximum reflectivity >= {thresh} dBZ",
             )
 
         for thresh in thresholds["updraft_helicity"]:
-            probs = {}
-            for radius in radii:
-                thresh = thresh.to(uh.units)
-                probs[f"{radius.m}"] = probcalc_numpy.nmep(uh.m, radius.m, thresh.m)
+            thresh = thresh.to(field_units["updraft_helicity"])
+            name = f'updraft_helicity_{str(thresh.m).replace(".", "_")}'
+            packed = packed_exceedance(uh, thresh.m)
 
             description = (
                 f"NMEPs for hourly maximum updraft helicity >= {thresh} {thresh.units}"
             )
-            data_vars[f'nmep_updraft_helicity_{str(thresh.m).replace(".", "_")}'] = (
+            probs = add_exceedance(
+                name,
+                packed,
+                thresh.m,
+                field_units["updraft_helicity"],
+                "Member neighborhood exceedance of hourly maximum updraft helicity "
+                f">= {thresh}",
+            )
+            data_vars[f"nmep_{name}"] = (
                 dims,
-                np.stack([v for v in probs.values()]),
-                {"description": description, "units": str(probs.values[0].units)},
+                probs,
+                {"description": description, "units": "percent"},
+            )
+            add_nep(
+                name,
+                uh,
+                thresh.m,
+                f"NEPs for hourly maximum updraft helicity >= {thresh}",
             )
 
         dims = ["member", "y", "x"]
         data_vars["precipitation"] = (
             dims,
-            precip.m,
+            precip,
             {
                 "description": "1-hour accumulated precipitation",
-                "units": str(precip.units),
+                "units": field_units["accumulated_precipitation"],
             },
         )
         data_vars["reflectivity"] = (
@@ -550,25 +658,47 @@ def main():
         )
         data_vars["updraft_helicity"] = (
             dims,
-            uh.m,
-            {"description": "Hourly maximum updraft helicity", "units": str(uh.units)},
+            uh,
+            {
+                "description": "Hourly maximum updraft helicity",
+                "units": field_units["updraft_helicity"],
+            },
         )
 
         attrs = {
             "description": (
-                "Raw WRF ensemble member convective forecasts and neighborhood maximum"
-                " ensemble probability forecasts."
+                "Raw WRF ensemble member convective forecasts, neighborhood maximum"
+                " ensemble probability forecasts, and neighborhood ensemble probability"
+                " forecasts."
             )
         }
         attrs.update(attrs_all)
 
-        ds_convective = xr.Dataset(data_vars, coords, attrs)
-        ds_convective.to_netcdf(path_save / f"convective_f{str(fhour).zfill(2)}.nc")
+        with profiling.span("write convective"):
+            ds_convective = xr.Dataset(data_vars, coords, attrs)
+            ds_convective.to_netcdf(path_save / f"convective_f{str(fhour).zfill(2)}.nc")
+
+        attrs = {
+            "description": (
+                "Neighborhood exceedance of WRF ensemble members, packed into bytes along"
+                " the member dimension with numpy.packbits (member 1 is the most"
+                " significant bit of the first byte). Use exceedance.py to calculate"
+                " NMEPs of subsets of members."
+            ),
+            "nmem": nmem,
+        }
+        attrs.update(attrs_all)
+        coords_exceedance = {name: coords[name] for name in ("radius", "y", "x")}
+
+        with profiling.span("write exceedance"):
+            ds_exceedance = xr.Dataset(data_vars_exceedance, coords_exceedance, attrs)
+            ds_exceedance.to_netcdf(
+                path_save / f"exceedance_f{str(fhour).zfill(2)}.nc",
+                encoding={name: {"zlib": True} for name in data_vars_exceedance},
+            )
 
     if profile:
-        print("Summary of performance:")
-        print(f"Total run time: {pd.Timestamp.now() - time_start}")
-        print_memory_use()
+        profiling.stop(path_profile)
 
 
 if __name__ == "__main__":
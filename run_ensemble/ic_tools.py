@@ -0,0 +1,282 @@
+# =============================================================================
+# ic_tools.py
+# -----------------------------------------------------------------------------
+# Functions to read, average, and modify WRF initial condition (wrfinput)
+# files in place of nco operators. Members may be plain or gzipped netCDF
+# files; gzipped files are decompressed into memory so that no scratch copies
+# of member files are needed.
+# =============================================================================
+
+import gzip
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+
+# Prognostic variables of a wrfinput file that define the model state
+PROGNOSTIC_VARIABLES = [
+    "U",
+    "V",
+    "W",
+    "PH",
+    "T",
+    "P",
+    "MU",
+    "QVAPOR",
+    "QCLOUD",
+    "QRAIN",
+    "QICE",
+    "QSNOW",
+    "QGRAUP",
+]
+
+
+def find_member_file(directory, name):
+    """Return the path of a plain or gzipped file in a directory.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Directory containing the file.
+    name : str
+        Name of the file without a .gz extension.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the plain file if it exists, otherwise the gzipped file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If neither the plain nor the gzipped file exists.
+    """
+    path = Path(directory) / name
+    if path.exists():
+        return path
+    if path.with_name(f"{name}.gz").exists():
+        return path.with_name(f"{name}.gz")
+    raise FileNotFoundError(f"Neither {path} nor {path}.gz exist")
+
+
+def read_gzip(path):
+    """Decompress a gzipped file into memory, using pigz when it is available."""
+    pigz = shutil.which("pigz")
+    if pigz is not None:
+        return subprocess.run(
+            [pigz, "-dc", str(path)], check=True, stdout=subprocess.PIPE
+        ).stdout
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+def read_contents(path):
+    """Read the (decompressed) contents of a plain or gzipped file into memory."""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return read_gzip(path)
+    return path.read_bytes()
+
+
+def open_wrfinput(path, contents=None):
+    """Open a plain or gzipped wrfinput file for reading.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a wrfinput file. Files ending in .gz are decompressed into memory.
+    contents : bytes (optional)
+        Contents of the file if already read into memory, e.g. with `read_contents`.
+
+    Returns
+    -------
+    netCDF4.Dataset
+    """
+    path = Path(path)
+    if contents is None and path.suffix == ".gz":
+        contents = read_gzip(path)
+    if contents is not None:
+        nc = netCDF4.Dataset(path.stem, mode="r", memory=contents)
+    else:
+        nc = netCDF4.Dataset(path, mode="r")
+    nc.set_auto_mask(False)
+    return nc
+
+
+def iter_contents(paths):
+    """Read (and decompress) files one at a time, prefetching the next file in a
+    background thread while the current file is being used.
+
+    Parameters
+    ----------
+    paths : list of str or pathlib.Path
+        Paths to plain or gzipped files.
+
+    Yields
+    ------
+    path : str or pathlib.Path
+        Path to the file.
+    contents : bytes
+        Decompressed contents of the file.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(read_contents, paths[0]) if paths else None
+        for i, path in enumerate(paths):
+            contents = future.result()
+            if i + 1 < len(paths):
+                future = pool.submit(read_contents, paths[i + 1])
+            yield path, contents
+
+
+def available_variables(path, variables):
+    """Return the subset of variables that exist in a wrfinput file."""
+    with open_wrfinput(path) as nc:
+        return [var for var in variables if var in nc.variables]
+
+
+def float_variables(path):
+    """Return the names of all floating point variables in a wrfinput file."""
+    with open_wrfinput(path) as nc:
+        return [
+            name
+            for name, var in nc.variables.items()
+            if np.issubdtype(var.dtype, np.floating)
+        ]
+
+
+def read_variables(path, variables):
+    """Read variables from a plain or gzipped wrfinput file as float64 arrays."""
+    with open_wrfinput(path) as nc:
+        return {var: nc.variables[var][:].astype(np.float64) for var in variables}
+
+
+def ensemble_mean(paths, variables):
+    """Calculate the ensemble mean of variables from wrfinput files.
+
+    Members are read one at a time and accumulated as float64 sums, so memory use does
+    not depend on the number of members. The next member is read and decompressed while
+    the current member is accumulated.
+
+    Parameters
+    ----------
+    paths : list of str or pathlib.Path
+        Paths to plain or gzipped member wrfinput files.
+    variables : list of str
+        Names of variables to average.
+
+    Returns
+    -------
+    dict
+        Ensemble mean of each variable as float64 arrays.
+    """
+    sums = {}
+    for path, contents in iter_contents(paths):
+        with open_wrfinput(path, contents) as nc:
+            for var in variables:
+                values = nc.variables[var][:].astype(np.float64)
+                if var in sums:
+                    sums[var] += values
+                else:
+                    sums[var] = values
+    return {var: total / len(paths) for var, total in sums.items()}
+
+
+def write_mean(path_template, path_out, mean):
+    """Write an ensemble mean to a copy of a member wrfinput file.
+
+    Parameters
+    ----------
+    path_template : str or pathlib.Path
+        Path to a plain or gzipped wrfinput file from which all variables not in `mean`
+        are copied.
+    path_out : str or pathlib.Path
+        Path of the ensemble mean wrfinput file to write.
+    mean : dict
+        Ensemble mean of each variable, as returned by `ensemble_mean`.
+    """
+    path_out = Path(path_out)
+    path_out.parent.mkdir(exist_ok=True, parents=True)
+    path_out.write_bytes(read_contents(path_template))
+
+    with netCDF4.Dataset(path_out, "r+") as out:
+        out.set_auto_mask(False)
+        for var, values in mean.items():
+            out.variables[var][:] = values.astype(out.variables[var].dtype)
+
+
+def recenter(path_member, path_analysis, path_out, mean, variables):
+    """Recenter a member about an analysis and write the result to a new wrfinput file.
+
+    The output file is a copy of the analysis where each variable is replaced by the
+    analysis plus the member perturbation from the ensemble mean, i.e.
+    `analysis + (member - mean)`. All other variables are taken from the analysis.
+
+    Parameters
+    ----------
+    path_member : str or pathlib.Path
+        Path to a plain or gzipped member wrfinput file.
+    path_analysis : str or pathlib.Path
+        Path to the analysis wrfinput file to recenter about.
+    path_out : str or pathlib.Path
+        Path of the recentered wrfinput file to write.
+    mean : dict
+        Ensemble mean of each variable, as returned by `ensemble_mean`.
+    variables : list of str
+        Names of variables to recenter.
+    """
+    path_out = Path(path_out)
+    path_out.parent.mkdir(exist_ok=True, parents=True)
+    shutil.copyfile(path_analysis, path_out)
+
+    with open_wrfinput(path_member) as member, netCDF4.Dataset(path_out, "r+") as out:
+        out.set_auto_mask(False)
+        for var in variables:
+            analysis = out.variables[var][:].astype(np.float64)
+            perturbation = member.variables[var][:] - mean[var]
+            out.variables[var][:] = (analysis + perturbation).astype(
+                out.variables[var].dtype
+            )
+
+
+def scale_perturbations(path_member, center, scales, paths_out, variables):
+    """Scale the perturbation of a member from a central state and write the results.
+
+    The member is read once, and for each scale factor s a copy of the member is written
+    where each variable is replaced by `center + s * (member - center)`. All other
+    variables are taken from the member.
+
+    Parameters
+    ----------
+    path_member : str or pathlib.Path
+        Path to a plain or gzipped member wrfinput file.
+    center : dict
+        Central state of each variable as float64 arrays, e.g. from `read_variables` or
+        `ensemble_mean`.
+    scales : list of float
+        Factors by which to scale the member perturbation.
+    paths_out : list of str or pathlib.Path
+        Paths of the scaled wrfinput files to write, one for each scale factor.
+    variables : list of str
+        Names of variables to scale.
+    """
+    contents = read_contents(path_member)
+    with open_wrfinput(path_member, contents) as member:
+        perturbations = {
+            var: member.variables[var][:] - center[var] for var in variables
+        }
+
+    for scale, path_out in zip(scales, paths_out):
+        path_out = Path(path_out)
+        path_out.parent.mkdir(exist_ok=True, parents=True)
+        path_out.write_bytes(contents)
+
+        with netCDF4.Dataset(path_out, "r+") as out:
+            out.set_auto_mask(False)
+            for var in variables:
+                out.variables[var][:] = (
+                    center[var] + scale * perturbations[var]
+                ).astype(out.variables[var].dtype)
@@ -0,0 +1,60 @@
+# =============================================================================
+# calc_mean.py
+#
+# Calculate the ensemble mean of member ICs for every domain without copying or
+# decompressing members to scratch space. Plain or gzipped member wrfinput files are
+# read one at a time from their source directories, with the next member decompressed
+# in the background while the current member is accumulated as a float64 sum.
+#
+# Means are written as <dir_out>/wrfinput_d0<domain>_mean.
+#
+# Requires ic_tools.py from the run_ensemble directory on the PYTHONPATH.
+# =============================================================================
+
+import argparse
+from pathlib import Path
+
+import ic_tools
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate the mean of ensemble ICs")
+    parser.add_argument(
+        "dir_members",
+        type=str,
+        help="Directory containing subdirectories mem<n> with (gzipped) member ICs",
+    )
+    parser.add_argument("dir_out", type=str, help="Directory to write mean ICs to")
+    parser.add_argument(
+        "--nmem", type=int, default=42, help="Number of ensemble members"
+    )
+    parser.add_argument(
+        "--domains", type=int, nargs="+", default=[1, 2], help="WRF domains to average"
+    )
+    parser.add_argument(
+        "--variables",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Variables to average. Default is all floating point variables",
+    )
+
+    args = parser.parse_args()
+    dir_members = Path(args.dir_members)
+    dir_out = Path(args.dir_out)
+    nmem = args.nmem
+    domains = args.domains
+
+    for domain in domains:
+        name = f"wrfinput_d0{domain}"
+        paths_member = [
+            ic_tools.find_member_file(dir_members / f"mem{mem}", name)
+            for mem in range(1, nmem + 1)
+        ]
+        if args.variables is None:
+            variables = ic_tools.float_variables(paths_member[0])
+        else:
+            variables = args.variables
+
+        print(f"Calculating the ensemble mean for domain {domain}...")
+        mean = ic_tools.ensemble_mean(paths_member, variables)
+        ic_tools.write_mean(paths_member[0], dir_out / f"{name}_mean", mean)
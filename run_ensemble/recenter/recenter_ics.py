@@ -0,0 +1,126 @@
+# =============================================================================
+# recenter_ics.py
+#
+# Recenter the perturbations of an existing ensemble (e.g., EnKF members) about a new
+# analysis (e.g., GFS ICs) for every domain. Members are streamed once to calculate the
+# ensemble mean of all --nmem_mean members (e.g., all 42 EnKF members), then the first
+# --nmem members are read once more to write `analysis + (member - mean)` directly into
+# the recentered wrfinput files, replacing the nces/ncbo chain of calc_mean.bash and
+# sub_recenter_ics.bash. Only prognostic variables are modified and members are
+# recentered in parallel.
+#
+# Recentered files are written as <dir_exp>/mem<n>/wrf/wrfinput_d0<domain>.
+#
+# Requires ic_tools.py from the run_ensemble directory on the PYTHONPATH.
+# =============================================================================
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import ic_tools
+
+# Ensemble mean of the domain being recentered, shared with forked worker processes
+_mean = {}
+
+
+def _recenter_member(path_member, path_analysis, path_out, variables):
+    ic_tools.recenter(path_member, path_analysis, path_out, _mean, variables)
+    return path_out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recenter ensemble member ICs about an analysis"
+    )
+    parser.add_argument(
+        "dir_members",
+        type=str,
+        help="Directory containing subdirectories mem<n> with (gzipped) member ICs",
+    )
+    parser.add_argument(
+        "dir_analysis", type=str, help="Directory containing the analysis ICs"
+    )
+    parser.add_argument(
+        "dir_exp",
+        type=str,
+        help="Experiment directory in which to write mem<n>/wrf/wrfinput_d0<domain>",
+    )
+    parser.add_argument(
+        "--nmem",
+        type=int,
+        default=42,
+        help="Number of ensemble members to recenter (members 1 to nmem)",
+    )
+    parser.add_argument(
+        "--nmem_mean",
+        type=int,
+        default=42,
+        help=(
+            "Number of ensemble members the mean is calculated over (members 1 to "
+            "nmem_mean), which may be more than are recentered"
+        ),
+    )
+    parser.add_argument(
+        "--domains", type=int, nargs="+", default=[1, 2], help="WRF domains to recenter"
+    )
+    parser.add_argument(
+        "--variables",
+        type=str,
+        nargs="+",
+        default=ic_tools.PROGNOSTIC_VARIABLES,
+        help="Variables to recenter. Variables not found in the ICs are skipped",
+    )
+    parser.add_argument(
+        "--nprocs",
+        type=int,
+        default=int(os.getenv("SLURM_NTASKS", 1)),
+        help="Number of members to recenter in parallel",
+    )
+
+    args = parser.parse_args()
+    dir_members = Path(args.dir_members)
+    dir_analysis = Path(args.dir_analysis)
+    dir_exp = Path(args.dir_exp)
+    nmem = args.nmem
+    nmem_mean = args.nmem_mean
+    domains = args.domains
+    nprocs = args.nprocs
+
+    if nmem > nmem_mean:
+        parser.error("--nmem cannot exceed --nmem_mean")
+
+    members = range(1, nmem + 1)
+    members_mean = range(1, nmem_mean + 1)
+
+    for domain in domains:
+        name = f"wrfinput_d0{domain}"
+        path_analysis = dir_analysis / name
+        paths_mean = [
+            ic_tools.find_member_file(dir_members / f"mem{mem}", name)
+            for mem in members_mean
+        ]
+        paths_member = paths_mean[:nmem]
+        variables = ic_tools.available_variables(path_analysis, args.variables)
+
+        print(f"Calculating the {nmem_mean}-member mean for domain {domain}...")
+        _mean.clear()
+        _mean.update(ic_tools.ensemble_mean(paths_mean, variables))
+
+        print(f"Recentering {nmem} members for domain {domain}...")
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(nprocs, mp_context=context) as pool:
+            futures = [
+                pool.submit(
+                    _recenter_member,
+                    path_member,
+                    path_analysis,
+                    dir_exp / f"mem{mem}" / "wrf" / name,
+                    variables,
+                )
+                for mem, path_member in zip(members, paths_member)
+            ]
+            for future in futures:
+                print(f"Wrote {future.result()}")
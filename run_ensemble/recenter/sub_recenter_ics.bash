@@ -13,6 +13,7 @@
 #
 # Generate initial conditions for an ensemble by differencing out perturbations
 # from the mean of an existing ensemble, then adding those to a new analysis.
+# Recentering is done in a single Python pass per domain by recenter_ics.py.
 #
 # Parameters
 # ----------
@@ -27,7 +28,9 @@ date_init=$2
 source $param
 
 NUM_MEM=2
-nco=/home/rmanser/software/miniconda3/envs/nco/bin
+# Perturbations are taken about the mean of all EnKF members, not only those recentered
+NUM_MEM_MEAN=42
+pypath=/home/rmanser/software/miniconda3/envs/ensembles/bin/python
 
 # =============================================================================
 # Setup
@@ -35,7 +38,6 @@ nco=/home/rmanser/software/miniconda3/envs/nco/bin
 
 dir_exp=${dir_scratch}/recenter/${date_init}
 dir_gfs=${dir_scratch}/perturb_GFS_fixed/${date_init}/gfs_icbc
-dir_mean=${dir_scratch}/recenter/${date_init}/enkf_mean
 
 # Determine the location of the EnKF files
 if [ $date_init -le $date_research ]; then
@@ -46,59 +48,29 @@ elif [ $date_init -le $date_scratch ]; then
   dir_enkf=$dir_enkf_scratch
 fi
 
-# Make a temporary directory for calculating perturbations
-mkdir ${dir_exp}/perturbations
-cd ${dir_exp}/perturbations
-
-# Copy control member forecast (GFS ICs) to re-centered member 1 wrf directory
-cp ${dir_gfs}/wrfinput_d01 ${dir_exp}/perturbations/wrfinput_d01_gfs
-cp ${dir_gfs}/wrfinput_d02 ${dir_exp}/perturbations/wrfinput_d02_gfs
+# =============================================================================
+# Recenter EnKF perturbations about the GFS ICs for both domains. Members are read
+# directly (zipped or not) from the EnKF directory, so no copies are needed.
+# =============================================================================
 
-# Calculate the EnKF mean and do not delete the member ICs
-${dir_base}/run_ensemble/recenter/calc_mean.bash $param $date_init
+echo "Recentering EnKF members about GFS ICs..."
+PYTHONPATH=${dir_base}/run_ensemble ${pypath} \
+${dir_base}/run_ensemble/recenter/recenter_ics.py ${dir_enkf}/${date_init} ${dir_gfs} \
+${dir_exp} --nmem $NUM_MEM --nmem_mean $NUM_MEM_MEAN --domains 1 2 --nprocs $SLURM_NTASKS
 
 # =============================================================================
-# Loop over EnKF members and do the following:
-# 1) Calculate EnKF perturbations by subtracting the EnKF mean from each EnKF member
-# 2) Add EnKF perturbations to GFS ICs to get re-centered ICs
-# 3) Copy EnKF BCs to respective re-centered member directories, and update them
+# Loop over EnKF members and copy EnKF BCs to respective re-centered member
+# directories, then update them
 # =============================================================================
 
 for mem in `seq 1 $NUM_MEM`; do
   echo "Working on member "${mem}"..."
 
-  #
-  # 1) Calculate perturbations by subtracting the mean from each member
-  #
-
-  echo "Calculating perturbations..."
-  ${nco}/ncbo --op_typ='-' -O ${dir_mean}/wrfinput_d01_mem${mem} \
-  ${dir_mean}/wrfinput_d01_mean \
-  ${dir_exp}/perturbations/wrfinput_d01_pert_mem${mem}
-
-  ${nco}/ncbo --op_typ='-' -O ${dir_mean}/wrfinput_d02_mem${mem} \
-  ${dir_mean}/wrfinput_d02_mean \
-  ${dir_exp}/perturbations/wrfinput_d02_pert_mem${mem}
-
-  #
-  # 2) Add perturbations to analysis ICs to get re-centered ICs
-  #
-
   # Input for domain 1 is named wrfvar_output so make_namelist_updatebc.bash can be reused...
-  echo "Calculating new initial conditions..."
-
-  ${nco}/ncbo --op_typ='+' -O ${dir_exp}/perturbations/wrfinput_d01_pert_mem${mem} \
-  ${dir_exp}/perturbations/wrfinput_d01_gfs ${dir_exp}/mem${mem}/wrf/wrfvar_output
-
-  ${nco}/ncbo --op_typ='+' -O ${dir_exp}/perturbations/wrfinput_d02_pert_mem${mem} \
-  ${dir_exp}/perturbations/wrfinput_d02_gfs ${dir_exp}/mem${mem}/wrf/wrfinput_d02
+  mv ${dir_exp}/mem${mem}/wrf/wrfinput_d01 ${dir_exp}/mem${mem}/wrf/wrfvar_output
 
   cd ${dir_exp}/mem${mem}/wrf
 
-  #
-  # 3) Copy BCs to respective re-centered member directories and update them
-  #
-
   echo "Copying BCs to "${dir_exp}/mem${mem}/wrf"..."
   if [ -e "${dir_enkf}/${date_init}/mem${mem}/wrfbdy_d01" ]; then
     ext=""
@@ -123,9 +95,4 @@ for mem in `seq 1 $NUM_MEM`; do
   ${dir_exp}/mem${mem}/wrf/wrfinput_d01
   unlink ${dir_exp}/mem${mem}/wrf/da_update_bc.exe
   rm ${dir_exp}/mem${mem}/wrf/fort.1?
-  rm ${dir_mean}/wrfinput_d01_mem${mem}
-  rm ${dir_mean}/wrfinput_d02_mem${mem}
 done
-
-echo "Removing directory "${dir_exp}/perturbations"..."
-rm -rf ${dir_exp}/perturbations
@@ -0,0 +1,138 @@
+# =============================================================================
+# scale_perturbations.py
+#
+# Scale ensemble IC perturbations about a central state for one or more scale factors,
+# replacing the ncbo/ncap2 chain of sub_scale_perturbations.bash. Each member wrfinput
+# file is read once per domain, and `center + scale * (member - center)` is written for
+# every scale factor. Members are scaled in parallel.
+#
+# The central state is either a wrfinput file (e.g., GFS ICs for the recenter
+# experiment) or the ensemble mean of the members (e.g., for downscale_GEFS). Scaled ICs
+# are written as <dir_out>/mem<n>/wrf/wrfinput_d0<domain>, where "{scale}" in dir_out is
+# replaced by the scale factor without decimal points.
+# =============================================================================
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import ic_tools
+
+# Central state of the domain being scaled, shared with forked worker processes
+_center = {}
+
+
+def _scale_member(path_member, scales, paths_out, variables):
+    ic_tools.scale_perturbations(path_member, _center, scales, paths_out, variables)
+    return paths_out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scale ensemble IC perturbations about a central state"
+    )
+    parser.add_argument(
+        "dir_exp",
+        type=str,
+        help="Directory containing subdirectories mem<n> with (gzipped) member ICs",
+    )
+    parser.add_argument(
+        "dir_out",
+        type=str,
+        help=(
+            "Directory in which to write scaled ICs, where {scale} is replaced by the "
+            "scale factor without decimal points, e.g. /path/to/recenter_scaled_{scale}"
+        ),
+    )
+    parser.add_argument(
+        "scales",
+        type=str,
+        nargs="+",
+        help="Factors by which to scale perturbations",
+    )
+    parser.add_argument(
+        "--dir_center",
+        type=str,
+        default=None,
+        help=(
+            "Directory containing central state ICs. If None, the ensemble mean of the "
+            "members is used"
+        ),
+    )
+    parser.add_argument(
+        "--subdir",
+        type=str,
+        default="wrfoutred",
+        help="Subdirectory of each member directory containing ICs",
+    )
+    parser.add_argument(
+        "--nmem", type=int, default=42, help="Number of ensemble members"
+    )
+    parser.add_argument(
+        "--domains", type=int, nargs="+", default=[1, 2], help="WRF domains to scale"
+    )
+    parser.add_argument(
+        "--variables",
+        type=str,
+        nargs="+",
+        default=["U", "V", "PH", "T", "MU", "QVAPOR"],
+        help="Variables to scale",
+    )
+    parser.add_argument(
+        "--nprocs",
+        type=int,
+        default=int(os.getenv("SLURM_NTASKS", 1)),
+        help="Number of members to scale in parallel",
+    )
+
+    args = parser.parse_args()
+    dir_exp = Path(args.dir_exp)
+    dir_out = args.dir_out
+    scales = [float(scale) for scale in args.scales]
+    dirs_out = [
+        Path(dir_out.format(scale=scale.replace(".", ""))) for scale in args.scales
+    ]
+    dir_center = args.dir_center
+    subdir = args.subdir
+    nmem = args.nmem
+    domains = args.domains
+    variables = args.variables
+    nprocs = args.nprocs
+
+    for domain in domains:
+        name = f"wrfinput_d0{domain}"
+        paths_member = {}
+        for mem in range(1, nmem + 1):
+            try:
+                paths_member[mem] = ic_tools.find_member_file(
+                    dir_exp / f"mem{mem}" / subdir, name
+                )
+            except FileNotFoundError as err:
+                print(f"*** WARNING: {err}")
+
+        if dir_center is None:
+            print(f"Calculating the ensemble mean for domain {domain}...")
+            center = ic_tools.ensemble_mean(list(paths_member.values()), variables)
+        else:
+            center = ic_tools.read_variables(Path(dir_center) / name, variables)
+        _center.clear()
+        _center.update(center)
+
+        print(f"Scaling {len(paths_member)} members for domain {domain}...")
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(nprocs, mp_context=context) as pool:
+            futures = [
+                pool.submit(
+                    _scale_member,
+                    path_member,
+                    scales,
+                    [d / f"mem{mem}" / "wrf" / name for d in dirs_out],
+                    variables,
+                )
+                for mem, path_member in paths_member.items()
+            ]
+            for future in futures:
+                for path in future.result():
+                    print(f"Wrote {path}")
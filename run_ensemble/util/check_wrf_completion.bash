@@ -1,10 +1,13 @@
 #!/bin/bash
 
-# Checks if a wrf run completed by looking for the final forecast time
+# Checks if a wrf run completed by looking for the final forecast time. If a SQLite
+# manifest is given as the fourth argument, it is updated and queried instead (see
+# manifest.py)
 
 exp=$1
 date_start=$2
 num_mem=${3:-42}
+path_manifest=${4:-""}
 
 source ../WRF_param_realtime_ens.bash
 
@@ -22,17 +25,29 @@ dir_log=${dir_base}/log
 
 mkdir -p ${dir_log}/failed
 
-for mem in `seq 1 ${num_mem}` ; do
-
-  dir_mem=${dir_exp}/${date_start}/mem${mem}/wrf
-
-  if [ ! -e "${dir_mem}/wrfout_d02_${ryear}-${rmonth}-${rday}_${rhour}:00:00" ] ; then
-    echo "Member ${mem} failed!"
-    if [ -e "${dir_log}/wrf_error_${date_start}_mem${mem}" ] ; then
-      mv ${dir_log}/wrf_error_${date_start}_mem${mem} ${dir_log}/failed
-    fi
-    if [ -e "${dir_log}/wrf_out_${date_start}_mem${mem}" ] ; then
-      mv ${dir_log}/wrf_out_${date_start}_mem${mem} ${dir_log}/failed
+if [ -n "${path_manifest}" ] ; then
+  # Index this forecast and find failed members with one query instead of checking for
+  # the final forecast file of every member
+  python ${dir_base}/manifest.py update ${path_manifest} ${dir_scratch} \
+  --only ${exp}/${date_start}
+  failed=`python ${dir_base}/manifest.py missing ${path_manifest} ${exp} ${date_start} \
+  --nmem ${num_mem} --hour 48 --domain 2`
+else
+  failed=""
+  for mem in `seq 1 ${num_mem}` ; do
+    dir_mem=${dir_exp}/${date_start}/mem${mem}/wrf
+    if [ ! -e "${dir_mem}/wrfout_d02_${ryear}-${rmonth}-${rday}_${rhour}:00:00" ] ; then
+      failed="${failed} ${mem}"
     fi
+  done
+fi
+
+for mem in ${failed} ; do
+  echo "Member ${mem} failed!"
+  if [ -e "${dir_log}/wrf_error_${date_start}_mem${mem}" ] ; then
+    mv ${dir_log}/wrf_error_${date_start}_mem${mem} ${dir_log}/failed
+  fi
+  if [ -e "${dir_log}/wrf_out_${date_start}_mem${mem}" ] ; then
+    mv ${dir_log}/wrf_out_${date_start}_mem${mem} ${dir_log}/failed
   fi
 done
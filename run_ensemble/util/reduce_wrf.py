@@ -0,0 +1,369 @@
+# =============================================================================
+# reduce_wrf.py
+#
+# Reduce the WRF output files of an ensemble member to only the variables we care
+# about, replacing the per-file ncks loop of sub_reduce_wrf.sh. Files are reduced in
+# parallel and written as compressed, chunked netCDF4 files. Each reduced file is read
+# back and checked against checksums of the source variables before the source file is
+# deleted.
+#
+# Progress is recorded in a JSON manifest in the output directory, so an interrupted
+# run can be restarted and will skip files that were already reduced.
+#
+# Reduced files are formatted as 'wrfout_d0<domain>_red_<year>-<month>-<day>_<hour>:00:00'
+# and written to a directory 'wrfoutred' within the member directory.
+#
+# Reduced files are compressed internally by netCDF4, so they are not gzipped afterward
+# (zip_ens.bash skips them), since xarray cannot open gzipped netCDF4 files. Reduced
+# files that were gzipped by an earlier run are still counted as reduced when resuming.
+#
+# With --derive, the 2-D fields used by post-processing (composite reflectivity, MSLP,
+# earth-relative winds, and isobaric fields) are also calculated from the full WRF file
+# and written next to the reduced file as
+# 'wrfout_d0<domain>_derived_<year>-<month>-<day>_<hour>:00:00.nc', so wrf_post.py does
+# not need to read 3-D fields. This requires post/diagnostics.py on the PYTHONPATH.
+# =============================================================================
+
+import argparse
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+
+VARS_TO_KEEP = [
+    "Q2",
+    "T2",
+    "U10",
+    "V10",
+    "U",
+    "V",
+    "W",
+    "T",
+    "PH",
+    "MU",
+    "QVAPOR",
+    "RAINC",
+    "RAINNC",
+    "P",
+    "TH2",
+    "PSFC",
+    "QCLOUD",
+    "QRAIN",
+    "QICE",
+    "QSNOW",
+    "QGRAUP",
+    "REFL_10CM",
+    "WSPD10MAX",
+    "W_UP_MAX",
+    "UP_HELI_MAX",
+]
+
+
+def checksum(values):
+    """Return a CRC32 checksum of the contents of an array."""
+    return zlib.crc32(np.ascontiguousarray(values).tobytes())
+
+
+def chunk_sizes(var):
+    """Chunk a variable into single horizontal slices, i.e. one level of one time."""
+    return [1] * (var.ndim - 2) + list(var.shape[-2:]) if var.ndim >= 2 else None
+
+
+def reduce_file(path_in, path_out, variables, complevel=4):
+    """Write a subset of variables from a WRF file to a compressed netCDF4 file.
+
+    Parameters
+    ----------
+    path_in : str or pathlib.Path
+        Path to a WRF output file.
+    path_out : str or pathlib.Path
+        Path of the reduced file to write.
+    variables : list of str
+        Names of variables to keep. Variables not found in the WRF file are skipped.
+    complevel : int (optional)
+        zlib compression level of the reduced file. Default is 4.
+
+    Returns
+    -------
+    dict
+        CRC32 checksums of each variable written to the reduced file.
+    """
+    checksums = {}
+    with netCDF4.Dataset(path_in, "r") as src, netCDF4.Dataset(
+        path_out, "w", format="NETCDF4"
+    ) as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+
+        keep = [var for var in variables if var in src.variables]
+        dims = {dim for var in keep for dim in src.variables[var].dimensions}
+        for name, dim in src.dimensions.items():
+            if name in dims:
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name in keep:
+            var = src.variables[name]
+            attrs = var.__dict__
+            out = dst.createVariable(
+                name,
+                var.dtype,
+                var.dimensions,
+                zlib=True,
+                complevel=complevel,
+                chunksizes=chunk_sizes(var),
+                fill_value=attrs.pop("_FillValue", None),
+            )
+            out.setncatts(attrs)
+            values = var[:]
+            out[:] = values
+            checksums[name] = checksum(values)
+
+    return checksums
+
+
+def verify_file(path_out, checksums):
+    """Check that each variable in a reduced file matches the checksum of its source.
+
+    Returns
+    -------
+    bool
+        True if all variables exist and match their checksums.
+    """
+    try:
+        with netCDF4.Dataset(path_out, "r") as nc:
+            nc.set_auto_maskandscale(False)
+            for name, value in checksums.items():
+                if name not in nc.variables or checksum(nc.variables[name][:]) != value:
+                    return False
+    except OSError:
+        return False
+    return True
+
+
+def derive_file(path_in, path_derived, levels):
+    """Calculate 2-D post-processing fields from a WRF file and write them to file.
+
+    Parameters
+    ----------
+    path_in : str or pathlib.Path
+        Path to a WRF output file containing base state variables.
+    path_derived : str or pathlib.Path
+        Path of the derived file to write.
+    levels : list of float
+        Pressure levels in hPa to interpolate upper air fields to.
+    """
+    # Only needed to derive fields, which requires the post-processing environment
+    import diagnostics
+    import xarray as xr
+    from metpy.units import units
+
+    with xr.open_dataset(path_in) as ds:
+        ds = ds.sel(Time=0)
+        diagnostics.write_derived(ds, ds, np.array(levels) * units.hPa, path_derived)
+
+
+def reduce_and_verify(
+    path_in,
+    path_out,
+    variables,
+    complevel=4,
+    keep_source=False,
+    path_derived=None,
+    levels=None,
+):
+    """Reduce a WRF file, verify the result, then delete the source file.
+
+    The reduced file is written to a temporary name and only renamed to `path_out`
+    after it is verified, so `path_out` never refers to a partially written file. If
+    `path_derived` is given, derived fields are written before the source is deleted.
+
+    Returns
+    -------
+    dict
+        Manifest entry describing the reduced file.
+
+    Raises
+    ------
+    RuntimeError
+        If the reduced file does not match the source file.
+    """
+    path_in = Path(path_in)
+    path_out = Path(path_out)
+    path_tmp = path_out.with_name(f"{path_out.name}.tmp")
+
+    checksums = reduce_file(path_in, path_tmp, variables, complevel)
+    if not verify_file(path_tmp, checksums):
+        path_tmp.unlink()
+        raise RuntimeError(f"Reduced file for {path_in} does not match its source")
+
+    os.replace(path_tmp, path_out)
+    entry = {
+        "output": str(path_out),
+        "checksums": checksums,
+        "size_in": path_in.stat().st_size,
+        "size_out": path_out.stat().st_size,
+    }
+
+    if path_derived is not None:
+        derive_file(path_in, path_derived, levels)
+        entry["derived"] = str(path_derived)
+
+    if not keep_source:
+        path_in.unlink()
+
+    return entry
+
+
+def load_manifest(path):
+    """Load a reduction manifest, or return an empty manifest if none exists."""
+    if Path(path).exists():
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(path, manifest):
+    """Atomically write a reduction manifest to file."""
+    path_tmp = Path(f"{path}.tmp")
+    with open(path_tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path_tmp, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reduce WRF output files of an ensemble member to select variables"
+    )
+    parser.add_argument(
+        "dir_member",
+        type=str,
+        help="Member directory containing WRF output in the subdirectory 'wrf'",
+    )
+    parser.add_argument(
+        "date_begin", type=str, help="Forecast initialization date (YYYYMMDDHH)"
+    )
+    parser.add_argument(
+        "--nhours", type=int, default=48, help="Number of forecast hours to reduce"
+    )
+    parser.add_argument(
+        "--domains", type=int, nargs="+", default=[1, 2], help="WRF domains to reduce"
+    )
+    parser.add_argument(
+        "--variables",
+        type=str,
+        nargs="+",
+        default=VARS_TO_KEEP,
+        help="Variables to keep in reduced files",
+    )
+    parser.add_argument(
+        "--complevel", type=int, default=4, help="zlib compression level (1-9)"
+    )
+    parser.add_argument(
+        "--nprocs",
+        type=int,
+        default=int(os.getenv("SLURM_NTASKS", 1)),
+        help="Number of files to reduce in parallel",
+    )
+    parser.add_argument(
+        "--derive",
+        action="store_true",
+        help="Also write 2-D fields used by wrf_post.py next to reduced files",
+    )
+    parser.add_argument(
+        "--derive_domains",
+        type=int,
+        nargs="+",
+        default=[2],
+        help="WRF domains for which to write derived fields",
+    )
+    parser.add_argument(
+        "--levels",
+        type=float,
+        nargs="+",
+        default=[850.0, 700.0, 500.0, 300.0],
+        help="Pressure levels in hPa of derived upper air fields",
+    )
+    parser.add_argument(
+        "--keep_source",
+        action="store_true",
+        help="Do not delete WRF output files after they are reduced",
+    )
+
+    args = parser.parse_args()
+    dir_member = Path(args.dir_member)
+    date_begin = datetime.strptime(args.date_begin, "%Y%m%d%H")
+    nhours = args.nhours
+    domains = args.domains
+    variables = args.variables
+    complevel = args.complevel
+    nprocs = args.nprocs
+    keep_source = args.keep_source
+    derive = args.derive
+    derive_domains = args.derive_domains
+    levels = args.levels
+
+    dir_wrf = dir_member / "wrf"
+    dir_wrfoutred = dir_member / "wrfoutred"
+    dir_wrfoutred.mkdir(exist_ok=True)
+
+    path_manifest = dir_wrfoutred / "reduce_manifest.json"
+    manifest = load_manifest(path_manifest)
+
+    # Find files that still need to be reduced
+    # -------------------------------------------------------------------------
+    tasks = {}
+    for hour in range(nhours + 1):
+        date = (date_begin + timedelta(hours=hour)).strftime("%Y-%m-%d_%H:%M:%S")
+        for domain in domains:
+            name = f"wrfout_d0{domain}_{date}"
+            path_out = dir_wrfoutred / f"wrfout_d0{domain}_red_{date}"
+            path_zipped = path_out.with_name(f"{path_out.name}.gz")
+            if name in manifest and (path_out.exists() or path_zipped.exists()):
+                continue
+            if not (dir_wrf / name).exists():
+                print(f"*** WARNING: {dir_wrf / name} does not exist")
+                continue
+            if derive and domain in derive_domains:
+                path_derived = dir_wrfoutred / f"wrfout_d0{domain}_derived_{date}.nc"
+            else:
+                path_derived = None
+            tasks[name] = (dir_wrf / name, path_out, path_derived)
+
+    print(f"Reducing {len(tasks)} files ({len(manifest)} already reduced)...")
+
+    # Reduce files in parallel and record each verified file in the manifest
+    # -------------------------------------------------------------------------
+    failed = []
+    with ProcessPoolExecutor(nprocs) as pool:
+        futures = {
+            pool.submit(
+                reduce_and_verify,
+                path_in,
+                path_out,
+                variables,
+                complevel,
+                keep_source,
+                path_derived,
+                levels,
+            ): name
+            for name, (path_in, path_out, path_derived) in tasks.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                manifest[name] = future.result()
+            except (OSError, RuntimeError) as err:
+                print(f"*** ERROR: {err}")
+                failed.append(name)
+                continue
+            save_manifest(path_manifest, manifest)
+            print(f"Reduced {name}")
+
+    if failed:
+        raise SystemExit(f"Failed to reduce {len(failed)} files: {', '.join(failed)}")
@@ -6,14 +6,16 @@
 #SBATCH -p quanah
 #SBATCH -t 06:00:00
 #SBATCH --nodes=1
-#SBATCH --ntasks=1
+#SBATCH --ntasks=4
 #SBATCH -a 1-42%4
 
 # ============================================================================================
 # sub_reduce_wrf.sh
 #
-# Reduce WRF ensemble member files to only variables we care about. See the 'vars_to_keep'
-# variable below.
+# Reduce WRF ensemble member files to only variables we care about. See 'VARS_TO_KEEP' in
+# reduce_wrf.py. Files are reduced in parallel, compressed, and checked before the original
+# wrfout files are deleted. Progress is kept in 'wrfoutred/reduce_manifest.json', so the
+# job can be resubmitted to finish an interrupted reduction.
 #
 # Reduced files are formatted as 'wrfoutred_d0<domain>_<year>-<month>-<day>_<hour>:00:00'
 # and moved into a new directory 'wrfoutred' within the member directory.
@@ -23,23 +25,25 @@
 # Parameters
 # ----------
 #   $1 = param : paramter file containing WRF settings and paths
-#   $1 = exp : ensemble experiment name
-#   $2 = date_begin : ensemble forecast date_beginialization date (YYYYMMDDHH)
+#   $2 = exp : ensemble experiment name
+#   $3 = date_begin : ensemble forecast date_beginialization date (YYYYMMDDHH)
+#   $4 = derive : if "true", also write the 2-D fields used by wrf_post.py next to the
+#        reduced domain 2 files. Default is "false"
 # ============================================================================================
 
-module load gnu nco
+module load gnu
 
 param=$1
 exp=$2
 date_begin=$3
+derive=${4:-"false"}
 
 source $param
 
 mem=$SLURM_ARRAY_TASK_ID
 
+pypath=/home/rmanser/software/miniconda3/envs/ensembles/bin/python
 dir_exp=${dir_scratch}/${exp}
-date_end=`python ${dir_base}/modify_date.py $date_begin 48`
-vars_to_keep="Q2,T2,U10,V10,U,V,W,T,PH,MU,QVAPOR,RAINC,RAINNC,P,TH2,PSFC,QCLOUD,QRAIN,QICE,QSNOW,QGRAUP,REFL_10CM,WSPD10MAX,W_UP_MAX,UP_HELI_MAX"
 
 # Create reference files for each domain
 mkdir -p ${dir_scratch}/wrfref
@@ -52,45 +56,15 @@ if [ ! -e "${dir_scratch}/wrfref/wrfoutREFd02" ] ; then
   ${dir_exp}/${date_begin}/wrfoutREFd02
 fi
 
-cd ${dir_exp}/${date_begin}/mem${mem}/wrf
-
-# Create a wrfout reduced storage directory for the ensemble member
-if [ ! -d "${dir_exp}/${date_begin}/mem${mem}/wrfoutred" ] ; then
-  mkdir ${dir_exp}/${date_begin}/mem${mem}/wrfoutred
+if [ "$derive" = "true" ] ; then
+  derive_args="--derive --derive_domains 2"
+else
+  derive_args=""
 fi
 
-date=$date_begin
-while [ $date -le $date_end ] ; do
-
-  dir_wrf=${dir_exp}/${date_begin}/mem${mem}/wrf
-  dir_wrfoutred=${dir_exp}/${date_begin}/mem${mem}/wrfoutred
-
-  hour=`echo $date | cut -b9-10`
-  year=`echo $date | cut -b1-4`
-  month=`echo $date | cut -b5-6`
-  day=`echo $date | cut -b7-8`
-
-  ncks -C -v $vars_to_keep wrfout_d01_${year}-${month}-${day}_${hour}:00:00 \
-  wrfout_d01_red_${year}-${month}-${day}_${hour}:00:00
-
-  ncks -C -v $vars_to_keep wrfout_d02_${year}-${month}-${day}_${hour}:00:00 \
-  wrfout_d02_red_${year}-${month}-${day}_${hour}:00:00
-
-  # Move the reduced wrfout files to the reduced storage directory
-  mv ${dir_wrf}/wrfout_d01_red_${year}-${month}-${day}_${hour}:00:00 ${dir_wrfoutred}
-  mv ${dir_wrf}/wrfout_d02_red_${year}-${month}-${day}_${hour}:00:00 ${dir_wrfoutred}
-
-  # Delete the original wrfout files if running ncks -C -v produced a file
-  if [ -e "${dir_wrfoutred}/wrfout_d01_red_${year}-${month}-${day}_${hour}:00:00" ] ; then
-    rm ${dir_wrf}/wrfout_d01_${year}-${month}-${day}_${hour}:00:00
-  fi
-  if [ -e "${dir_wrfoutred}/wrfout_d02_red_${year}-${month}-${day}_${hour}:00:00" ] ; then
-    rm ${dir_wrf}/wrfout_d02_${year}-${month}-${day}_${hour}:00:00
-  fi
-
-  date=`python ${dir_base}/modify_date.py $date 1`
-
-done
+PYTHONPATH=${dir_base}/post ${pypath} ${dir_base}/run_ensemble/util/reduce_wrf.py \
+${dir_exp}/${date_begin}/mem${mem} $date_begin --nhours 48 --nprocs $SLURM_NTASKS \
+${derive_args}
 
 # Move wrfinput and wrfbdy files to the reduced storage directory
 mv ${dir_exp}/${date_begin}/mem${mem}/wrf/wrfinput_d01 \
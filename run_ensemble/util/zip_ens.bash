@@ -3,6 +3,10 @@
 # ============================================================================================
 # Zip WRF ensemble members for a single initialization and forecast hour
 #
+# Only netCDF3 files reduced by ncks are zipped. Files reduced by reduce_wrf.py are
+# netCDF4 files that are already compressed internally, and xarray cannot open them once
+# gzipped, so they are left as they are.
+#
 # Parameters
 # ----------
 # $1 = param : parameter file containing WRF settings and paths
@@ -36,6 +40,8 @@ filename=wrfout_d0${domain}_red_${year}-${month}-${day}_${hour}:00:00
 if [[ -e "${dir_zip}/${filename}.gz" ]]; then
   echo "${dir_zip}/${filename}.gz already exists. Removing any unzipped files if present..."
   rm -f ${dir_zip}/${filename}
+elif [[ "$(head -c 4 ${dir_zip}/${filename} | tail -c 3)" == "HDF" ]]; then
+  echo "${dir_zip}/${filename} is compressed netCDF4. Skipping..."
 else
   echo "Zipping ${dir_zip}/${filename}..."
   pigz ${dir_zip}/${filename}
@@ -0,0 +1,56 @@
+# =============================================================================
+# test_calc_practically_perfect.py
+#
+# Check practically perfect probabilities against the values of Hitchens et al. (2013).
+# =============================================================================
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "verify"))
+
+import calc_practically_perfect  # noqa: E402
+
+
+def test_single_report_peak():
+    """One report peaks at 1 / (2 pi sigma^2), with sigma in ~81 km grid lengths."""
+    dx = 3.0
+    sigma = 120.0
+    events = np.zeros((1, 300, 300), dtype=bool)
+    events[0, 150, 150] = True
+
+    probs = calc_practically_perfect.practically_perfect(events, sigma, dx)
+
+    sigma_ppp = sigma / calc_practically_perfect.PPP_DX
+    np.testing.assert_allclose(probs.max(), 1.0 / (2.0 * np.pi * sigma_ppp**2), 1e-3)
+
+
+def test_tails_are_zero():
+    """Probabilities below min_prob are not verified as observed events."""
+    dx = 3.0
+    events = np.zeros((1, 300, 300), dtype=bool)
+    events[0, 150, 150] = True
+
+    probs = calc_practically_perfect.practically_perfect(
+        events, 120.0, dx, min_prob=0.01
+    )
+
+    assert probs[0, 0, 0] == 0.0
+    assert probs[probs > 0.0].min() >= 0.01
+
+
+def test_reports_in_one_box_count_once():
+    """Reports within the same ~81 km box give the same probabilities as one report."""
+    dx = 3.0
+    one = np.zeros((1, 300, 300), dtype=bool)
+    one[0, 150, 150] = True
+    many = one.copy()
+    many[0, 150, 151] = True
+    many[0, 151, 150] = True
+
+    np.testing.assert_array_equal(
+        calc_practically_perfect.practically_perfect(one, 80.0, dx),
+        calc_practically_perfect.practically_perfect(many, 80.0, dx),
+    )
@@ -0,0 +1,210 @@
+# bootstrap.py
+
+"""Bootstrap confidence intervals for verification scores aggregated over initializations.
+
+Replicates are drawn as index matrices over initializations and converted to resampling
+weights, so that each replicate is a weighted sum of per-initialization sufficient
+statistics rather than a recomputation of the scores. Aggregate scores follow the
+definitions used in `probabilistic_verification`:
+
+- FSS is one minus the ratio of summed fractions Brier scores.
+- BSS is the mean of per-initialization BSS, since the reference uncertainty is a
+  constant sample climatology.
+- ROC area is computed from the probability bin frequencies and hits returned by
+  `probabilistic_verification.reliability`.
+
+Missing values (NaN) are excluded from each replicate, so initializations without
+forecasts do not contribute.
+"""
+
+import numpy as np
+
+
+def bootstrap_indices(n, n_boot, seed=None):
+    """Draw bootstrap resamples of `n` samples as an index matrix.
+
+    Parameters
+    ----------
+    n : int
+        Number of samples (e.g., initializations).
+    n_boot : int
+        Number of bootstrap replicates.
+    seed : int (optional)
+        Seed for the random number generator.
+
+    Returns
+    -------
+    n_boot x n numpy.ndarray
+        Indices of the samples drawn for each replicate.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n, size=(n_boot, n))
+
+
+def resample_weights(indices, n):
+    """Convert a bootstrap index matrix into the number of times each sample is drawn.
+
+    Parameters
+    ----------
+    indices : n_boot x m numpy.ndarray
+        Indices of the samples drawn for each replicate.
+    n : int
+        Number of samples.
+
+    Returns
+    -------
+    n_boot x n numpy.ndarray
+        Resampling weights for each replicate.
+    """
+    n_boot = indices.shape[0]
+    offsets = np.arange(n_boot)[:, np.newaxis] * n
+    counts = np.bincount((indices + offsets).ravel(), minlength=n_boot * n)
+    return counts.reshape(n_boot, n).astype(float)
+
+
+def weighted_sums(stat, weights):
+    """Sum a per-sample statistic for every bootstrap replicate, skipping missing values.
+
+    Parameters
+    ----------
+    stat : numpy.ndarray
+        Statistic with samples along the first axis.
+    weights : n_boot x n numpy.ndarray
+        Resampling weights from `resample_weights`.
+
+    Returns
+    -------
+    sums : numpy.ndarray
+        Sum of `stat` for each replicate, with shape (n_boot, *stat.shape[1:]).
+    counts : numpy.ndarray
+        Number of non-missing samples in each sum, with the same shape as `sums`.
+    """
+    n = stat.shape[0]
+    valid = np.isfinite(stat)
+    values = np.where(valid, stat, 0.0).reshape(n, -1)
+    sums = weights @ values
+    counts = weights @ valid.reshape(n, -1).astype(float)
+    shape = (weights.shape[0], *stat.shape[1:])
+    return sums.reshape(shape), counts.reshape(shape)
+
+
+def mean_replicates(stat, weights):
+    """Calculate bootstrap replicates of the mean of a per-sample statistic (e.g., BSS).
+
+    Parameters
+    ----------
+    stat : numpy.ndarray
+        Statistic with samples along the first axis.
+    weights : n_boot x n numpy.ndarray
+        Resampling weights from `resample_weights`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Replicates with shape (n_boot, *stat.shape[1:]).
+    """
+    sums, counts = weighted_sums(stat, weights)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def fss_replicates(fbs, fbs_worst, weights):
+    """Calculate bootstrap replicates of the aggregate fractions skill score.
+
+    Parameters
+    ----------
+    fbs : numpy.ndarray
+        Fractions Brier score with samples along the first axis.
+    fbs_worst : numpy.ndarray
+        Reference (worst) fractions Brier score with the same shape as `fbs`.
+    weights : n_boot x n numpy.ndarray
+        Resampling weights from `resample_weights`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Replicates with shape (n_boot, *fbs.shape[1:]).
+    """
+    missing = ~(np.isfinite(fbs) & np.isfinite(fbs_worst))
+    sums_fbs, _ = weighted_sums(np.where(missing, np.nan, fbs), weights)
+    sums_worst, _ = weighted_sums(np.where(missing, np.nan, fbs_worst), weights)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(sums_worst > 0, 1.0 - sums_fbs / sums_worst, np.nan)
+
+
+def roc_area_from_bins(freq, hits):
+    """Calculate the area under the ROC curve from binned forecast frequencies and hits.
+
+    Each bin edge is used as a decision threshold, where a forecast of "yes" is any
+    probability in that bin or a higher one.
+
+    Parameters
+    ----------
+    freq : numpy.ndarray
+        Frequency of probability forecasts for each bin along the last axis.
+    hits : numpy.ndarray
+        Hits of probability forecasts for each bin along the last axis.
+
+    Returns
+    -------
+    numpy.ndarray
+        ROC area with the shape of `freq` excluding the last axis.
+    """
+    false_alarms = freq - hits
+    hits_cum = np.cumsum(hits[..., ::-1], axis=-1)
+    false_alarms_cum = np.cumsum(false_alarms[..., ::-1], axis=-1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pod = hits_cum / hits_cum[..., -1:]
+        pofd = false_alarms_cum / false_alarms_cum[..., -1:]
+
+    zeros = np.zeros((*pod.shape[:-1], 1))
+    pod = np.concatenate([zeros, pod], axis=-1)
+    pofd = np.concatenate([zeros, pofd], axis=-1)
+    return 0.5 * (
+        (pofd[..., 1:] - pofd[..., :-1]) * (pod[..., 1:] + pod[..., :-1])
+    ).sum(axis=-1)
+
+
+def roc_area_replicates(freq, hits, weights):
+    """Calculate bootstrap replicates of the aggregate ROC area.
+
+    Parameters
+    ----------
+    freq : numpy.ndarray
+        Frequency of probability forecasts with samples along the first axis and bins
+        along the last axis.
+    hits : numpy.ndarray
+        Hits of probability forecasts with the same shape as `freq`.
+    weights : n_boot x n numpy.ndarray
+        Resampling weights from `resample_weights`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Replicates with shape (n_boot, *freq.shape[1:-1]).
+    """
+    missing = ~(np.isfinite(freq) & np.isfinite(hits))
+    sums_freq, _ = weighted_sums(np.where(missing, np.nan, freq), weights)
+    sums_hits, _ = weighted_sums(np.where(missing, np.nan, hits), weights)
+    return roc_area_from_bins(sums_freq, sums_hits)
+
+
+def confidence_interval(replicates, alpha=0.05):
+    """Calculate a percentile confidence interval from bootstrap replicates.
+
+    Parameters
+    ----------
+    replicates : numpy.ndarray
+        Bootstrap replicates along the first axis.
+    alpha : float (optional)
+        Significance level. Default is 0.05 (95% confidence interval).
+
+    Returns
+    -------
+    numpy.ndarray
+        Lower and upper bounds along the first axis.
+    """
+    return np.nanpercentile(
+        replicates, [100.0 * alpha / 2.0, 100.0 * (1.0 - alpha / 2.0)], axis=0
+    )
@@ -0,0 +1,154 @@
+# calc_bootstrap_ci.py
+
+import argparse
+import itertools
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+import bootstrap
+
+
+def aggregate_replicates(ds, weights):
+    """Calculate replicates of FSS, BSS, and ROC area for one experiment."""
+    return {
+        "fss": bootstrap.fss_replicates(ds.fbs.values, ds.fbs_worst.values, weights),
+        "bss": bootstrap.mean_replicates(ds.bss.values, weights),
+        "roc_area": bootstrap.roc_area_replicates(
+            ds.frequency.values, ds.hits.values, weights
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Calculate bootstrap confidence intervals over initializations for verification "
+            "scores from verify_convective.py, including paired differences between "
+            "experiments"
+        )
+    )
+    parser.add_argument(
+        "dir_in", type=str, help="Directory containing verify_convective.py output"
+    )
+    parser.add_argument(
+        "fcst_key", type=str, help="Key in dataset for forecast probabilities"
+    )
+    parser.add_argument(
+        "radius_idx",
+        type=int,
+        help="Index in dataset of the neighborhood radius to verify",
+    )
+    parser.add_argument("dir_out", type=str, help="Directory to write files to")
+    parser.add_argument(
+        "experiments", type=str, nargs="+", help="Ensemble experiments to compare"
+    )
+    parser.add_argument(
+        "--nboot", type=int, default=10000, help="Number of bootstrap replicates"
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="Significance level of the confidence intervals",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed for the random number generator"
+    )
+
+    args = parser.parse_args()
+    dir_in = Path(args.dir_in)
+    fcst_key = args.fcst_key
+    radius_idx = args.radius_idx
+    dir_out = Path(args.dir_out)
+    experiments = args.experiments
+    nboot = args.nboot
+    alpha = args.alpha
+    seed = args.seed
+
+    datasets = {
+        exp: xr.open_dataset(dir_in / exp / f"{fcst_key}_r{radius_idx}.nc").load()
+        for exp in experiments
+    }
+    datasets = dict(zip(experiments, xr.align(*datasets.values(), join="inner")))
+
+    # Paired comparisons only use initializations and hours verified in every experiment
+    names = ["fss", "fbs", "fbs_worst", "bss", "frequency", "hits"]
+    for name in names:
+        missing = np.any(
+            [~np.isfinite(ds[name].values) for ds in datasets.values()], axis=0
+        )
+        for ds in datasets.values():
+            ds[name].values[missing] = np.nan
+
+    ninit = datasets[experiments[0]].initialization.size
+    indices = bootstrap.bootstrap_indices(ninit, nboot, seed=seed)
+    weights = bootstrap.resample_weights(indices, ninit)
+    weights_all = np.ones((1, ninit))
+
+    scores = {
+        exp: aggregate_replicates(ds, weights_all) for exp, ds in datasets.items()
+    }
+    replicates = {
+        exp: aggregate_replicates(ds, weights) for exp, ds in datasets.items()
+    }
+    pairs = list(itertools.combinations(experiments, 2))
+
+    dims = ["experiment", "forecast_hour"]
+    dims_ci = ["bound", "experiment", "forecast_hour"]
+    dims_diff = ["comparison", "forecast_hour"]
+    dims_diff_ci = ["bound", "comparison", "forecast_hour"]
+    coords = {
+        "experiment": experiments,
+        "comparison": [f"{a}-{b}" for a, b in pairs],
+        "forecast_hour": datasets[experiments[0]].forecast_hour.values,
+        "bound": ["lower", "upper"],
+    }
+
+    data_vars = {}
+    for name in ["fss", "bss", "roc_area"]:
+        data_vars[name] = (
+            dims,
+            np.stack([scores[exp][name][0] for exp in experiments]),
+        )
+        data_vars[f"{name}_ci"] = (
+            dims_ci,
+            np.stack(
+                [
+                    bootstrap.confidence_interval(replicates[exp][name], alpha)
+                    for exp in experiments
+                ],
+                axis=1,
+            ),
+        )
+        if not pairs:
+            continue
+        data_vars[f"{name}_diff"] = (
+            dims_diff,
+            np.stack([scores[a][name][0] - scores[b][name][0] for a, b in pairs]),
+        )
+        data_vars[f"{name}_diff_ci"] = (
+            dims_diff_ci,
+            np.stack(
+                [
+                    bootstrap.confidence_interval(
+                        replicates[a][name] - replicates[b][name], alpha
+                    )
+                    for a, b in pairs
+                ],
+                axis=1,
+            ),
+        )
+
+    attrs = {
+        "description": (
+            "Scores aggregated over initializations with percentile bootstrap confidence "
+            "intervals. Differences are paired by initialization."
+        ),
+        "nboot": nboot,
+        "alpha": alpha,
+    }
+    ds = xr.Dataset(data_vars, coords, attrs)
+    dir_out.mkdir(exist_ok=True, parents=True)
+    ds.to_netcdf(dir_out / f"bootstrap_{fcst_key}_r{radius_idx}.nc")
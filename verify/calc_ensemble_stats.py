@@ -0,0 +1,132 @@
+# calc_ensemble_stats.py
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import ensemble_statistics
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Verify surface or upper air ensemble forecasts against a gridded analysis on "
+            "the WRF grid for all forecast hours of one initialization"
+        )
+    )
+    parser.add_argument(
+        "dir_post", type=str, help="Directory of post-processed forecasts to verify"
+    )
+    parser.add_argument(
+        "initialization", type=str, help="Initialization date (YYYYMMDDHH)"
+    )
+    parser.add_argument(
+        "level", type=str, choices=["surface", "upper"], help="Forecast file type"
+    )
+    parser.add_argument("fcst_key", type=str, help="Forecast variable to verify")
+    parser.add_argument("anl_key", type=str, help="Analysis variable to verify against")
+    parser.add_argument(
+        "anl_fmt",
+        type=str,
+        help=(
+            "Path to analysis files on the WRF grid as a strftime format of the valid "
+            "date, e.g. /path/to/analysis_%%Y%%m%%d%%H.nc"
+        ),
+    )
+    parser.add_argument("dir_out", type=str, help="Directory to write files to")
+    parser.add_argument(
+        "--nhours",
+        type=int,
+        default=48,
+        help="Total number of forecast hours to verify",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed for breaking rank histogram ties"
+    )
+
+    args = parser.parse_args()
+    dir_post = Path(args.dir_post)
+    init = pd.to_datetime(args.initialization, format="%Y%m%d%H")
+    level = args.level
+    fcst_key = args.fcst_key
+    anl_key = args.anl_key
+    anl_fmt = args.anl_fmt
+    dir_out = Path(args.dir_out)
+    nhours = args.nhours
+    seed = args.seed
+
+    # Surface forecasts are written every 6 hours and upper air forecasts every 12 hours
+    dt = 6 if level == "surface" else 12
+    fhours = np.arange(0, nhours + dt, dt)
+
+    files = [dir_post / f"{level}_f{str(h).zfill(2)}.nc" for h in fhours]
+    fcst = xr.open_mfdataset(
+        files, concat_dim="forecast_hour", combine="nested"
+    ).assign_coords(forecast_hour=fhours)[fcst_key]
+
+    dates = [init + pd.Timedelta(h, unit="hour") for h in fhours]
+    anl = np.stack(
+        [xr.open_dataset(d.strftime(anl_fmt))[anl_key].values for d in dates]
+    )
+
+    # Forecasts are (forecast_hour, member, [pressure,] y, x)
+    values = fcst.values
+    bias, rmse, mae = ensemble_statistics.ensemble_mean_error(values, anl, axis=1)
+    spread, skill = ensemble_statistics.spread_skill(values, anl, axis=1)
+    crps = np.nanmean(ensemble_statistics.crps(values, anl, axis=1), axis=(-2, -1))
+    ranks = ensemble_statistics.rank_histogram(values, anl, axis=1, seed=seed)
+
+    dims = ["forecast_hour"]
+    coords = {"forecast_hour": fhours, "rank": np.arange(1, fcst.member.size + 2)}
+    if "pressure" in fcst.dims:
+        dims.append("pressure")
+        coords["pressure"] = fcst.pressure.values
+
+    units = fcst.attrs.get("units", "")
+    data_vars = {
+        "bias": (
+            dims,
+            bias,
+            {"description": "Bias of the ensemble mean", "units": units},
+        ),
+        "rmse": (
+            dims,
+            rmse,
+            {"description": "RMSE of the ensemble mean", "units": units},
+        ),
+        "mae": (dims, mae, {"description": "MAE of the ensemble mean", "units": units}),
+        "spread": (
+            dims,
+            spread,
+            {"description": "Square root of mean ensemble variance", "units": units},
+        ),
+        "spread_skill_ratio": (
+            dims,
+            spread / skill,
+            {"description": "Ratio of ensemble spread to RMSE of the ensemble mean"},
+        ),
+        "crps": (
+            dims,
+            crps,
+            {
+                "description": "Domain mean continuous ranked probability score",
+                "units": units,
+            },
+        ),
+        "rank_histogram": (
+            dims + ["rank"],
+            ranks,
+            {"description": "Counts of analysis rank within the ensemble"},
+        ),
+    }
+    attrs = {
+        "initialization": init.strftime("%Y-%m-%d %H:%M:%S"),
+        "forecast": fcst_key,
+        "analysis": anl_key,
+    }
+
+    ds = xr.Dataset(data_vars, coords, attrs)
+    dir_out.mkdir(exist_ok=True, parents=True)
+    ds.to_netcdf(dir_out / f'{fcst_key}_{init.strftime("%Y%m%d%H")}.nc')
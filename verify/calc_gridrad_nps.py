@@ -18,14 +18,23 @@ from metpy.units import units
 
 import gridrad
 import neighborhood
+import profiling
 from wrf_ens_tools.calc import coordinateSystems
 
 parser = argparse.ArgumentParser(
     description='Calculate hourly neighborhood probabilities from column maximum reflectivity'
 )
 parser.add_argument('date_str', type=str, help='Date formatted as YYYYMMDDHH')
+parser.add_argument(
+    '--profile',
+    type=str,
+    default=None,
+    help='Path of a Chrome trace file of time, I/O, and memory use of each stage'
+)
 
 args = parser.parse_args()
+if args.profile is not None:
+    profiling.start()
 date_str = args.date_str
 
 date = datetime.strptime(date_str, "%Y%m%d%H")
@@ -36,7 +45,8 @@ path_save = Path(os.getenv("PATH_GRIDRAD_SAVE")) / f'gridrad_{date.strftime("%Y%
 path_gr = Path(os.getenv("PATH_GRIDRAD_OBS")) / date.strftime("%Y%m")
 path_file = path_gr / f'nexrad_3d_v3_1_{date.strftime("%Y%m%dT%H%M%S")}Z.nc'
 
-gr_raw = gridrad.read_file(path_file)
+with profiling.span('read observations'):
+    gr_raw = gridrad.read_file(path_file)
 
 if type(gr_raw) is int:
     sys.stderr.write(f"Could not find observation file {path_file} to build grid. Exiting...")
@@ -48,12 +58,13 @@ grlongrid, grlatgrid = np.meshgrid(grlon, grlat)
 
 wrfref = xr.open_dataset(path_ref)
 
-obs_x, obs_y, wrf_x, wrf_y, obs_mask = neighborhood.subset_to_forecast_grid(
-    wrfref,
-    grlongrid,
-    grlatgrid,
-    return_mask=True
-)
+with profiling.span('subset to forecast grid'):
+    obs_x, obs_y, wrf_x, wrf_y, obs_mask = neighborhood.subset_to_forecast_grid(
+        wrfref,
+        grlongrid,
+        grlatgrid,
+        return_mask=True
+    )
 
 points = np.vstack((obs_y, obs_x)).T
 xi = np.vstack((wrf_y.flatten(), wrf_x.flatten())).T
@@ -64,7 +75,8 @@ thresh_probs = {}
 for thresh in thresholds:
     obs_probs = np.full((radii.size, *wrf_x.shape), -1., dtype=float)
 
-    comp_refl = neighborhood.open_rad_obs(path_file, level='colmax')
+    with profiling.span('read column maximum reflectivity'):
+        comp_refl = neighborhood.open_rad_obs(path_file, level='colmax')
     comp_refl_bin = comp_refl.copy()
     thresh_field = (comp_refl >= thresh)
     comp_refl_bin[thresh_field] = 1.
@@ -72,9 +84,11 @@ for thresh in thresholds:
     values = comp_refl_bin[obs_mask]
 
     for i, r in enumerate(radii):
-        query = neighborhood.build_query(points, xi, r)
+        with profiling.span('build query', radius=float(r.m)):
+            query = neighborhood.build_query(points, xi, r)
 
-        probs = neighborhood.neighbor_prob(xi, values, query)
+        with profiling.span('neighbor prob', radius=float(r.m)):
+            probs = neighborhood.neighbor_prob(xi, values, query)
         probs.shape = wrf_x.shape
         probs[np.where(np.isnan(probs))] = 0.
         obs_probs[i] = probs * 100.
@@ -100,5 +114,10 @@ data = {
     for (key, value), t in zip(thresh_probs.items(), thresholds)
 }
 
-ds = xr.Dataset(data, coords)
-ds.to_netcdf(path_save)
+with profiling.span('write'):
+    ds = xr.Dataset(data, coords)
+    ds.to_netcdf(path_save)
+
+if args.profile is not None:
+    profiling.stop(args.profile)
+
@@ -0,0 +1,259 @@
+# =============================================================================
+# calc_practically_perfect.py
+#
+# Calculate practically perfect probabilities (Hitchens et al. 2013) from point storm
+# reports on the WRF grid for every hour of a season in one batched run.
+#
+# Reports are mapped to the nearest WRF grid point and binned into hourly windows ending
+# at each valid time. As in Hitchens et al. (2013), a window has an event in every box of
+# an ~81 km grid (NCEP grid 211) with at least one report, and events are smoothed with a
+# Gaussian kernel normalized on that grid. Each box is placed at the WRF grid point
+# nearest its center and smoothed on the WRF grid, scaled by the ratio of the box area to
+# the WRF grid cell area, so a single report peaks at 1 / (2 pi (sigma / 81 km)^2).
+# Probabilities below --min_prob are set to zero, since verify_convective.py treats every
+# non-zero probability as an observed event. Files are written as ppp_YYYYMMDDHH.nc in
+# the layout expected by verify_convective.py.
+# =============================================================================
+
+import os
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from metpy.units import units
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+import neighborhood
+
+# Grid spacing in km of the grid that reports are binned to (NCEP grid 211)
+PPP_DX = 81.271
+
+
+def box_events(events, dx, ppp_dx=PPP_DX):
+    """Bin events on the WRF grid to boxes of a coarser grid.
+
+    Parameters
+    ----------
+    events : ... x N x M numpy.ndarray
+        Boolean events on the WRF grid.
+    dx : float
+        WRF grid spacing in km.
+    ppp_dx : float (optional)
+        Grid spacing of the boxes in km. Default is PPP_DX.
+
+    Returns
+    -------
+    ... x N x M numpy.ndarray
+        Boolean events that are True only at the WRF grid point nearest the center of
+        each box containing at least one event.
+    """
+    ratio = ppp_dx / dx
+    ny, nx = events.shape[-2:]
+    # WRF grid index of the center of the box containing each WRF grid point
+    centers_y = np.minimum(((np.arange(ny) // ratio) + 0.5) * ratio, ny - 1).astype(int)
+    centers_x = np.minimum(((np.arange(nx) // ratio) + 0.5) * ratio, nx - 1).astype(int)
+
+    boxed = np.zeros_like(events, dtype=bool)
+    *lead, jj, ii = np.nonzero(events)
+    boxed[(*lead, centers_y[jj], centers_x[ii])] = True
+    return boxed
+
+
+def practically_perfect(events, sigma, dx, ppp_dx=PPP_DX, min_prob=0.01):
+    """Calculate practically perfect probabilities from events on the WRF grid.
+
+    Parameters
+    ----------
+    events : ... x N x M numpy.ndarray
+        Boolean report events on the WRF grid, with y and x as the last two dimensions.
+    sigma : float
+        Standard deviation of the Gaussian kernel in km.
+    dx : float
+        WRF grid spacing in km.
+    ppp_dx : float (optional)
+        Grid spacing in km of the boxes reports are binned to. Default is PPP_DX.
+    min_prob : float (optional)
+        Probabilities below this value are set to zero. Default is 0.01.
+
+    Returns
+    -------
+    ... x N x M numpy.ndarray
+        float32 probabilities (dimensionless).
+    """
+    field = box_events(events, dx, ppp_dx).astype(np.float32)
+    sigma_grid = sigma / dx
+    sigmas = (0.0,) * (field.ndim - 2) + (sigma_grid, sigma_grid)
+    probs = ndimage.gaussian_filter(field, sigma=sigmas, mode="constant")
+    # The kernel is normalized on the WRF grid, so scale it to the area of a box
+    probs *= np.float32((ppp_dx / dx) ** 2)
+    probs[probs < min_prob] = 0.0
+    return probs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calculate hourly practically perfect probabilities from storm reports"
+    )
+    parser.add_argument(
+        "reports",
+        type=str,
+        nargs="+",
+        help="CSV files of storm reports with times (UTC), latitudes, and longitudes",
+    )
+    parser.add_argument(
+        "--date_start",
+        type=str,
+        default="2016042700",
+        help="First valid date formatted as YYYYMMDDHH",
+    )
+    parser.add_argument(
+        "--date_end",
+        type=str,
+        default="2016060512",
+        help="Last valid date formatted as YYYYMMDDHH",
+    )
+    parser.add_argument(
+        "--sigmas",
+        type=float,
+        nargs="+",
+        default=[40.0, 80.0, 120.0],
+        help="Standard deviations of the Gaussian smoother in kilometers",
+    )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Time windows in hours ending at each valid time over which reports are used",
+    )
+    parser.add_argument(
+        "--time_col", type=str, default="time", help="Report time column"
+    )
+    parser.add_argument(
+        "--lat_col", type=str, default="lat", help="Report latitude column"
+    )
+    parser.add_argument(
+        "--lon_col", type=str, default="lon", help="Report longitude column"
+    )
+    parser.add_argument(
+        "--ppp_dx",
+        type=float,
+        default=PPP_DX,
+        help="Grid spacing in kilometers of the boxes reports are binned to",
+    )
+    parser.add_argument(
+        "--min_prob",
+        type=float,
+        default=0.01,
+        help=(
+            "Probabilities below this value (dimensionless) are set to zero, so the "
+            "tails of the kernel are not verified as observed events"
+        ),
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=48,
+        help="Number of hours to smooth and write at once",
+    )
+
+    args = parser.parse_args()
+    dates = pd.date_range(
+        pd.to_datetime(args.date_start, format="%Y%m%d%H"),
+        pd.to_datetime(args.date_end, format="%Y%m%d%H"),
+        freq="1H",
+    )
+    sigmas = np.array(args.sigmas) * units.kilometer
+    windows = args.windows
+    block_size = args.block_size
+    ppp_dx = args.ppp_dx
+    min_prob = args.min_prob
+
+    wrfref = xr.open_dataset(Path(os.getenv("PATH_WRFREF")) / "wrfoutREFd02")
+    path_save = Path(os.getenv("PATH_PPP_SAVE"))
+    path_save.mkdir(exist_ok=True, parents=True)
+
+    reports = pd.concat([pd.read_csv(f) for f in args.reports], ignore_index=True)
+    times = pd.to_datetime(reports[args.time_col])
+
+    # Transform all reports of the season to the WRF grid at once
+    # -----------------------------------------------------------
+    obs_x, obs_y, wrf_x, wrf_y, obs_mask = neighborhood.subset_to_forecast_grid(
+        wrfref,
+        reports[args.lon_col].values,
+        reports[args.lat_col].values,
+        return_mask=True,
+    )
+    ny, nx = wrf_x.shape
+    dx = (wrfref.DX * units.meter).to("kilometer")
+
+    xi = np.vstack((wrf_y.flatten(), wrf_x.flatten())).T
+    _, nearest = cKDTree(xi).query(np.vstack((obs_y, obs_x)).T)
+
+    # Each report belongs to the hour ending at or after its time
+    hour_idx = np.ceil((times[obs_mask] - dates[0]) / pd.Timedelta(1, unit="hour"))
+    hour_idx = hour_idx.values.astype(int)
+    valid = (hour_idx >= 0) & (hour_idx < dates.size)
+
+    events = np.zeros((dates.size, ny * nx), dtype=bool)
+    events[hour_idx[valid], nearest[valid]] = True
+    events.shape = (dates.size, ny, nx)
+
+    # Accumulate reports over each time window, smooth, and write results to file one
+    # block of hours at a time
+    # -------------------------------------------------------------------------------
+    names = {
+        window: (
+            "practically_perfect_probabilities"
+            if window == 1
+            else f"practically_perfect_probabilities_{window}h"
+        )
+        for window in windows
+    }
+    dims = ["radii", "y", "x"]
+    coords = {"sigma": (["radii"], sigmas.m, {"units": str(sigmas.units)})}
+
+    for start in range(0, dates.size, block_size):
+        block = np.arange(start, min(start + block_size, dates.size))
+
+        probs = {}
+        for window in windows:
+            window_events = np.zeros((block.size, ny, nx), dtype=bool)
+            for lag in range(window):
+                lagged = block - lag
+                window_events[lagged >= 0] |= events[lagged[lagged >= 0]]
+
+            # Smooth only the hours with reports, since all other probabilities are zero
+            window_probs = np.zeros((sigmas.size, block.size, ny, nx), dtype=np.float32)
+            hours = np.nonzero(window_events.any(axis=(1, 2)))[0]
+            if hours.size > 0:
+                for i, sigma in enumerate(sigmas.m):
+                    window_probs[i, hours] = practically_perfect(
+                        window_events[hours], sigma, dx.m, ppp_dx, min_prob
+                    )
+            probs[window] = window_probs
+
+        for h, date in enumerate(dates[block]):
+            data = {
+                names[window]: (
+                    dims,
+                    probs[window][:, h],
+                    {
+                        "description": (
+                            "Practically perfect probabilities from reports within "
+                            f"{window} hour(s) ending at the valid time"
+                        ),
+                        "units": "dimensionless",
+                    },
+                )
+                for window in windows
+            }
+            ds = xr.Dataset(data, coords, {"valid": date.strftime("%Y-%m-%d %H:%M:%S")})
+            ds.to_netcdf(path_save / f'ppp_{date.strftime("%Y%m%d%H")}.nc')
+
+
+if __name__ == "__main__":
+    main()
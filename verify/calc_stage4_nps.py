@@ -10,13 +10,22 @@ import pandas as pd
 from metpy.units import units
 
 import neighborhood
+import profiling
 
 parser = argparse.ArgumentParser(
     description='Calculate hourly neighborhood probabilities from column maximum reflectivity'
 )
 parser.add_argument('date_str', type=str, help='Date formatted as YYYYMMDDHH')
+parser.add_argument(
+    '--profile',
+    type=str,
+    default=None,
+    help='Path of a Chrome trace file of time, I/O, and memory use of each stage'
+)
 
 args = parser.parse_args()
+if args.profile is not None:
+    profiling.start()
 date = pd.to_datetime(args.date_str, format="%Y%m%d%H")
 
 radii = (np.array([20., 40., 60.]) * units.mile).to("meter")
@@ -25,7 +34,8 @@ thresholds = (np.array([0.01, 0.1, 0.25, 0.5, 1.0]) * units.inch).to("millimeter
 wrfref = xr.open_dataset(Path(os.getenv("PATH_WRFREF")) / "wrfoutREFd02")
 st4 = xr.open_dataset(Path(os.getenv("PATH_STAGE4_OBS")) / f'ST4.{date.strftime("%Y%m%d%H")}.01h.nc')
 
-obs_x, obs_y, wrf_x, wrf_y, obs_mask = neighborhood.subset_to_forecast_grid(wrfref, st4.longitude, st4.latitude, return_mask=True)
+with profiling.span('subset to forecast grid'):
+    obs_x, obs_y, wrf_x, wrf_y, obs_mask = neighborhood.subset_to_forecast_grid(wrfref, st4.longitude, st4.latitude, return_mask=True)
 points = np.vstack((obs_y, obs_x)).T
 xi = np.vstack((wrf_y.flatten(), wrf_x.flatten())).T
 
@@ -33,16 +43,19 @@ thresh_probs = {}
 for thresh in thresholds:
     obs_probs = np.full((radii.size, *wrf_x.shape), np.nan, dtype=float)
 
-    probs_bin = st4.tp.values.copy()
+    with profiling.span('read observations'):
+        probs_bin = st4.tp.values.copy()
     thresh_field = (st4.tp.values >= thresh.m)
     probs_bin[thresh_field] = 1.
     probs_bin[~thresh_field] = 0.
     values = probs_bin[obs_mask]
 
     for i, r in enumerate(radii):
-        query = neighborhood.build_query(points, xi, r)
+        with profiling.span('build query', radius=float(r.m)):
+            query = neighborhood.build_query(points, xi, r)
 
-        probs = neighborhood.neighbor_prob(xi, values, query)
+        with profiling.span('neighbor prob', radius=float(r.m)):
+            probs = neighborhood.neighbor_prob(xi, values, query)
         probs.shape = wrf_x.shape
         probs[np.where(np.isnan(probs))] = 0.
         obs_probs[i] = probs * 100.
@@ -70,4 +83,8 @@ data = {
 
 ds = xr.Dataset(data, coords)
 path_out = Path(os.getenv("PATH_STAGE4_SAVE"))
-ds.to_netcdf(path_out / f'stage4_{date.strftime("%Y%m%d%H")}.nc')
+with profiling.span('write'):
+    ds.to_netcdf(path_out / f'stage4_{date.strftime("%Y%m%d%H")}.nc')
+
+if args.profile is not None:
+    profiling.stop(args.profile)
@@ -0,0 +1,160 @@
+# climatology.py
+
+"""Streaming sample climatology of gridded binary observations.
+
+The sample climatology of a season of neighborhood observation probabilities is reduced
+block by block over dates, so the full (date, y, x) cube is never held in memory. Results
+are cached on disk per observation key, radius, and set of observation files so that every
+experiment verified against the same observations reuses them. Cached results are
+recomputed if an observation file was written after them.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+from metpy.units import units
+
+import probabilistic_verification
+
+
+def open_obs_field(path, obs_key, radius_idx):
+    """Read a single observation probability field for one neighborhood radius.
+
+    Parameters
+    ----------
+    path : str or os.path object
+        Path to an hourly observation probability file.
+    obs_key : str
+        Name of the observation probability variable.
+    radius_idx : int
+        Index of the neighborhood radius along the `radii` dimension.
+
+    Returns
+    -------
+    N x M numpy.ndarray
+    """
+    with xr.open_dataset(path) as ds:
+        return ds[obs_key].isel(radii=radius_idx).values
+
+
+def binary_event_count(files, obs_key, radius_idx, block_size=24):
+    """Count observed events and grid points over a set of observation files.
+
+    An event is any grid point with an observation probability greater than zero, which is
+    the same binarization applied to observations before computing the Brier score.
+
+    Parameters
+    ----------
+    files : list of str or os.path objects
+        Hourly observation probability files.
+    obs_key : str
+        Name of the observation probability variable.
+    radius_idx : int
+        Index of the neighborhood radius along the `radii` dimension.
+    block_size : int (optional)
+        Number of dates to read and reduce at once. Default is 24.
+
+    Returns
+    -------
+    n_events : int
+        Number of grid points with an observed event.
+    n_points : int
+        Total number of grid points.
+    """
+    n_events = 0
+    n_points = 0
+    for start in range(0, len(files), block_size):
+        block = np.stack(
+            [
+                open_obs_field(f, obs_key, radius_idx)
+                for f in files[start : start + block_size]
+            ]
+        )
+        n_events += int(np.count_nonzero(block > 0.0))
+        n_points += block.size
+    return n_events, n_points
+
+
+def cache_name(obs_key, radius_idx, files):
+    """Return a file name that uniquely identifies the climatology of a set of files."""
+    digest = hashlib.sha1()
+    for path in files:
+        digest.update(os.path.abspath(path).encode())
+        digest.update(b"\0")
+    return f"climo_{obs_key}_r{radius_idx}_{digest.hexdigest()[:16]}.nc"
+
+
+def newest_mtime(files):
+    """Return the latest modification time of a set of files."""
+    return max(os.stat(path).st_mtime for path in files)
+
+
+def sample_climatology(
+    files, dates, obs_key, radius_idx, path_cache=None, block_size=24
+):
+    """Calculate the sample climatology and uncertainty of binary gridded observations.
+
+    If `path_cache` is given, a previously computed result for the same observation key,
+    radius, and observation files is read from the cache instead of being recomputed,
+    unless one of the files was modified after the result was computed. Otherwise, the
+    result is computed and written to the cache.
+
+    Parameters
+    ----------
+    files : list of str or os.path objects
+        Hourly observation probability files, one for each date in `dates`.
+    dates : pandas.DatetimeIndex
+        Dates corresponding to `files`.
+    obs_key : str
+        Name of the observation probability variable.
+    radius_idx : int
+        Index of the neighborhood radius along the `radii` dimension.
+    path_cache : os.path object (optional)
+        Directory for cached climatologies. Default is None (no caching).
+    block_size : int (optional)
+        Number of dates to read and reduce at once. Default is 24.
+
+    Returns
+    -------
+    climo : pint.Quantity
+        Sample climatology as a *dimensionless* value.
+    uncertainty : pint.Quantity
+        Uncertainty as a *dimensionless* value.
+    """
+    if path_cache is not None:
+        path_climo = path_cache / cache_name(obs_key, radius_idx, files)
+        mtime = newest_mtime(files)
+        if path_climo.exists():
+            with xr.open_dataset(path_climo) as ds:
+                # Observations processed again after the climatology was cached
+                # invalidate it
+                if ds.attrs.get("obs_mtime") == mtime:
+                    climo = float(ds.climatology) * units.dimensionless
+                    uncertainty = float(ds.uncertainty) * units.dimensionless
+                    return climo, uncertainty
+
+    n_events, n_points = binary_event_count(files, obs_key, radius_idx, block_size)
+    climo = (n_events / n_points) * units.dimensionless
+    uncertainty = probabilistic_verification.uncertainty_of_probabilities(climo)
+
+    if path_cache is not None:
+        path_cache.mkdir(exist_ok=True, parents=True)
+        attrs = {
+            "obs_key": obs_key,
+            "radius_idx": radius_idx,
+            "date_start": dates[0].strftime("%Y-%m-%d %H:%M:%S"),
+            "date_end": dates[-1].strftime("%Y-%m-%d %H:%M:%S"),
+            "dir_obs": os.path.dirname(os.path.abspath(files[0])),
+            "obs_mtime": mtime,
+            "n_events": n_events,
+            "n_points": n_points,
+        }
+        data_vars = {
+            "climatology": ((), climo.m, {"units": str(climo.units)}),
+            "uncertainty": ((), uncertainty.m, {"units": str(uncertainty.units)}),
+        }
+        xr.Dataset(data_vars, attrs=attrs).to_netcdf(path_climo)
+
+    return climo, uncertainty
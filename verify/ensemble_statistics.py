@@ -0,0 +1,171 @@
+# ensemble_statistics.py
+
+"""Ensemble verification statistics for gridded forecasts against a gridded analysis.
+
+All functions operate directly on ensemble arrays such as those in the surface_f*.nc and
+upper_f*.nc files written by wrf_post.py, where members are aligned along one axis and y
+and x are the last two dimensions. Any other leading dimensions (e.g., forecast hour and
+pressure level) are kept, so statistics for all hours and levels are computed in one
+vectorized call. Grid points where the analysis is missing (NaN) are excluded.
+"""
+
+import numpy as np
+
+
+def _members_first(fcst, axis):
+    """Move the member axis of an ensemble forecast to the first dimension."""
+    return np.moveaxis(np.asarray(fcst, dtype=float), axis, 0)
+
+
+def _domain_errors(error):
+    """Average the bias, squared error, and absolute error over y and x."""
+    bias = np.nanmean(error, axis=(-2, -1))
+    rmse = np.sqrt(np.nanmean(error**2, axis=(-2, -1)))
+    mae = np.nanmean(np.abs(error), axis=(-2, -1))
+    return bias, rmse, mae
+
+
+def ensemble_mean_error(fcst, obs, axis=0):
+    """Calculate the bias, root mean square error, and mean absolute error of the
+    ensemble mean.
+
+    Parameters
+    ----------
+    fcst : numpy.ndarray
+        Ensemble forecasts with members along `axis` and y and x as the last two
+        dimensions.
+    obs : numpy.ndarray
+        Gridded analysis with the shape of `fcst` excluding `axis`.
+    axis : int (optional)
+        Dimension along which ensemble member forecasts are aligned. Default is 0.
+
+    Returns
+    -------
+    bias, rmse, mae : numpy.ndarray
+        Domain-averaged statistics with the shape of `obs` excluding y and x.
+    """
+    fcst = _members_first(fcst, axis)
+    return _domain_errors(fcst.mean(axis=0) - obs)
+
+
+def member_error(fcst, obs, axis=0):
+    """Calculate the bias, root mean square error, and mean absolute error of each
+    ensemble member.
+
+    Parameters
+    ----------
+    fcst : numpy.ndarray
+        Ensemble forecasts with members along `axis` and y and x as the last two
+        dimensions.
+    obs : numpy.ndarray
+        Gridded analysis with the shape of `fcst` excluding `axis`.
+    axis : int (optional)
+        Dimension along which ensemble member forecasts are aligned. Default is 0.
+
+    Returns
+    -------
+    bias, rmse, mae : numpy.ndarray
+        Domain-averaged statistics with members along the first dimension followed by
+        the shape of `obs` excluding y and x.
+    """
+    fcst = _members_first(fcst, axis)
+    return _domain_errors(fcst - obs)
+
+
+def spread_skill(fcst, obs, axis=0):
+    """Calculate ensemble spread and the skill (RMSE) of the ensemble mean.
+
+    Spread is the square root of the domain-averaged ensemble variance, which should
+    match the RMSE of the ensemble mean for a statistically consistent ensemble.
+
+    Parameters
+    ----------
+    fcst : numpy.ndarray
+        Ensemble forecasts with members along `axis` and y and x as the last two
+        dimensions.
+    obs : numpy.ndarray
+        Gridded analysis with the shape of `fcst` excluding `axis`.
+    axis : int (optional)
+        Dimension along which ensemble member forecasts are aligned. Default is 0.
+
+    Returns
+    -------
+    spread, skill : numpy.ndarray
+        Domain-averaged statistics with the shape of `obs` excluding y and x.
+    """
+    fcst = _members_first(fcst, axis)
+    missing = np.isnan(obs)
+    variance = np.where(missing, np.nan, fcst.var(axis=0, ddof=1))
+    spread = np.sqrt(np.nanmean(variance, axis=(-2, -1)))
+    skill = np.sqrt(np.nanmean((fcst.mean(axis=0) - obs) ** 2, axis=(-2, -1)))
+    return spread, skill
+
+
+def crps(fcst, obs, axis=0):
+    """Calculate the continuous ranked probability score (CRPS) of an ensemble forecast.
+
+    The CRPS of the empirical ensemble distribution is computed in closed form from the
+    sorted members x_(1) <= ... <= x_(m),
+
+        CRPS = (1 / m) sum_i |x_i - y| - (1 / m^2) sum_i (2i - m - 1) x_(i),
+
+    which avoids the O(m^2) sum over member pairs.
+
+    Parameters
+    ----------
+    fcst : numpy.ndarray
+        Ensemble forecasts with members along `axis`.
+    obs : numpy.ndarray
+        Gridded analysis with the shape of `fcst` excluding `axis`.
+    axis : int (optional)
+        Dimension along which ensemble member forecasts are aligned. Default is 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        CRPS at each grid point with the shape of `obs`.
+    """
+    fcst = np.sort(_members_first(fcst, axis), axis=0)
+    m = fcst.shape[0]
+    weights = (2.0 * np.arange(1, m + 1) - m - 1).reshape((m,) + (1,) * obs.ndim)
+    return np.abs(fcst - obs).mean(axis=0) - (weights * fcst).sum(axis=0) / m**2
+
+
+def rank_histogram(fcst, obs, axis=0, seed=None):
+    """Calculate the rank histogram of the analysis within the ensemble.
+
+    Ties between the analysis and ensemble members are broken at random.
+
+    Parameters
+    ----------
+    fcst : numpy.ndarray
+        Ensemble forecasts with members along `axis` and y and x as the last two
+        dimensions.
+    obs : numpy.ndarray
+        Gridded analysis with the shape of `fcst` excluding `axis`.
+    axis : int (optional)
+        Dimension along which ensemble member forecasts are aligned. Default is 0.
+    seed : int (optional)
+        Seed for the random number generator used to break ties.
+
+    Returns
+    -------
+    numpy.ndarray
+        Counts of each of the m + 1 ranks, with the shape of `obs` excluding y and x
+        followed by a rank dimension.
+    """
+    fcst = _members_first(fcst, axis)
+    m = fcst.shape[0]
+    rng = np.random.default_rng(seed)
+
+    below = (fcst < obs).sum(axis=0)
+    ties = (fcst == obs).sum(axis=0)
+    rank = below + np.floor(rng.random(obs.shape) * (ties + 1)).astype(int)
+
+    # Count ranks for every leading index at once by offsetting each group of ranks
+    groups = int(np.prod(obs.shape[:-2]))
+    rank = rank.reshape(groups, -1)
+    valid = ~np.isnan(obs).reshape(groups, -1)
+    offsets = np.arange(groups)[:, np.newaxis] * (m + 1)
+    counts = np.bincount((rank + offsets)[valid], minlength=groups * (m + 1))
+    return counts.reshape(*obs.shape[:-2], m + 1)
@@ -0,0 +1,92 @@
+# =============================================================================
+# fastunits.py
+# -----------------------------------------------------------------------------
+# Convert and check units of plain NumPy arrays. Fields are passed between
+# stages of post-processing and verification as float arrays, with their units
+# kept alongside as strings, rather than as pint quantities, which copy full
+# grids on every conversion. Units are only converted where fields are read or
+# written, in place, with a scale and offset looked up from pint once per pair
+# of units:
+#
+#     values = fastunits.convert(ds.T2.values.copy(), ds.T2.units, "degC")
+#
+# `check` compares fields calculated this way to the same fields calculated
+# with pint quantities, for scripts run with --validate_units.
+# =============================================================================
+
+from functools import lru_cache
+
+import numpy as np
+from metpy.units import units
+
+
+@lru_cache(maxsize=None)
+def factors(unit, target):
+    """Return the scale and offset converting values in `unit` to `target`.
+
+    Conversions between units with offsets, e.g. degC to kelvin, are linear, so they
+    are found from the conversion of 0 and 1.
+    """
+    if unit == target:
+        return 1.0, 0.0
+    offset = units.Quantity(0.0, unit).m_as(target)
+    scale = units.Quantity(1.0, unit).m_as(target) - offset
+    return scale, offset
+
+
+def convert(values, unit, target):
+    """Convert values in `unit` to `target` in place.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Floating point values, which are modified unless the units are equivalent.
+        Pass a copy if the original values must be kept.
+    unit, target : str
+        Units of `values` and units to convert to.
+
+    Returns
+    -------
+    numpy.ndarray
+        `values` in `target` units.
+    """
+    scale, offset = factors(unit, target)
+    if scale != 1.0:
+        values *= scale
+    if offset != 0.0:
+        values += offset
+    return values
+
+
+def check(values, reference, unit, name, rtol=1e-4, atol=1e-3):
+    """Check values without units against a reference calculated with pint.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values in `unit`.
+    reference : pint.Quantity or numpy.ndarray
+        Reference values. Arrays without units are assumed to be in `unit`.
+    unit : str
+        Units of `values`.
+    name : str
+        Name of the field to report if values differ.
+    rtol, atol : float (optional)
+        Relative and absolute tolerance. Defaults are 1e-4 and 1e-3, which allow for
+        float32 rounding.
+
+    Raises
+    ------
+    AssertionError
+        If values differ from the reference by more than the tolerance.
+    """
+    if hasattr(reference, "units"):
+        reference = reference.m_as(unit)
+    np.testing.assert_allclose(
+        values,
+        reference,
+        rtol=rtol,
+        atol=atol,
+        equal_nan=True,
+        err_msg=f"{name} differs from calculation with units",
+    )
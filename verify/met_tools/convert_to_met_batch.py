@@ -0,0 +1,192 @@
+# =============================================================================
+# convert_to_met_batch.py
+#
+# Convert every ensemble member of a single field in a post-processed WRF file to MET
+# gridded NetCDF files in one process. The post-processed file and the WRF reference
+# grid are each opened once, and grid attributes are cached per domain.
+#
+# Member files are written as met_mem<member>.nc in the output directory, which can be
+# passed to ensemble_stat in place of files produced with pcp_combine and
+# convert_to_met.py.
+# =============================================================================
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import xarray as xr
+
+_grid_cache = {}
+
+
+def grid_attrs(path_wrfref, domain):
+    """Return MET grid attributes and coordinates for a WRF domain.
+
+    Results are cached, so each reference file is only opened once per process.
+
+    Parameters
+    ----------
+    path_wrfref : str
+        Directory containing WRF reference files named wrfoutREFd0<domain>.
+    domain : int
+        WRF domain number.
+
+    Returns
+    -------
+    attrs : dict
+        Grid attributes as specified in the MET user's guide under Python embedding.
+    xlat : numpy.ndarray
+        Latitudes of the WRF grid.
+    xlong : numpy.ndarray
+        Longitudes of the WRF grid.
+    """
+    key = (path_wrfref, domain)
+    if key not in _grid_cache:
+        ref = xr.open_dataset("{}/wrfoutREFd0{}".format(path_wrfref, domain)).squeeze()
+        xlat = ref.variables["XLAT"].values
+        xlong = ref.variables["XLONG"].values
+
+        attrs = {
+            "type": "Lambert Conformal",
+            "hemisphere": "N",
+            "name": "TTU WRF",
+            "lat_pin": float(xlat[0, 0]),
+            "lon_pin": float(xlong[0, 0]),
+            "x_pin": 0.0,
+            "y_pin": 0.0,
+            "r_km": 6371.2,
+            "scale_lat_1": float(ref.attrs["TRUELAT1"]),
+            "scale_lat_2": float(ref.attrs["TRUELAT2"]),
+            "lon_orient": float(ref.attrs["STAND_LON"]),
+            "d_km": float(ref.attrs["DX"]) / 1000.0,
+            "nx": int(xlat.shape[1]),
+            "ny": int(xlat.shape[0]),
+        }
+        ref.close()
+        _grid_cache[key] = (attrs, xlat, xlong)
+
+    return _grid_cache[key]
+
+
+def met_global_attrs(attrs):
+    """Translate grid attributes to the global attributes of a MET NetCDF file."""
+    return {
+        "MET_version": "V8.0",
+        "FileOrigin": "File generated by convert_to_met_batch.py",
+        "Projection": attrs["type"],
+        "hemisphere": attrs["hemisphere"],
+        "scale_lat_1": "{:f} degrees_north".format(attrs["scale_lat_1"]),
+        "scale_lat_2": "{:f} degrees_north".format(attrs["scale_lat_2"]),
+        "lat_pin": "{:f} degrees_north".format(attrs["lat_pin"]),
+        "lon_pin": "{:f} degrees_east".format(attrs["lon_pin"]),
+        "x_pin": "{:f}".format(attrs["x_pin"]),
+        "y_pin": "{:f}".format(attrs["y_pin"]),
+        "lon_orient": "{:f} degrees_east".format(attrs["lon_orient"]),
+        "d_km": "{:f} km".format(attrs["d_km"]),
+        "r_km": "{:f} km".format(attrs["r_km"]),
+        "nx": "{:d} grid_points".format(attrs["nx"]),
+        "ny": "{:d} grid_points".format(attrs["ny"]),
+    }
+
+
+def met_time_attrs(initialization, valid):
+    """Return the time attributes of a MET NetCDF variable."""
+    epoch = datetime(1970, 1, 1)
+    return {
+        "init_time": initialization.strftime("%Y%m%d_%H%M%S"),
+        "init_time_ut": str(int((initialization - epoch).total_seconds())),
+        "valid_time": valid.strftime("%Y%m%d_%H%M%S"),
+        "valid_time_ut": str(int((valid - epoch).total_seconds())),
+        "accum_time": "000000",
+        "accum_time_sec": 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert all ensemble members of a field to MET NetCDF files"
+    )
+    parser.add_argument("path", type=str, help="Post-processed WRF ensemble file")
+    parser.add_argument("name", type=str, help="Name of the field to convert")
+    parser.add_argument(
+        "level", type=str, help="'Surface' or a pressure level in hPa to convert"
+    )
+    parser.add_argument("dir_out", type=str, help="Directory to write member files to")
+    parser.add_argument(
+        "--nmem",
+        type=int,
+        default=None,
+        help="Number of ensemble members to convert. Default is all members in the file",
+    )
+    args = parser.parse_args()
+
+    path_wrfref = os.getenv("PATH_WRFREF")
+
+    f = xr.open_dataset(args.path)
+
+    initialization = datetime.strptime(f.initialization, "%Y-%m-%d %H:%M:%S")
+    forecast_hour = int(f.forecast_hour)
+    valid = initialization + timedelta(hours=forecast_hour)
+    domain = int(f.domain)
+
+    attrs, xlat, xlong = grid_attrs(path_wrfref, domain)
+
+    if args.level == "Surface":
+        sel = {}
+    else:
+        sel = {"pressure": int(args.level)}
+    if args.nmem is not None:
+        sel["member"] = slice(1, args.nmem)
+
+    # Read all members at once, convert to *DOUBLE* floating point precision (float64) and
+    # round to avoid adding random noise, as in convert_to_met.py. MET NetCDF grids are
+    # stored south to north like WRF, so unlike Python embedding no flip is needed.
+    try:
+        field = f[args.name].sel(sel)
+        members = field.member.values
+        fcst = np.asarray(field, dtype=float).round(5)
+        units = str(f[args.name].units)
+    except KeyError as err:
+        sys.stderr.write("{}: KeyError: {}".format(sys.argv[0], err))
+        sys.exit(1)
+    f.close()
+
+    var_attrs = {
+        "name": args.name,
+        "long_name": args.name,
+        "level": args.level,
+        "units": units,
+    }
+    var_attrs.update(met_time_attrs(initialization, valid))
+
+    coords = {
+        "lat": (
+            ["lat", "lon"],
+            np.asarray(xlat, dtype=np.float32),
+            {"long_name": "latitude", "units": "degrees_north"},
+        ),
+        "lon": (
+            ["lat", "lon"],
+            np.asarray(xlong, dtype=np.float32),
+            {"long_name": "longitude", "units": "degrees_east"},
+        ),
+    }
+    encoding = {args.name: {"dtype": "float32", "_FillValue": -9999.0}}
+
+    if not os.path.isdir(args.dir_out):
+        os.makedirs(args.dir_out)
+
+    for m, data in zip(members, fcst):
+        ds = xr.Dataset(
+            {args.name: (["lat", "lon"], data, var_attrs)},
+            coords,
+            met_global_attrs(attrs),
+        )
+        path_out = os.path.join(args.dir_out, "met_mem{}.nc".format(int(m)))
+        ds.to_netcdf(path_out, encoding=encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -56,31 +56,21 @@ else
   fname=upper_f${fcst_hour_padded}.nc
 fi
 
-# Convert ensemble member forecasts to MET format
-for mem in `seq 1 $NUM_MEM` ; do
-  path_to_file=${dir_post}/${experiment}/${date_init}/${fname}
-
-  if [[ -e "${path_to_file}" ]]; then
-
-    cat > ${dir_tmp}/run_convert_to_met.bash << END_INPUT
-
-    singularity exec ${met_container} pcp_combine -name ${fcst_key} -add PYTHON_NUMPY \
-    'name="${dir_scripts}/convert_to_met.py ${path_to_file} ${fcst_key} ${fcst_lvl} ${mem} \
-    ";' ${dir_tmp}/met_mem${mem}.nc
-
-END_INPUT
+# Convert all ensemble member forecasts to MET format in a single process
+path_to_file=${dir_post}/${experiment}/${date_init}/${fname}
 
-    chmod u+x ${dir_tmp}/run_convert_to_met.bash
-    ${dir_tmp}/run_convert_to_met.bash
+if [[ -e "${path_to_file}" ]]; then
 
-    if [[ $? -ne 0 ]]; then
-      echo "*** Error: convert_to_met.py returned a nonzero exit code. Skipping ${path_to_file} ..."
-    fi
+  python ${dir_scripts}/convert_to_met_batch.py ${path_to_file} ${fcst_key} ${fcst_lvl} \
+  ${dir_tmp} --nmem $NUM_MEM
 
-  else
-    echo "*** Error: Could not find file ${path_to_file}, skipping..."
+  if [[ $? -ne 0 ]]; then
+    echo "*** Error: convert_to_met_batch.py returned a nonzero exit code. Skipping ${path_to_file} ..."
   fi
-done
+
+else
+  echo "*** Error: Could not find file ${path_to_file}, skipping..."
+fi
 
 # =============================================================================
 # Convert MADIS observation files to a format acceptable for MET
@@ -0,0 +1,238 @@
+# multiscale_fss.py
+
+"""Neighborhood fractions and multi-scale fractions skill score from binary fields.
+
+Fractions are computed directly from binary exceedance fields on the WRF grid, so that
+FSS can be evaluated for many neighborhood scales without recomputing neighborhood
+probabilities for each one. Square neighborhoods are summed with a summed-area table
+and circular neighborhoods with an FFT convolution, where the transform of each field is
+computed once and shared by all scales.
+
+As in `neighborhood.neighbor_prob`, neighborhoods are truncated at the domain edges and
+fractions are normalized by the number of grid points within the domain.
+"""
+
+import numpy as np
+from scipy import fft
+
+
+def summed_area_table(field):
+    """Calculate the summed-area table of a gridded field.
+
+    Parameters
+    ----------
+    field : ... x N x M numpy.ndarray
+        Gridded field with y and x as the last two dimensions.
+
+    Returns
+    -------
+    ... x (N + 1) x (M + 1) numpy.ndarray
+        Summed-area table padded with a leading row and column of zeros.
+    """
+    ny, nx = field.shape[-2:]
+    sat = np.zeros((*field.shape[:-2], ny + 1, nx + 1))
+    np.cumsum(np.cumsum(field, axis=-2, dtype=float), axis=-1, out=sat[..., 1:, 1:])
+    return sat
+
+
+def _bounds(n, half_width):
+    """Lower and upper (exclusive) indices of windows truncated at the domain edges."""
+    idx = np.arange(n)
+    return np.clip(idx - half_width, 0, n), np.clip(idx + half_width + 1, 0, n)
+
+
+def box_sum(sat, half_width):
+    """Sum a field over square neighborhoods using its summed-area table.
+
+    Parameters
+    ----------
+    sat : ... x (N + 1) x (M + 1) numpy.ndarray
+        Summed-area table from `summed_area_table`.
+    half_width : int
+        Neighborhood half-width in grid points.
+
+    Returns
+    -------
+    ... x N x M numpy.ndarray
+        Sum over the (2 * half_width + 1)-point square centered on each grid point.
+    """
+    ny, nx = sat.shape[-2] - 1, sat.shape[-1] - 1
+    jlo, jhi = _bounds(ny, half_width)
+    ilo, ihi = _bounds(nx, half_width)
+    jlo, jhi = jlo[:, np.newaxis], jhi[:, np.newaxis]
+    return (
+        sat[..., jhi, ihi]
+        - sat[..., jlo, ihi]
+        - sat[..., jhi, ilo]
+        + sat[..., jlo, ilo]
+    )
+
+
+def box_count(shape, half_width):
+    """Number of grid points within each square neighborhood truncated at the edges."""
+    jlo, jhi = _bounds(shape[0], half_width)
+    ilo, ihi = _bounds(shape[1], half_width)
+    return (jhi - jlo)[:, np.newaxis] * (ihi - ilo)[np.newaxis, :]
+
+
+def disk(radius, dx):
+    """Circular neighborhood footprint.
+
+    Parameters
+    ----------
+    radius : float
+        Neighborhood radius.
+    dx : float
+        Grid spacing in the same units as `radius`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Binary footprint of all grid points within `radius` of the center point.
+    """
+    n = int(radius / dx)
+    offsets = np.arange(-n, n + 1) * dx
+    return (np.hypot(*np.meshgrid(offsets, offsets)) <= radius).astype(float)
+
+
+class _DiskConvolver:
+    """Convolve fields with circular footprints of several sizes via FFT.
+
+    Fields are zero-padded by the largest footprint so that neighborhoods are truncated
+    at the domain edges, and the transform of each field is computed once.
+    """
+
+    def __init__(self, shape, max_half_width):
+        self.ny, self.nx = shape
+        self.pad = max_half_width
+        self.shape_fft = (
+            fft.next_fast_len(self.ny + 2 * self.pad),
+            fft.next_fast_len(self.nx + 2 * self.pad, real=True),
+        )
+        self.count_fft = self.transform(np.ones(shape))
+
+    def transform(self, field):
+        return fft.rfft2(field, s=self.shape_fft, axes=(-2, -1))
+
+    def convolve(self, field_fft, footprint):
+        n = footprint.shape[0] // 2
+        kernel_fft = fft.rfft2(footprint, s=self.shape_fft)
+        full = fft.irfft2(field_fft * kernel_fft, s=self.shape_fft, axes=(-2, -1))
+        # Rounding removes floating point noise, since all sums are integer counts
+        return np.rint(full[..., n : n + self.ny, n : n + self.nx])
+
+
+def fractions(field, scale, dx, shape="square"):
+    """Calculate neighborhood fractions of a binary field for a single scale.
+
+    Parameters
+    ----------
+    field : ... x N x M numpy.ndarray
+        Binary exceedance field with y and x as the last two dimensions.
+    scale : float
+        Neighborhood half-width (square) or radius (circle).
+    dx : float
+        Grid spacing in the same units as `scale`.
+    shape : str (optional)
+        Neighborhood shape, either 'square' or 'circle'. Default is 'square'.
+
+    Returns
+    -------
+    ... x N x M numpy.ndarray
+        Fraction of grid points within each neighborhood where the event occurs.
+    """
+    return next(_iter_fractions([field], [scale], dx, shape))[0]
+
+
+def fractions_scales(field, scales, dx, shape="square"):
+    """Calculate neighborhood fractions of a binary field for many scales.
+
+    The summed-area table or transform of the field is computed once and shared by all
+    scales.
+
+    Parameters
+    ----------
+    field : ... x N x M numpy.ndarray
+        Binary exceedance field, or a sum of binary fields, with y and x as the last two
+        dimensions.
+    scales : array-like
+        Neighborhood half-widths (square) or radii (circle).
+    dx : float
+        Grid spacing in the same units as `scales`.
+    shape : str (optional)
+        Neighborhood shape, either 'square' or 'circle'. Default is 'square'.
+
+    Returns
+    -------
+    numpy.ndarray
+        Fractions with shape (len(scales), ...) x N x M.
+    """
+    return np.stack([f[0] for f in _iter_fractions([field], scales, dx, shape)])
+
+
+def _iter_fractions(fields, scales, dx, shape):
+    """Yield neighborhood fractions of several fields for each scale in turn."""
+    grid_shape = fields[0].shape[-2:]
+    half_widths = [int(s / dx) for s in scales]
+
+    if shape == "square":
+        sats = [summed_area_table(f) for f in fields]
+        for n in half_widths:
+            count = box_count(grid_shape, n)
+            yield [box_sum(sat, n) / count for sat in sats]
+
+    elif shape == "circle":
+        conv = _DiskConvolver(grid_shape, max(half_widths))
+        fields_fft = [conv.transform(f) for f in fields]
+        for s in scales:
+            footprint = disk(s, dx)
+            count = conv.convolve(conv.count_fft, footprint)
+            yield [conv.convolve(f_fft, footprint) / count for f_fft in fields_fft]
+
+    else:
+        raise ValueError(f"Neighborhood shape {shape} not supported")
+
+
+def fss_scales(fcst, obs, scales, dx, shape="square", return_fbs=False):
+    """Calculate the fractions skill score for many neighborhood scales.
+
+    Parameters
+    ----------
+    fcst : ... x N x M numpy.ndarray
+        Binary forecast exceedance field(s), with y and x as the last two dimensions.
+        Leading dimensions (e.g., forecast hour) are scored separately.
+    obs : ... x N x M numpy.ndarray
+        Binary observed exceedance field(s) with the same shape as `fcst`.
+    scales : array-like
+        Neighborhood half-widths (square) or radii (circle).
+    dx : float
+        Grid spacing in the same units as `scales`.
+    shape : str (optional)
+        Neighborhood shape, either 'square' or 'circle'. Default is 'square'.
+    return_fbs : bool (optional)
+        Return fractions Brier score and reference fractions Brier score in addition to
+        FSS. Default is False.
+
+    Returns
+    -------
+    numpy.ndarray or 3-tuple of numpy.ndarray
+        FSS with shape (len(scales), ...), where FSS is NaN if neither the forecast nor
+        observations contain an event.
+    """
+    fcst = np.asarray(fcst, dtype=float)
+    obs = np.asarray(obs, dtype=float)
+
+    shape_out = (len(scales), *fcst.shape[:-2])
+    fbs = np.full(shape_out, np.nan)
+    fbs_worst = np.full(shape_out, np.nan)
+
+    for i, (pf, po) in enumerate(_iter_fractions([fcst, obs], scales, dx, shape)):
+        fbs[i] = ((pf - po) ** 2).mean(axis=(-2, -1))
+        fbs_worst[i] = (pf**2 + po**2).mean(axis=(-2, -1))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fss = np.where(fbs_worst > 0.0, 1.0 - fbs / fbs_worst, np.nan)
+
+    if return_fbs:
+        return fss, fbs, fbs_worst
+    return fss
@@ -2,33 +2,54 @@
 
 """Verification metrics and calculations for gridded probabilistic forecasts."""
 
+import fastunits
 import numpy as np
 from metpy.units import units
 
 
-def fss(fcst, obs, return_fbs=False):
+def _magnitudes(fcst, obs, unit):
+    """Return forecast and observed probabilities without units in common units.
+
+    Probabilities with units are not copied unless their units differ. Also returns the
+    factor converting probabilities to dimensionless values, which is applied to sums
+    rather than to every grid point.
+    """
+    values = []
+    for probs in (fcst, obs):
+        if hasattr(probs, "units"):
+            values.append((probs.m, str(probs.units)))
+        else:
+            values.append((np.asarray(probs), unit))
+    (fcst, fcst_unit), (obs, obs_unit) = values
+    if fcst_unit != obs_unit:
+        obs = fastunits.convert(np.array(obs, dtype=float), obs_unit, fcst_unit)
+    return fcst, obs, fastunits.factors(fcst_unit, "dimensionless")[0]
+
+
+def fss(fcst, obs, return_fbs=False, unit="dimensionless"):
     """Calculate fractions skill score (FSS) for a gridded probabilstic forecast.
 
     Parameters
     ----------
-    fcst : N x M pint.Quantity
+    fcst : N x M pint.Quantity or numpy.ndarray
         Forecast probabilities to verify.
-    obs : N x M pint.Quantity
+    obs : N x M pint.Quantity or numpy.ndarray
         Observation probabilities to verify forecast against.
     return_fbs : bool
         Return fractions Brier Score and reference fractions Brier score in addition to FSS.
+    unit : str (optional)
+        Units of probabilities given as arrays without units. Default is "dimensionless".
 
     Returns
     -------
     float or 3-tuple of float
     """
     nxny = fcst.size
-    fcst = fcst.to("dimensionless").m
-    obs = obs.to("dimensionless").m
+    fcst, obs, scale = _magnitudes(fcst, obs, unit)
 
     if np.max(fcst) > 0.0 or np.max(obs) > 0.0:
-        fbs = ((fcst - obs) ** 2).sum() / nxny
-        fbs_worst = (fcst ** 2 + obs ** 2).sum() / nxny
+        fbs = ((fcst - obs) ** 2).sum() / nxny * scale**2
+        fbs_worst = (fcst**2 + obs**2).sum() / nxny * scale**2
         fss = 1 - fbs / fbs_worst
 
     elif return_fbs:
@@ -42,36 +63,40 @@ def fss(fcst, obs, return_fbs=False):
         return fss
 
 
-def brier_score(fcst, obs, skill_score=False, ref=None):
+def brier_score(fcst, obs, skill_score=False, ref=None, unit="dimensionless"):
     """Calculate the Brier score (BS) for a gridded probabilistic forecast.
 
     Parameters
     ----------
-    fcst : N x M pint.Quantity
+    fcst : N x M pint.Quantity or numpy.ndarray
         Forecast probabilities to verify.
-    obs : N x M pint.Quantity
+    obs : N x M pint.Quantity or numpy.ndarray
         Observation probabilities to verify forecast against.
     skill_score : bool (optional)
         Return the Brier Skill Score (BSS) instead of BS, where the reference
         forecast is the mean of `obs`, unless `ref` is given. Default is False.
-    ref : scalar pint.Quantity (optional)
-        Reference forecast value for computing the skill score. If `ref` is
+    ref : scalar pint.Quantity or float (optional)
+        Reference forecast value for computing the skill score, which is dimensionless if
+        it has no units. If `ref` is
         given, `skill_score` is assumed to be `True` unless specified `False`.
+    unit : str (optional)
+        Units of probabilities given as arrays without units. Default is "dimensionless".
 
     Returns
     -------
     float
     """
     n = fcst.size
-    f = fcst.to("dimensionless").m
-    o = obs.to("dimensionless").m
+    f, o, scale = _magnitudes(fcst, obs, unit)
 
-    bs = (1 / n) * np.nansum((f - o) ** 2)
+    bs = (1 / n) * np.nansum((f - o) ** 2) * scale**2
 
     if skill_score and ref is not None:
-        return 1 - (bs / ref.to("dimensionless"))
+        if hasattr(ref, "units"):
+            ref = ref.m_as("dimensionless")
+        return 1 - (bs / ref)
     elif skill_score:
-        ref = (1 / n) * np.nansum((np.nanmean(o) - o) ** 2)
+        ref = (1 / n) * np.nansum((np.nanmean(o) - o) ** 2) * scale**2
         return 1 - (bs / ref)
     return bs
 
@@ -0,0 +1,164 @@
+# regrid.py
+
+"""Bilinear regridding of rectilinear latitude/longitude grids to the WRF grid.
+
+Interpolation weights are stored as a sparse matrix with one row per WRF grid point and
+one column per source grid point, so that regridding any number of fields (e.g., all
+forecast hours and pressure levels of an analysis) is a single sparse matrix product.
+Weights only depend on the pair of grids and are cached to file, so they are computed
+once per grid pair rather than once per field.
+"""
+
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+
+def _bracket(coord, points):
+    """Find the lower index and fractional distance of points within a 1-D coordinate.
+
+    Parameters
+    ----------
+    coord : numpy.ndarray
+        Strictly increasing source coordinate.
+    points : numpy.ndarray
+        Coordinates of points to interpolate to.
+
+    Returns
+    -------
+    idx : numpy.ndarray
+        Index of the coordinate at or below each point.
+    frac : numpy.ndarray
+        Fractional distance of each point from coord[idx] to coord[idx + 1].
+    inside : numpy.ndarray
+        Boolean mask of points within the bounds of the coordinate.
+    """
+    inside = (points >= coord[0]) & (points <= coord[-1])
+    idx = np.clip(np.searchsorted(coord, points, side="right") - 1, 0, coord.size - 2)
+    frac = (points - coord[idx]) / (coord[idx + 1] - coord[idx])
+    return idx, frac, inside
+
+
+def bilinear_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """Calculate bilinear interpolation weights from a rectilinear latitude/longitude grid.
+
+    Source latitudes may be ordered north to south and source longitudes may span either
+    -180 to 180 or 0 to 360 degrees. Destination points outside of the source grid have
+    no weights and are set to NaN by `regrid`.
+
+    Parameters
+    ----------
+    src_lat : numpy.ndarray
+        1-D latitudes of the source grid in degrees.
+    src_lon : numpy.ndarray
+        1-D longitudes of the source grid in degrees.
+    dst_lat : numpy.ndarray
+        2-D latitudes of the destination (WRF) grid in degrees.
+    dst_lon : numpy.ndarray
+        2-D longitudes of the destination (WRF) grid in degrees.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Weights with shape (dst_lat.size, src_lat.size * src_lon.size).
+    """
+    src_lat = np.asarray(src_lat, dtype=float)
+    src_lon = np.asarray(src_lon, dtype=float)
+    lat = np.asarray(dst_lat, dtype=float).ravel()
+    lon = np.asarray(dst_lon, dtype=float).ravel()
+    nlat, nlon = src_lat.size, src_lon.size
+
+    # Work with increasing coordinates and map sorted indices back to the source grid
+    lat_order = np.argsort(src_lat)
+    lon_order = np.argsort(src_lon)
+    if src_lon.max() > 180.0:
+        lon = np.mod(lon, 360.0)
+
+    i, fy, inside_y = _bracket(src_lat[lat_order], lat)
+    j, fx, inside_x = _bracket(src_lon[lon_order], lon)
+    inside = inside_y & inside_x
+
+    rows = np.repeat(np.nonzero(inside)[0], 4)
+    i, j, fy, fx = i[inside], j[inside], fy[inside], fx[inside]
+    corners = [
+        (i, j, (1 - fy) * (1 - fx)),
+        (i, j + 1, (1 - fy) * fx),
+        (i + 1, j, fy * (1 - fx)),
+        (i + 1, j + 1, fy * fx),
+    ]
+    cols = np.stack([lat_order[ii] * nlon + lon_order[jj] for ii, jj, _ in corners])
+    weights = np.stack([w for _, _, w in corners])
+
+    return sparse.csr_matrix(
+        (weights.T.ravel(), (rows, cols.T.ravel())), shape=(lat.size, nlat * nlon)
+    )
+
+
+def cache_name(src_lat, src_lon, dst_lat, dst_lon):
+    """Return a file name that uniquely identifies weights for a pair of grids."""
+    digest = hashlib.sha1()
+    for coord in (src_lat, src_lon, dst_lat, dst_lon):
+        coord = np.ascontiguousarray(coord, dtype=np.float64)
+        digest.update(str(coord.shape).encode())
+        digest.update(coord.tobytes())
+    return f"bilinear_{digest.hexdigest()[:16]}.npz"
+
+
+def load_weights(src_lat, src_lon, dst_lat, dst_lon, path_cache=None):
+    """Load bilinear weights for a pair of grids from cache, or calculate and cache them.
+
+    Parameters
+    ----------
+    src_lat, src_lon : numpy.ndarray
+        1-D latitudes and longitudes of the source grid in degrees.
+    dst_lat, dst_lon : numpy.ndarray
+        2-D latitudes and longitudes of the destination (WRF) grid in degrees.
+    path_cache : str or pathlib.Path (optional)
+        Directory in which weights are cached. If None, weights are not cached.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Weights as returned by `bilinear_weights`.
+    """
+    if path_cache is not None:
+        path = Path(path_cache) / cache_name(src_lat, src_lon, dst_lat, dst_lon)
+        if path.exists():
+            return sparse.load_npz(path).tocsr()
+
+    weights = bilinear_weights(src_lat, src_lon, dst_lat, dst_lon)
+
+    if path_cache is not None:
+        path.parent.mkdir(exist_ok=True, parents=True)
+        sparse.save_npz(path, weights)
+
+    return weights
+
+
+def regrid(weights, field, shape):
+    """Interpolate fields on the source grid to the destination grid.
+
+    Parameters
+    ----------
+    weights : scipy.sparse.csr_matrix
+        Weights as returned by `bilinear_weights` or `load_weights`.
+    field : numpy.ndarray
+        Fields on the source grid with latitude and longitude as the last two dimensions.
+        All leading dimensions are regridded at once.
+    shape : tuple
+        Shape (y, x) of the destination grid.
+
+    Returns
+    -------
+    numpy.ndarray
+        Fields on the destination grid with the leading dimensions of `field`.
+    """
+    field = np.asarray(field, dtype=float)
+    leading = field.shape[:-2]
+    values = field.reshape(-1, field.shape[-2] * field.shape[-1])
+
+    result = (weights @ values.T).T
+    result[:, weights.getnnz(axis=1) == 0] = np.nan
+    return result.reshape(*leading, *shape)
@@ -0,0 +1,160 @@
+# =============================================================================
+# verify_continuous.py
+#
+# Verify surface or upper air ensemble forecasts from wrf_post.py against gridded
+# analyses on a latitude/longitude grid (e.g., GFS or RAP). Analyses are bilinearly
+# interpolated to the WRF grid with sparse weights that are cached per grid pair, then
+# bias, RMSE, and MAE of every member and of the ensemble mean are calculated for all
+# forecast hours and pressure levels at once.
+# =============================================================================
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from metpy.units import units
+
+import ensemble_statistics
+import regrid
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Verify ensemble forecasts against gridded latitude/longitude analyses"
+    )
+    parser.add_argument(
+        "dir_post", type=str, help="Directory of post-processed forecasts to verify"
+    )
+    parser.add_argument(
+        "initialization", type=str, help="Initialization date (YYYYMMDDHH)"
+    )
+    parser.add_argument(
+        "level", type=str, choices=["surface", "upper"], help="Forecast file type"
+    )
+    parser.add_argument("fcst_key", type=str, help="Forecast variable to verify")
+    parser.add_argument("anl_key", type=str, help="Analysis variable to verify against")
+    parser.add_argument(
+        "anl_fmt",
+        type=str,
+        help=(
+            "Path to analysis files as a strftime format of the valid date, e.g. "
+            "/path/to/gfs_%%Y%%m%%d%%H.nc"
+        ),
+    )
+    parser.add_argument("dir_out", type=str, help="Directory to write files to")
+    parser.add_argument(
+        "--nhours",
+        type=int,
+        default=48,
+        help="Total number of forecast hours to verify",
+    )
+    parser.add_argument(
+        "--lat_name", type=str, default="latitude", help="Analysis latitude coordinate"
+    )
+    parser.add_argument(
+        "--lon_name",
+        type=str,
+        default="longitude",
+        help="Analysis longitude coordinate",
+    )
+    parser.add_argument(
+        "--level_name",
+        type=str,
+        default="isobaricInhPa",
+        help="Analysis pressure level coordinate in hPa for upper air verification",
+    )
+    parser.add_argument(
+        "--path_cache",
+        type=str,
+        default="/lustre/scratch/rmanser/regrid_weights",
+        help="Directory in which to cache interpolation weights",
+    )
+
+    args = parser.parse_args()
+    dir_post = Path(args.dir_post)
+    init = pd.to_datetime(args.initialization, format="%Y%m%d%H")
+    level = args.level
+    fcst_key = args.fcst_key
+    anl_key = args.anl_key
+    anl_fmt = args.anl_fmt
+    dir_out = Path(args.dir_out)
+    nhours = args.nhours
+    lat_name = args.lat_name
+    lon_name = args.lon_name
+    level_name = args.level_name
+    path_cache = args.path_cache
+
+    # Surface forecasts are written every 6 hours and upper air forecasts every 12 hours
+    dt = 6 if level == "surface" else 12
+    fhours = np.arange(0, nhours + dt, dt)
+
+    files = [dir_post / f"{level}_f{str(h).zfill(2)}.nc" for h in fhours]
+    fcst = xr.open_mfdataset(
+        files, concat_dim="forecast_hour", combine="nested"
+    ).assign_coords(forecast_hour=fhours)[fcst_key]
+    fcst_units = fcst.attrs.get("units", "")
+    domain = int(xr.open_dataset(files[0]).domain)
+
+    wrfref = xr.open_dataset(
+        Path(os.getenv("PATH_WRFREF")) / f"wrfoutREFd0{domain}"
+    ).squeeze()
+    wrf_lat = wrfref.XLAT.values
+    wrf_lon = wrfref.XLONG.values
+
+    # Read analyses for all valid times and regrid them in a single sparse product
+    # ---------------------------------------------------------------------------
+    dates = [init + pd.Timedelta(h, unit="hour") for h in fhours]
+    analyses = []
+    for date in dates:
+        anl = xr.open_dataset(date.strftime(anl_fmt))[anl_key].squeeze()
+        if level == "upper":
+            anl = anl.sel({level_name: fcst.pressure.values})
+        analyses.append(anl.transpose(..., lat_name, lon_name))
+    anl_lat = analyses[0][lat_name].values
+    anl_lon = analyses[0][lon_name].values
+
+    anl = np.stack([a.values for a in analyses])
+    anl_units = analyses[0].attrs.get("units", fcst_units)
+    if fcst_units and anl_units != fcst_units:
+        anl = units.Quantity(anl, anl_units).to(fcst_units).m
+
+    weights = regrid.load_weights(anl_lat, anl_lon, wrf_lat, wrf_lon, path_cache)
+    anl = regrid.regrid(weights, anl, wrf_lat.shape)
+
+    # Forecasts are (forecast_hour, member, [pressure,] y, x)
+    values = fcst.values
+    stats_members = ensemble_statistics.member_error(values, anl, axis=1)
+    stats_mean = ensemble_statistics.ensemble_mean_error(values, anl, axis=1)
+
+    dims = ["forecast_hour"]
+    coords = {"forecast_hour": fhours, "member": fcst.member.values}
+    if "pressure" in fcst.dims:
+        dims.append("pressure")
+        coords["pressure"] = fcst.pressure.values
+
+    data_vars = {}
+    names = {"bias": "Bias", "rmse": "RMSE", "mae": "MAE"}
+    for (stat, name), member_stat, mean_stat in zip(
+        names.items(), stats_members, stats_mean
+    ):
+        data_vars[f"member_{stat}"] = (
+            ["member"] + dims,
+            member_stat,
+            {"description": f"{name} of each member", "units": fcst_units},
+        )
+        data_vars[f"mean_{stat}"] = (
+            dims,
+            mean_stat,
+            {"description": f"{name} of the ensemble mean", "units": fcst_units},
+        )
+    attrs = {
+        "initialization": init.strftime("%Y-%m-%d %H:%M:%S"),
+        "forecast": fcst_key,
+        "analysis": anl_key,
+    }
+
+    ds = xr.Dataset(data_vars, coords, attrs)
+    dir_out.mkdir(exist_ok=True, parents=True)
+    ds.to_netcdf(dir_out / f'continuous_{fcst_key}_{init.strftime("%Y%m%d%H")}.nc')
@@ -7,8 +7,10 @@ import xarray as xr
 from metpy.units import units
 from sklearn.metrics import roc_auc_score
 
+import climatology
+import fastunits
 import probabilistic_verification
-
+import profiling
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -64,6 +66,58 @@ if __name__ == "__main__":
         default="/lustre/scratch/rmanser/wrfref/wrfoutREFd02",
         help="Reference file for WRF base fields and attributes",
     )
+    parser.add_argument(
+        "--dir_post",
+        type=str,
+        default="/lustre/scratch/rmanser/wrf_post",
+        help="Parent directory of post-processed forecasts of each experiment",
+    )
+    parser.add_argument(
+        "--dir_obs",
+        type=str,
+        default=None,
+        help=(
+            "Directory of observed neighborhood probabilities. Default is gr_neps, "
+            "st4_nps, or practically_perfect in /lustre/scratch/rmanser, depending on "
+            "`obs_key`"
+        ),
+    )
+    parser.add_argument(
+        "--path_cache",
+        type=str,
+        default="/lustre/scratch/rmanser/climatology",
+        help="Directory of cached observation climatologies shared between experiments",
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=24,
+        help="Number of observation dates to reduce at once when computing climatology",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help=(
+            "SQLite manifest of ensemble files (see manifest.py in the repository root, "
+            "which must be on the PYTHONPATH). If given, forecast files are found with a "
+            "single query of the manifest instead of globbing each initialization"
+        ),
+    )
+    parser.add_argument(
+        "--validate_units",
+        action="store_true",
+        help=(
+            "Also verify each forecast hour with pint quantities, and stop if the scores "
+            "differ from those calculated without units"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Path of a Chrome trace file of time, I/O, and memory use of each stage",
+    )
 
     path = Path("/lustre/scratch/rmanser")
     fmt = "%Y%m%d%H"
@@ -80,6 +134,16 @@ if __name__ == "__main__":
     nhours = args.nhours
     dt_hours = args.dt_hours
     path_ref = Path(args.path_ref)
+    dir_post = Path(args.dir_post)
+    dir_obs = Path(args.dir_obs) if args.dir_obs is not None else None
+    path_cache = Path(args.path_cache)
+    block_size = args.block_size
+    path_manifest = args.manifest
+    validate_units = args.validate_units
+    path_profile = args.profile
+
+    if path_profile is not None:
+        profiling.start()
 
     inits = pd.date_range(init_start, init_end, freq=init_freq)
     fhours = np.arange(dt_hours, nhours + dt_hours, dt_hours)
@@ -98,6 +162,8 @@ if __name__ == "__main__":
     )
 
     fss = np.full((len(inits), nhours), np.nan)
+    fbs = np.full((len(inits), nhours), np.nan)
+    fbs_worst = np.full((len(inits), nhours), np.nan)
     bss = np.full((len(inits), nhours), np.nan)
     freq = np.full((len(inits), nhours, len(bins)), np.nan)
     hits = np.full((len(inits), nhours, len(bins)), np.nan)
@@ -108,96 +174,148 @@ if __name__ == "__main__":
     # Open observation files
     # ----------------------
 
-    dates = pd.date_range("2016-04-27 00:00", "2016-06-05 12:00", freq="1H")
+    # Valid dates of every forecast hour verified, which are the dates of the observation
+    # files processed for these initializations
+    dates = pd.DatetimeIndex(
+        sorted(
+            {init + pd.Timedelta(hours=int(hour)) for init in inits for hour in fhours}
+        )
+    )
     dates_da = xr.DataArray(data=dates, name="date", dims="date")
     if "col_max_refl" in obs_key:
-        files = [
-            path / "gr_neps" / f'gridrad_{d.strftime("%Y%m%d%H")}.nc' for d in dates
-        ]
-        obs = xr.open_mfdataset(files, concat_dim=dates_da, combine="nested")
-        obs_subset = obs[obs_key].sel(radii=radius_idx).load().values * units.percent
+        default_dir, prefix = "gr_neps", "gridrad"
     elif "precip" in obs_key:
-        files = [
-            path / "st4_nps" / f'stage4_{d.strftime("%Y%m%d%H")}.nc' for d in dates
-        ]
-        obs = xr.open_mfdataset(files, concat_dim=dates_da, combine="nested")
-        obs_subset = obs[obs_key].sel(radii=radius_idx).load().values * units.percent
+        default_dir, prefix = "st4_nps", "stage4"
     elif "practically_perfect" in obs_key:
-        files = [
-            path / "practically_perfect" / f'ppp_{d.strftime("%Y%m%d%H")}.nc'
-            for d in dates
-        ]
-        obs = xr.open_mfdataset(files, concat_dim=dates_da, combine="nested")
-        obs_subset = (
-            obs[obs_key].isel(radii=radius_idx).load().values * units.dimensionless
-        ).to("percent")
+        default_dir, prefix = "practically_perfect", "ppp"
     else:
         raise ValueError(f"Observation key {obs_key} not supported")
+    if dir_obs is None:
+        dir_obs = path / default_dir
+    files = [dir_obs / f'{prefix}_{d.strftime("%Y%m%d%H")}.nc' for d in dates]
+    with profiling.span("open observations"):
+        obs = xr.open_mfdataset(files, concat_dim=dates_da, combine="nested")
 
     # ----------------------------------------------------------------------------------------
     # Sample climatology and uncertainty for BSS and attributes statistics (Wilks 2011, book)
     # ----------------------------------------------------------------------------------------
-    locs = np.where(obs_subset > 0.0 * units.percent)
-    obs_bin = np.zeros_like(obs_subset)
-    obs_subset[locs] = 100.0 * units.percent
-
-    sample_climo = probabilistic_verification.sample_climatology_of_probabilities(
-        obs_subset
-    )
-    uncertainty = probabilistic_verification.uncertainty_of_probabilities(sample_climo)
+    # Reduced over blocks of dates and cached, so the season of observations is never loaded
+    # at once and every experiment verified against these observations reuses the result
+    with profiling.span("sample climatology"):
+        sample_climo, uncertainty = climatology.sample_climatology(
+            files,
+            dates,
+            obs_key,
+            radius_idx,
+            path_cache=path_cache,
+            block_size=block_size,
+        )
 
     # ----------------
     # Verify forecasts
     # ----------------
 
+    # Index post-processed forecasts of this experiment and find all of them at once
+    if path_manifest is not None:
+        import manifest
+
+        with manifest.Manifest(path_manifest) as index:
+            index.update(dir_post, only=[exp])
+            rows = index.files(experiment=exp, kind="convective")
+        fcst_files = {}
+        for row in sorted(rows, key=lambda row: row["hour"]):
+            if row["hour"] in fhours:
+                fcst_files.setdefault(row["init"], []).append(row["path"])
+
     for i, init in enumerate(inits):
         if exp == "recenter" and init in bad_inits:
             continue
 
-        files = sorted(
-            path.glob(f'wrf_post/{exp}/{init.strftime("%Y%m%d%H")}/convective_f*.nc')
-        )
-        if len(files) < 48:
+        if path_manifest is not None:
+            files = fcst_files.get(init.strftime("%Y%m%d%H"), [])
+        else:
+            dir_init = dir_post / exp / init.strftime("%Y%m%d%H")
+            files = [
+                dir_init / f"convective_f{str(hour).zfill(2)}.nc" for hour in fhours
+            ]
+            files = [f for f in files if f.exists()]
+        if len(files) < len(fhours):
             print(
-                f"Only found {len(files)} of 48 files. Skipping initialization {init}"
+                f"Only found {len(files)} of {len(fhours)} files. "
+                f"Skipping initialization {init}"
             )
             continue
 
-        fcst = xr.open_mfdataset(files, concat_dim="forecast_hour", combine="nested")
+        with profiling.span("open forecasts", init=str(init)):
+            fcst = xr.open_mfdataset(
+                files, concat_dim="forecast_hour", combine="nested"
+            )
 
         for h, hour in enumerate(fhours):
 
-            fprobs = fcst[fcst_key].values[h, radius_idx] * units(fcst[fcst_key].units)
             date = init + pd.Timedelta(f"{hour} hours")
+            # Probabilities are verified in percent without units. Units are converted
+            # in place here, where they are read, rather than in every score
+            with profiling.span("read probabilities", hour=int(hour)):
+                fprobs = fastunits.convert(
+                    fcst[fcst_key].values[h, radius_idx],
+                    fcst[fcst_key].units,
+                    "percent",
+                )
+                oprobs = obs[obs_key].isel(radii=radius_idx).sel(date=date).values
+            if "practically_perfect" in obs_key:
+                oprobs = fastunits.convert(oprobs, "dimensionless", "percent")
+            if validate_units:
+                fprobs_pint = fprobs.copy() * units.percent
+                oprobs_pint = oprobs.copy() * units.percent
 
-            oprobs = obs[obs_key].isel(radii=radius_idx).sel(date=date).values
-            if obs_key == "practically_perfect_probabilities":
-                oprobs = (oprobs * units.dimensionless).to("percent")
-            else:
-                oprobs = oprobs * units.percent
-
-            # FSS requires fractional probabilities
-            fss[i, h] = probabilistic_verification.fss(fprobs, oprobs)
+            # FSS requires fractional probabilities. The fractions Brier scores are kept as
+            # sufficient statistics for aggregating FSS over initializations
+            with profiling.span("fss", hour=int(hour)):
+                fss[i, h], fbs[i, h], fbs_worst[i, h] = probabilistic_verification.fss(
+                    fprobs, oprobs, return_fbs=True, unit="percent"
+                )
 
             # All other verification measures require binary probabilities
-            locs = np.where(oprobs > 0.0 * units.percent)
-            oprobs[locs] = 100.0 * units.percent
+            oprobs[oprobs > 0.0] = 100.0
 
-            bss[i, h] = probabilistic_verification.brier_score(
-                fprobs, oprobs, skill_score=True, ref=uncertainty
-            )
+            with profiling.span("brier score", hour=int(hour)):
+                bss[i, h] = probabilistic_verification.brier_score(
+                    fprobs, oprobs, skill_score=True, ref=uncertainty, unit="percent"
+                )
 
-            (
-                freq[i, h],
-                hits[i, h],
-                bin_mean[i, h],
-            ) = probabilistic_verification.reliability(fprobs, oprobs, bins)
+            with profiling.span("reliability", hour=int(hour)):
+                (
+                    freq[i, h],
+                    hits[i, h],
+                    bin_mean[i, h],
+                ) = probabilistic_verification.reliability(fprobs, oprobs, bins.m)
 
-            try:
-                auc[i, h] = roc_auc_score(oprobs.flatten(), fprobs.flatten())
-            except ValueError:
-                print("*** Warning: undefined ROC AUC. Setting value to np.nan\n")
-                auc[i, h] = np.nan
+            if validate_units:
+                with profiling.span("validate units", hour=int(hour)):
+                    scores = probabilistic_verification.fss(
+                        fprobs_pint, oprobs_pint, return_fbs=True
+                    )
+                    for name, values, score in zip(
+                        ("fss", "fbs", "fbs_worst"), (fss, fbs, fbs_worst), scores
+                    ):
+                        fastunits.check(
+                            values[i, h], score, "dimensionless", name, atol=0
+                        )
+                    oprobs_pint[oprobs_pint > 0.0 * units.percent] = (
+                        100.0 * units.percent
+                    )
+                    score = probabilistic_verification.brier_score(
+                        fprobs_pint, oprobs_pint, skill_score=True, ref=uncertainty
+                    )
+                    fastunits.check(bss[i, h], score, "dimensionless", "bss", atol=0)
+
+            with profiling.span("roc area", hour=int(hour)):
+                try:
+                    auc[i, h] = roc_auc_score(oprobs.flatten(), fprobs.flatten())
+                except ValueError:
+                    print("*** Warning: undefined ROC AUC. Setting value to np.nan\n")
+                    auc[i, h] = np.nan
 
     sample_climo = xr.DataArray(
         data=sample_climo.m, attrs={"units": str(sample_climo.units)}
@@ -215,6 +333,8 @@ if __name__ == "__main__":
     }
     data_vars = {
         "fss": (dims, fss),
+        "fbs": (dims, fbs),
+        "fbs_worst": (dims, fbs_worst),
         "bss": (dims, bss),
         "frequency": (dims_reliability, freq),
         "hits": (dims_reliability, hits),
@@ -226,4 +346,8 @@ if __name__ == "__main__":
     ds = xr.Dataset(data_vars, coords)
     path_save = dir_out / exp
     path_save.mkdir(exist_ok=True, parents=True)
-    ds.to_netcdf(path_save / f"{fcst_key}_r{radius_idx}.nc")
+    with profiling.span("write"):
+        ds.to_netcdf(path_save / f"{fcst_key}_r{radius_idx}.nc")
+
+    if path_profile is not None:
+        profiling.stop(path_profile)
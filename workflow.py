@@ -0,0 +1,742 @@
+# =============================================================================
+# workflow.py
+#
+# Run the reduce -> post -> neighborhood probabilities -> verify pipeline as a graph of
+# tasks. Each task is keyed by (stage, experiment, initialization, member, hour) and
+# declares the files it reads and writes. Dependencies between tasks are found by
+# matching inputs to outputs, and tasks whose outputs are all newer than their inputs
+# are skipped, so re-running a season only redoes stale work.
+#
+# Tasks run on a local process pool by default, or are submitted to SLURM with
+# dependencies between jobs using --backend slurm.
+# =============================================================================
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from pathlib import Path
+
+TaskKey = namedtuple("TaskKey", ["stage", "experiment", "init", "member", "hour"])
+
+# Observed neighborhood probabilities, keyed by the type of observation key they are
+# verified with (see observation_type), with the prefix of their file names
+OBSERVATIONS = {
+    "gridrad": {"key": "col_max_refl", "prefix": "gridrad"},
+    "stage4": {"key": "precip", "prefix": "stage4"},
+    "practically_perfect": {"key": "practically_perfect", "prefix": "ppp"},
+}
+
+
+def observation_type(obs_key):
+    """Return the type of observations of an observation key, as in verify_convective.py.
+
+    Raises
+    ------
+    ValueError
+        If the key does not match any type of observations.
+    """
+    for obs_type, obs in OBSERVATIONS.items():
+        if obs["key"] in obs_key:
+            return obs_type
+    raise ValueError(f"Observation key {obs_key} not supported")
+
+
+class Task:
+    """A command with declared input and output files.
+
+    Parameters
+    ----------
+    key : TaskKey
+        Unique key of the task.
+    command : list of str
+        Command and arguments to run.
+    inputs : list of str or pathlib.Path
+        Files read by the command.
+    outputs : list of str or pathlib.Path
+        Files written by the command.
+    env : dict (optional)
+        Environment variables to set for the command.
+    """
+
+    def __init__(self, key, command, inputs, outputs, env=None):
+        self.key = key
+        self.command = [str(arg) for arg in command]
+        # Paths are kept as strings, which are much faster to hash than Path objects
+        # for the hundreds of thousands of files in a season
+        self.inputs = [os.fspath(path) for path in inputs]
+        self.outputs = [os.fspath(path) for path in outputs]
+        self.env = env or {}
+
+    def __repr__(self):
+        return f"Task({', '.join(str(k) for k in self.key if k is not None)})"
+
+    def is_stale(self, mtimes=None):
+        """Return True if any output is missing or older than the newest input.
+
+        Missing inputs are ignored, e.g. WRF output that was deleted after reduction.
+
+        Parameters
+        ----------
+        mtimes : dict (optional)
+            Modification times of existing files keyed by absolute path, e.g. from
+            `manifest.Manifest.mtimes`. Default is to stat each file.
+        """
+        if mtimes is None:
+            mtimes = _StatTimes()
+
+        output_mtimes = [mtimes.get(path) for path in self.outputs]
+        if not output_mtimes or None in output_mtimes:
+            return True
+        oldest_output = min(output_mtimes)
+
+        for path in self.inputs:
+            mtime = mtimes.get(path)
+            if mtime is not None and mtime > oldest_output:
+                return True
+        return False
+
+
+class _StatTimes:
+    """Look up file modification times on the file system like a dict of mtimes."""
+
+    def get(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+
+class Workflow:
+    """A directed acyclic graph of tasks."""
+
+    def __init__(self):
+        self.tasks = {}
+        self._producers = {}
+
+    def add(self, task):
+        """Add a task to the workflow."""
+        if task.key in self.tasks:
+            raise ValueError(f"Duplicate task {task}")
+        self.tasks[task.key] = task
+        for path in task.outputs:
+            self._producers[path] = task.key
+
+    def dependencies(self, task):
+        """Return the keys of tasks that write any input of a task."""
+        keys = {self._producers.get(path) for path in task.inputs}
+        keys.discard(None)
+        keys.discard(task.key)
+        return keys
+
+    def order(self):
+        """Return tasks in an order where every task follows its dependencies.
+
+        Raises
+        ------
+        ValueError
+            If the dependencies between tasks contain a cycle.
+        """
+        remaining = {}
+        dependents = {key: [] for key in self.tasks}
+        for key, task in self.tasks.items():
+            deps = self.dependencies(task)
+            remaining[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+
+        ordered = []
+        ready = deque(key for key, n in remaining.items() if n == 0)
+        while ready:
+            key = ready.popleft()
+            ordered.append(self.tasks[key])
+            for other in dependents[key]:
+                remaining[other] -= 1
+                if remaining[other] == 0:
+                    ready.append(other)
+
+        if len(ordered) != len(self.tasks):
+            raise ValueError("Task dependencies contain a cycle")
+        return ordered
+
+    def plan(self, force=False, mtimes=None):
+        """Return tasks that need to run, in dependency order.
+
+        A task runs if it is stale, or if any of its dependencies run. File modification
+        times are looked up in `mtimes` if given (see `Task.is_stale`).
+        """
+        scheduled = set()
+        plan = []
+        for task in self.order():
+            if (
+                force
+                or task.is_stale(mtimes)
+                or any(key in scheduled for key in self.dependencies(task))
+            ):
+                scheduled.add(task.key)
+                plan.append(task)
+        return plan
+
+
+class LocalBackend:
+    """Run tasks as subprocesses on the local machine.
+
+    Parameters
+    ----------
+    nprocs : int
+        Maximum number of tasks to run at once.
+    """
+
+    def __init__(self, nprocs=1):
+        self.nprocs = nprocs
+
+    def run(self, workflow, tasks):
+        """Run tasks as soon as all of their dependencies have finished.
+
+        Tasks that depend on a failed task are not run.
+
+        Returns
+        -------
+        list of Task
+            Tasks that failed or were not run because a dependency failed.
+        """
+        tasks = {task.key: task for task in tasks}
+        remaining = {}
+        dependents = {key: [] for key in tasks}
+        for key, task in tasks.items():
+            deps = workflow.dependencies(task) & tasks.keys()
+            remaining[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+
+        failed = []
+
+        def skip(key):
+            # Tasks downstream of a failed task are never run
+            for other in dependents[key]:
+                if remaining[other] > 0:
+                    remaining[other] = -1
+                    print(f"Skipping {tasks[other]}: a dependency failed")
+                    failed.append(tasks[other])
+                    skip(other)
+
+        with ThreadPoolExecutor(self.nprocs) as pool:
+            running = {}
+            ready = deque(key for key, n in remaining.items() if n == 0)
+            while ready or running:
+                while ready:
+                    task = tasks[ready.popleft()]
+                    print(f"Running {task}")
+                    running[pool.submit(self._run_task, task)] = task
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if future.result() != 0:
+                        print(f"*** ERROR: {task} exited with code {future.result()}")
+                        failed.append(task)
+                        skip(task.key)
+                        continue
+                    for other in dependents[task.key]:
+                        remaining[other] -= 1
+                        if remaining[other] == 0:
+                            ready.append(other)
+
+        return failed
+
+    @staticmethod
+    def _run_task(task):
+        for path in task.outputs:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        env = dict(os.environ, **task.env)
+        return subprocess.run(task.command, env=env).returncode
+
+
+class SlurmBackend:
+    """Submit tasks as SLURM jobs with dependencies between jobs.
+
+    Parameters
+    ----------
+    partition : str
+        SLURM partition to submit jobs to.
+    time : str
+        Time limit of each job.
+    ntasks : int
+        Number of tasks (cores) requested by each job.
+    """
+
+    def __init__(self, partition="quanah", time="06:00:00", ntasks=1):
+        self.partition = partition
+        self.time = time
+        self.ntasks = ntasks
+
+    def run(self, workflow, tasks):
+        """Submit tasks in dependency order without waiting for them to finish.
+
+        Returns
+        -------
+        list of Task
+            Tasks that could not be submitted.
+        """
+        job_ids = {}
+        failed = []
+        for task in tasks:
+            for path in task.outputs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            command = [
+                "sbatch",
+                "--parsable",
+                f"--partition={self.partition}",
+                f"--time={self.time}",
+                f"--ntasks={self.ntasks}",
+                "--nodes=1",
+                f"--job-name={task.key.stage}",
+                "--export=ALL," + ",".join(f"{k}={v}" for k, v in task.env.items()),
+            ]
+            deps = [
+                job_ids[key] for key in workflow.dependencies(task) if key in job_ids
+            ]
+            if deps:
+                command.append(f"--dependency=afterok:{':'.join(deps)}")
+            command.append(f"--wrap={subprocess.list2cmdline(task.command)}")
+
+            result = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                print(f"*** ERROR: could not submit {task}")
+                failed.append(task)
+                continue
+            job_ids[task.key] = result.stdout.strip().split(";")[0]
+            print(f"Submitted {task} as job {job_ids[task.key]}")
+
+        return failed
+
+
+def build_pipeline(args):
+    """Create the tasks of the reduce, post, NPs, and verify stages.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments of this script.
+
+    Returns
+    -------
+    Workflow
+    """
+    fmt = "%Y%m%d%H"
+    wrf_fmt = "%Y-%m-%d_%H:%M:%S"
+    python = args.python
+    dir_base = Path(args.dir_base)
+    # Absolute paths match the paths of files indexed in a manifest
+    dir_exp = Path(os.path.abspath(args.dir_exp))
+    dir_post = Path(os.path.abspath(args.dir_post))
+    dir_nps = Path(os.path.abspath(args.dir_nps))
+    dir_verif = Path(os.path.abspath(args.dir_verif))
+
+    init_start = datetime.strptime(args.init_start, fmt)
+    init_end = datetime.strptime(args.init_end, fmt)
+    inits = []
+    init = init_start
+    while init <= init_end:
+        inits.append(init)
+        init += timedelta(hours=args.init_freq)
+    members = range(1, args.nmem + 1)
+    hours = range(args.nhours + 1)
+
+    workflow = Workflow()
+
+    def post_files(exp, init, hour):
+        path = f"{dir_post}/{exp}/{init.strftime(fmt)}"
+        files = []
+        if hour > 0:
+            files.append(f"{path}/convective_f{str(hour).zfill(2)}.nc")
+        if hour % 6 == 0:
+            files.append(f"{path}/surface_f{str(hour).zfill(2)}.nc")
+        if hour % 12 == 0:
+            files.append(f"{path}/upper_f{str(hour).zfill(2)}.nc")
+        return files
+
+    for exp in args.experiments:
+        for init in inits:
+            init_str = init.strftime(fmt)
+
+            # Format each valid date once, since a season has millions of file paths
+            dates = [(init + timedelta(hours=h)).strftime(wrf_fmt) for h in hours]
+            dirs_member = {
+                mem: f"{dir_exp}/{exp}/{init_str}/mem{mem}" for mem in members
+            }
+            reduced = {
+                (mem, domain): [
+                    f"{dirs_member[mem]}/wrfoutred/wrfout_d0{domain}_red_{date}"
+                    for date in dates
+                ]
+                for mem in members
+                for domain in (1, 2)
+            }
+
+            if "reduce" in args.stages:
+                for mem in members:
+                    dir_member = dirs_member[mem]
+                    workflow.add(
+                        Task(
+                            TaskKey("reduce", exp, init_str, mem, None),
+                            [
+                                python,
+                                dir_base / "run_ensemble/util/reduce_wrf.py",
+                                dir_member,
+                                init_str,
+                                "--nhours",
+                                args.nhours,
+                                "--nprocs",
+                                1,
+                            ],
+                            [
+                                f"{dir_member}/wrf/wrfout_d0{domain}_{date}"
+                                for date in dates
+                                for domain in (1, 2)
+                            ],
+                            [
+                                reduced[mem, domain][h]
+                                for h in hours
+                                for domain in (1, 2)
+                            ],
+                        )
+                    )
+
+            if "post" in args.stages:
+                for hour in hours:
+                    # Hourly precipitation also requires the previous forecast hour
+                    inputs = [
+                        reduced[mem, args.domain][h]
+                        for mem in members
+                        for h in {max(hour - 1, 0), hour}
+                    ]
+                    workflow.add(
+                        Task(
+                            TaskKey("post", exp, init_str, None, hour),
+                            [
+                                python,
+                                dir_base / "post/wrf_post.py",
+                                dir_exp / exp / init_str,
+                                init_str,
+                                hour,
+                                args.nmem,
+                                args.domain,
+                                "--path_ref",
+                                args.path_ref,
+                                "--path_save",
+                                dir_post / exp / init_str,
+                            ],
+                            inputs,
+                            post_files(exp, init, hour),
+                        )
+                    )
+
+    # Observed NPs only depend on the valid date, so they are shared by all experiments.
+    # Only observations verified against (see --verify) are processed
+    obs_types = sorted({observation_type(pair.split(":")[1]) for pair in args.verify})
+    dates = sorted(
+        {init + timedelta(hours=h) for init in inits for h in hours if h > 0}
+    )
+
+    def obs_files(obs_type):
+        prefix = OBSERVATIONS[obs_type]["prefix"]
+        return [f"{dir_nps}/{prefix}_{date.strftime(fmt)}.nc" for date in dates]
+
+    if "nps" in args.stages:
+        path_wrfref = str(Path(args.path_ref).parent)
+        if "gridrad" in obs_types:
+            for date in dates:
+                workflow.add(
+                    Task(
+                        TaskKey("nps_gridrad", None, None, None, date.strftime(fmt)),
+                        [
+                            python,
+                            dir_base / "verify/calc_gridrad_nps.py",
+                            date.strftime(fmt),
+                        ],
+                        [],
+                        [dir_nps / f"gridrad_{date.strftime(fmt)}.nc"],
+                        env={
+                            "PATH_GRIDRAD_OBS": args.path_gridrad_obs,
+                            "PATH_WRFREF": path_wrfref,
+                            "PATH_GRIDRAD_SAVE": str(dir_nps),
+                        },
+                    )
+                )
+        if "stage4" in obs_types:
+            for date in dates:
+                workflow.add(
+                    Task(
+                        TaskKey("nps_stage4", None, None, None, date.strftime(fmt)),
+                        [
+                            python,
+                            dir_base / "verify/calc_stage4_nps.py",
+                            date.strftime(fmt),
+                        ],
+                        [],
+                        [dir_nps / f"stage4_{date.strftime(fmt)}.nc"],
+                        env={
+                            "PATH_STAGE4_OBS": args.path_stage4_obs,
+                            "PATH_WRFREF": path_wrfref,
+                            "PATH_STAGE4_SAVE": str(dir_nps),
+                        },
+                    )
+                )
+        if "practically_perfect" in obs_types:
+            # Practically perfect probabilities of the whole season are one batched run
+            # that writes every hour from the first to the last date
+            nseason = int((dates[-1] - dates[0]) / timedelta(hours=1)) + 1
+            season = [dates[0] + timedelta(hours=h) for h in range(nseason)]
+            workflow.add(
+                Task(
+                    TaskKey("nps_practically_perfect", None, None, None, None),
+                    [
+                        python,
+                        dir_base / "verify/calc_practically_perfect.py",
+                        *args.path_reports,
+                        "--date_start",
+                        dates[0].strftime(fmt),
+                        "--date_end",
+                        dates[-1].strftime(fmt),
+                    ],
+                    args.path_reports,
+                    [dir_nps / f"ppp_{date.strftime(fmt)}.nc" for date in season],
+                    env={"PATH_WRFREF": path_wrfref, "PATH_PPP_SAVE": str(dir_nps)},
+                )
+            )
+
+    if "verify" in args.stages:
+        for exp in args.experiments:
+            fcst = [
+                path
+                for init in inits
+                for h in hours
+                if h > 0
+                for path in post_files(exp, init, h)
+                if os.path.basename(path).startswith("convective")
+            ]
+            for pair in args.verify:
+                fcst_key, obs_key = pair.split(":")
+                obs = obs_files(observation_type(obs_key))
+                for radius_idx in args.radii:
+                    workflow.add(
+                        Task(
+                            TaskKey(
+                                f"verify_{fcst_key}_{obs_key}_r{radius_idx}",
+                                exp,
+                                None,
+                                None,
+                                None,
+                            ),
+                            [
+                                python,
+                                dir_base / "verify/verify_convective.py",
+                                exp,
+                                fcst_key,
+                                obs_key,
+                                radius_idx,
+                                dir_verif,
+                                "--init_start",
+                                args.init_start,
+                                "--init_end",
+                                args.init_end,
+                                "--init_freq",
+                                f"{args.init_freq}H",
+                                "--nhours",
+                                args.nhours,
+                                "--path_ref",
+                                args.path_ref,
+                                "--dir_post",
+                                dir_post,
+                                "--dir_obs",
+                                dir_nps,
+                            ],
+                            fcst + obs,
+                            [dir_verif / exp / f"{fcst_key}_r{radius_idx}.nc"],
+                        )
+                    )
+
+    return workflow
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the reduce, post, NPs, and verify pipeline for ensemble experiments"
+    )
+    parser.add_argument(
+        "experiments", type=str, nargs="+", help="Ensemble experiments to process"
+    )
+    parser.add_argument(
+        "--stages",
+        type=str,
+        nargs="+",
+        choices=["reduce", "post", "nps", "verify"],
+        default=["reduce", "post", "nps", "verify"],
+        help="Stages of the pipeline to run",
+    )
+    parser.add_argument(
+        "--init_start",
+        type=str,
+        default="2016042700",
+        help="First initialization date (YYYYMMDDHH)",
+    )
+    parser.add_argument(
+        "--init_end",
+        type=str,
+        default="2016060312",
+        help="Last initialization date (YYYYMMDDHH)",
+    )
+    parser.add_argument(
+        "--init_freq", type=int, default=12, help="Hours between initializations"
+    )
+    parser.add_argument(
+        "--nhours", type=int, default=48, help="Number of forecast hours"
+    )
+    parser.add_argument("--nmem", type=int, default=42, help="Number of members")
+    parser.add_argument("--domain", type=int, default=2, help="WRF domain to post")
+    parser.add_argument(
+        "--verify",
+        type=str,
+        nargs="+",
+        default=["nmep_reflectivity_40_0:col_max_refl_40"],
+        help="Forecast and observation keys to verify formatted as fcst_key:obs_key",
+    )
+    parser.add_argument(
+        "--radii",
+        type=int,
+        nargs="+",
+        default=[0, 1, 2],
+        help="Indices of neighborhood radii to verify",
+    )
+    parser.add_argument(
+        "--python", type=str, default=sys.executable, help="Python executable"
+    )
+    parser.add_argument(
+        "--dir_base",
+        type=str,
+        default=str(Path(__file__).resolve().parent),
+        help="Directory of this repository",
+    )
+    parser.add_argument(
+        "--dir_exp",
+        type=str,
+        default="/lustre/scratch/rmanser",
+        help="Parent directory of ensemble experiments",
+    )
+    parser.add_argument(
+        "--dir_post",
+        type=str,
+        default="/lustre/scratch/rmanser/wrf_post",
+        help="Parent directory of post-processed forecasts",
+    )
+    parser.add_argument(
+        "--dir_nps",
+        type=str,
+        default="/lustre/scratch/rmanser/gr_nps",
+        help="Directory of observed neighborhood probabilities",
+    )
+    parser.add_argument(
+        "--dir_verif",
+        type=str,
+        default="/lustre/scratch/rmanser/verif",
+        help="Directory of verification output",
+    )
+    parser.add_argument(
+        "--path_ref",
+        type=str,
+        default="/lustre/work/rmanser/wrfref/wrfoutREFd02",
+        help="WRF reference file",
+    )
+    parser.add_argument(
+        "--path_gridrad_obs",
+        type=str,
+        default="/lustre/work/rmanser/gridrad",
+        help="Directory of GridRad observations",
+    )
+    parser.add_argument(
+        "--path_stage4_obs",
+        type=str,
+        default="/lustre/work/rmanser/stage4",
+        help="Directory of Stage IV precipitation observations",
+    )
+    parser.add_argument(
+        "--path_reports",
+        type=str,
+        nargs="+",
+        default=[],
+        help="CSV files of storm reports for practically perfect probabilities",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=["local", "slurm"],
+        default="local",
+        help="Run tasks on a local process pool or submit them to SLURM",
+    )
+    parser.add_argument(
+        "--nprocs", type=int, default=1, help="Number of local tasks to run at once"
+    )
+    parser.add_argument(
+        "--partition", type=str, default="quanah", help="SLURM partition"
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help=(
+            "SQLite manifest of ensemble files (see manifest.py). If given, it is "
+            "updated and used to find stale tasks instead of checking each file"
+        ),
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Run all tasks even if they are up to date"
+    )
+    parser.add_argument(
+        "--dry_run", action="store_true", help="Only print tasks that would run"
+    )
+
+    args = parser.parse_args()
+    try:
+        obs_types = {observation_type(pair.split(":")[1]) for pair in args.verify}
+    except (IndexError, ValueError) as err:
+        parser.error(f"invalid --verify: {err}")
+    if "practically_perfect" in obs_types and not args.path_reports:
+        parser.error("--path_reports is required to verify practically perfect")
+
+    workflow = build_pipeline(args)
+
+    mtimes = None
+    if args.manifest is not None:
+        import manifest
+
+        with manifest.Manifest(args.manifest) as index:
+            index.update(args.dir_exp, only=args.experiments)
+            # Post-processed, NPs, and verification files are overwritten in place by
+            # to_netcdf, which does not change the modification time of their
+            # directories, so every file in those trees is re-stat'ed
+            for root in (args.dir_post, args.dir_verif):
+                index.update(root, only=args.experiments, full=True)
+            index.update(args.dir_nps, full=True)
+            mtimes = index.mtimes()
+
+    tasks = workflow.plan(force=args.force, mtimes=mtimes)
+    print(f"{len(tasks)} of {len(workflow.tasks)} tasks are stale")
+
+    if args.dry_run:
+        for task in tasks:
+            print(task)
+        sys.exit(0)
+
+    if args.backend == "slurm":
+        backend = SlurmBackend(partition=args.partition)
+    else:
+        backend = LocalBackend(nprocs=args.nprocs)
+
+    failed = backend.run(workflow, tasks)
+    if failed:
+        sys.exit(f"{len(failed)} tasks failed")